@@ -0,0 +1,335 @@
+"""Asynchronous batch driver for terrain and scenario jobs with overlapped file I/O."""
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from instrumentation import add_arguments, count, instrumented
+from rnd_extract_connections import DEFAULT_LANE_TYPES, save_extraction
+from rnd_pipeline import STAGES, run_pipeline
+from scenario_batch import get_job_output
+from scenario_generator import compile_configuration, merge_configuration, write_scenario
+from utils import parse_xml_source
+
+DEFAULT_IO_JOBS = 8
+
+# Per-worker cache of compiled configurations, keyed by content hash
+_patch_plans: Dict[str, Dict[str, Any]] = {}
+
+def get_terrain_job(
+    terrain_file: str,
+    output_dir: Optional[str] = None,
+    stages: List[str] = STAGES,
+    lane_types: List[str] = DEFAULT_LANE_TYPES,
+    output_format: str = "json"
+) -> Dict[str, Any]:
+    """
+    Build a terrain job with default output paths.
+
+    The terrain is written to the output directory under its own name, or over
+    the input without one, like rnd_pipeline.py. Extracted data is written next
+    to it with a .json/.npz extension.
+
+    Args:
+        terrain_file: Input .rnd file path
+        output_dir: Output directory (defaults to the input directory)
+        stages: Pipeline stages, see rnd_pipeline.run_pipeline()
+        lane_types: Lane types to extract lanes of
+        output_format: "json" or "npz" extracted data
+
+    Returns:
+        Terrain job
+    """
+    terrain_path = Path(terrain_file)
+    directory = Path(output_dir) if output_dir else terrain_path.parent
+    return {
+        "input": terrain_file,
+        "output": str(directory / terrain_path.name),
+        "extract_output": str(directory / f"{terrain_path.stem}.{output_format}"),
+        "stages": stages,
+        "lane_types": lane_types,
+        "format": output_format
+    }
+
+def load_manifest(manifest_file: str, output_dir: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Load batch jobs from a JSON manifest.
+
+    The manifest is a list of objects. Objects with a "config" key are merge
+    jobs with "input" and an optional "output", as for scenario_batch.py. The
+    others are terrain jobs with "input" and optional "output", "extract_output",
+    "stages", "lane_types" and "format", see get_terrain_job().
+
+    Args:
+        manifest_file: Manifest file path
+        output_dir: Output directory for jobs without explicit outputs
+
+    Returns:
+        List of jobs
+    """
+    with open(manifest_file, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    jobs = []
+    for entry in entries:
+        if "config" in entry:
+            jobs.append({
+                "config": entry["config"],
+                "input": entry["input"],
+                "output": entry.get("output") or get_job_output(entry["config"], entry["input"], output_dir)
+            })
+        else:
+            job = get_terrain_job(
+                entry["input"], output_dir, entry.get("stages", STAGES),
+                entry.get("lane_types", DEFAULT_LANE_TYPES), entry.get("format", "json")
+            )
+            job.update({key: entry[key] for key in ("output", "extract_output") if entry.get(key)})
+            jobs.append(job)
+
+    return jobs
+
+def get_job_inputs(job: Dict[str, Any]) -> List[str]:
+    """
+    Get the input files of a job.
+
+    Args:
+        job: Merge or terrain job
+
+    Returns:
+        Input file paths
+    """
+    return [job["config"], job["input"]] if "config" in job else [job["input"]]
+
+def run_job(job: Dict[str, Any], inputs: Dict[str, bytes]) -> Dict[str, Any]:
+    """
+    Run one job on input file contents, in a worker process.
+
+    Args:
+        job: Merge or terrain job
+        inputs: Input file path to content
+
+    Returns:
+        Dictionary with "outputs" (output file path to content), "stats" and
+        "seconds" of processing
+    """
+    start = time.perf_counter()
+    outputs = dict()
+
+    # Worker output is silenced, progress is reported by the event loop
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if "config" in job:
+            configuration = inputs[job["config"]]
+            key = hashlib.sha256(configuration).hexdigest()
+            plan = _patch_plans.get(key)
+            if plan is None:
+                plan = compile_configuration(parse_xml_source(configuration)[1])
+                _patch_plans[key] = plan
+
+            scenario_root, stats = merge_configuration(plan, inputs[job["input"]])
+            buffer = io.BytesIO()
+            write_scenario(scenario_root, buffer)
+            outputs[job["output"]] = buffer.getvalue()
+
+        else:
+            terrain, data = run_pipeline(inputs[job["input"]], None, job["stages"], job["lane_types"])
+            stats = dict()
+            if terrain is not None:
+                outputs[job["output"]] = terrain
+            if data is not None:
+                buffer = io.BytesIO()
+                save_extraction(data, buffer, job["format"])
+                outputs[job["extract_output"]] = buffer.getvalue()
+                stats["tracks"] = len(data)
+
+    return {"outputs": outputs, "stats": stats, "seconds": time.perf_counter() - start}
+
+def _write_output(file_path: str, content: bytes) -> None:
+    """Write an output file, creating its directory."""
+    output_path = Path(file_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_bytes(content)
+
+class _InputReads:
+    """
+    Input file reads shared by the jobs using the same file.
+
+    A file is read once while jobs that use it are running, and its content is
+    dropped when the last job using it is done.
+    """
+
+    def __init__(self, jobs: List[Dict[str, Any]], io_pool: ThreadPoolExecutor):
+        self.io_pool = io_pool
+        self.users = Counter(path for job in jobs for path in get_job_inputs(job))
+        self.reads: Dict[str, asyncio.Future] = {}
+
+    async def read(self, path: str) -> bytes:
+        read = self.reads.get(path)
+        if read is None:
+            read = asyncio.get_running_loop().run_in_executor(self.io_pool, Path(path).read_bytes)
+            self.reads[path] = read
+        return await read
+
+    def release(self, path: str) -> None:
+        self.users[path] -= 1
+        if self.users[path] == 0:
+            self.reads.pop(path, None)
+
+async def run_batch_async(
+    jobs: List[Dict[str, Any]],
+    workers: Optional[int] = None,
+    io_jobs: int = DEFAULT_IO_JOBS,
+    max_pending: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Run jobs with file reads and writes overlapping the processing.
+
+    Inputs are read and outputs written on a pool of I/O threads, while jobs
+    are processed on a pool of worker processes on the read content. At most
+    max_pending jobs are between reading their inputs and writing their
+    outputs, which bounds the memory held by file contents. Jobs start in input
+    order, so jobs sharing an input file read it once.
+
+    Args:
+        jobs: Merge and terrain jobs, see load_manifest()
+        workers: Number of worker processes (defaults to CPU count)
+        io_jobs: Number of concurrent file reads and writes
+        max_pending: Maximum number of jobs in progress (defaults to twice the workers)
+
+    Returns:
+        Job results, in job order, with "job", "seconds" (from reading inputs to
+        writing outputs), "stats" and "error"
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    loop = asyncio.get_running_loop()
+    pending = asyncio.Semaphore(max_pending)
+    finished = 0
+
+    print(f"Jobs: {len(jobs)}, workers: {workers}, I/O jobs: {io_jobs}, max pending: {max_pending}\n")
+
+    with ThreadPoolExecutor(max_workers=io_jobs) as io_pool, ProcessPoolExecutor(max_workers=workers) as process_pool:
+        input_reads = _InputReads(jobs, io_pool)
+
+        async def run(job: Dict[str, Any]) -> Dict[str, Any]:
+            nonlocal finished
+
+            async with pending:
+                start = time.perf_counter()
+                paths = get_job_inputs(job)
+                try:
+                    contents = await asyncio.gather(*(input_reads.read(path) for path in paths))
+                    count("bytes read", sum(len(content) for content in contents))
+
+                    processed = await loop.run_in_executor(process_pool, run_job, job, dict(zip(paths, contents)))
+                    del contents
+
+                    await asyncio.gather(*(
+                        loop.run_in_executor(io_pool, _write_output, path, content)
+                        for path, content in processed["outputs"].items()
+                    ))
+                    count("bytes written", sum(len(content) for content in processed["outputs"].values()))
+
+                    result = {"job": job, "seconds": time.perf_counter() - start, "stats": processed["stats"], "error": None}
+                except Exception as e:
+                    result = {"job": job, "seconds": time.perf_counter() - start, "stats": None, "error": f"{type(e).__name__}: {e}"}
+                finally:
+                    for path in paths:
+                        input_reads.release(path)
+
+            finished += 1
+            name = f"{job['config']} + {job['input']}" if "config" in job else job["input"]
+            if result["error"]:
+                print(f"[{finished}/{len(jobs)}] FAILED {name}: {result['error']}")
+            else:
+                print(f"[{finished}/{len(jobs)}] {name} ({result['seconds']:.2f}s)")
+            return result
+
+        return await asyncio.gather(*(run(job) for job in jobs))
+
+def run_batch(
+    jobs: List[Dict[str, Any]],
+    workers: Optional[int] = None,
+    io_jobs: int = DEFAULT_IO_JOBS,
+    max_pending: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Run jobs with overlapped file I/O and print a summary, see run_batch_async().
+
+    Args:
+        jobs: Merge and terrain jobs, see load_manifest()
+        workers: Number of worker processes (defaults to CPU count)
+        io_jobs: Number of concurrent file reads and writes
+        max_pending: Maximum number of jobs in progress (defaults to twice the workers)
+
+    Returns:
+        Job results, ordered by input
+    """
+    # Jobs on the same input follow each other, so its content is shared
+    jobs = sorted(jobs, key=lambda job: job["input"])
+
+    start = time.perf_counter()
+    results = asyncio.run(run_batch_async(jobs, workers, io_jobs, max_pending))
+    wall_time = time.perf_counter() - start
+
+    job_time = sum(result["seconds"] for result in results)
+    failed = sum(1 for result in results if result["error"])
+
+    # Summary
+    print(f"\nJobs succeeded: {len(results) - failed}")
+    print(f"Jobs failed: {failed}")
+    print(f"Total job time: {job_time:.2f}s")
+    print(f"Wall time: {wall_time:.2f}s")
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Run terrain and scenario jobs in parallel, with file reads and writes overlapping the processing.")
+    parser.add_argument("-m", "--manifest", required=False, type=str, help="JSON manifest with a list of merge and terrain jobs (used instead of the job arguments below).")
+    parser.add_argument("-c", "--configs", required=False, nargs='+', type=str, help="Configuration XML file paths, merged into every --inputs scenario.")
+    parser.add_argument("-i", "--inputs", required=False, nargs='+', type=str, help="Input scenario .sce file paths.")
+    parser.add_argument("-t", "--terrains", required=False, nargs='+', type=str, help="Input .rnd file paths to run the terrain pipeline on.")
+    parser.add_argument("-o", "--output_dir", required=False, type=str, help="Output directory (defaults to each input directory). Scenarios are named <input>_<config>.sce, terrains keep their name.")
+    parser.add_argument("--stages", required=False, nargs='+', choices=STAGES, default=STAGES, help="Terrain pipeline stages, in this order (default: all).")
+    parser.add_argument("--format", required=False, choices=["json", "npz"], default="json", help="Format of the extracted terrain data (default: json).")
+    parser.add_argument("--lane_types", required=False, nargs='+', type=str, help="List of lane types to extract (default: paved express, paved entry, paved, emergency).")
+    parser.add_argument("-j", "--jobs", required=False, type=int, help="Number of worker processes (defaults to CPU count).")
+    parser.add_argument("--io_jobs", required=False, type=int, default=DEFAULT_IO_JOBS, help=f"Number of concurrent file reads and writes (default: {DEFAULT_IO_JOBS}).")
+    parser.add_argument("--max_pending", required=False, type=int, help="Maximum number of jobs between reading inputs and writing outputs, bounds memory use (defaults to twice the worker processes).")
+    add_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.manifest:
+        jobs = load_manifest(args.manifest, args.output_dir)
+    else:
+        if bool(args.configs) != bool(args.inputs):
+            parser.error("--configs and --inputs are required together")
+        jobs = [
+            {"config": config, "input": scenario, "output": get_job_output(config, scenario, args.output_dir)}
+            for scenario in args.inputs or []
+            for config in args.configs or []
+        ]
+        lane_types = args.lane_types if args.lane_types else DEFAULT_LANE_TYPES
+        jobs.extend(get_terrain_job(terrain, args.output_dir, args.stages, lane_types, args.format) for terrain in args.terrains or [])
+
+    if not jobs:
+        parser.error("either --manifest, --configs with --inputs, or --terrains is required")
+
+    with instrumented("async_batch", args):
+        results = run_batch(jobs, args.jobs, args.io_jobs, args.max_pending)
+
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Benchmark the terrain and scenario scripts on synthetic inputs."""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmark_data import generate_scenario, generate_terrain
+
+REPORT_VERSION = 1
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+TOOLS = [
+    'rnd_extract_connections',
+    'rnd_import_fix',
+    'rnd_name_portions',
+    'scenario_set_initial_speed',
+    'scenario_generator'
+]
+
+def run_command(command: List[str]) -> Tuple[float, Optional[float]]:
+    """
+    Run a command and measure it.
+
+    Args:
+        command: Command line
+
+    Returns:
+        Tuple of (wall time in seconds, peak RSS in MB or None where it cannot be measured)
+
+    Raises:
+        RuntimeError: If the command fails
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    if hasattr(os, "wait4"):
+        # Resource usage of exactly this child, ru_maxrss is in KB on Linux and bytes on macOS
+        stderr = process.stderr.read()
+        _, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        _, stderr = process.communicate()
+        seconds = time.perf_counter() - start
+        peak_rss = None
+    process.stderr.close()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed with exit code {process.returncode}:\n{stderr.decode(errors='replace')}")
+
+    return seconds, peak_rss
+
+def get_tool_runs(work_dir: Path, terrain_file: str, scenario_file: str, configuration_file: str) -> Dict[str, Tuple[List[str], str]]:
+    """
+    Build the command line of every benchmarked tool.
+
+    Args:
+        work_dir: Directory for outputs
+        terrain_file: Input .rnd file path
+        scenario_file: Input .sce file path
+        configuration_file: Configuration .xml file path
+
+    Returns:
+        Dictionary mapping tool name to (command line, input file path)
+    """
+    def script(tool: str) -> List[str]:
+        return [sys.executable, str(SCRIPTS_DIR / f"{tool}.py")]
+
+    return {
+        'rnd_extract_connections': (script('rnd_extract_connections') + ["--input", terrain_file, "--output", str(work_dir / "extracted.json")], terrain_file),
+        'rnd_import_fix': (script('rnd_import_fix') + ["--input", terrain_file, "--output", str(work_dir / "fixed.rnd")], terrain_file),
+        'rnd_name_portions': (script('rnd_name_portions') + ["--input", terrain_file, "--output", str(work_dir / "named.rnd")], terrain_file),
+        'scenario_set_initial_speed': (script('scenario_set_initial_speed') + ["-i", scenario_file, "-o", str(work_dir / "initial_speed.sce"), "-s", "50"], scenario_file),
+        'scenario_generator': (script('scenario_generator') + ["-c", configuration_file, "-i", scenario_file, "-o", str(work_dir / "generated.sce"), "--no_plan_cache"], scenario_file),
+    }
+
+def run_benchmarks(parameters: Dict[str, Any], work_dir: Path, tools: List[str], repeat: int) -> Dict[str, Any]:
+    """
+    Generate the synthetic inputs and benchmark the tools on them.
+
+    Args:
+        parameters: Input sizes (tracks, portions, lanes, degree, subnetworks, vehicles, images)
+        work_dir: Directory for inputs and outputs
+        tools: Names of the tools to run
+        repeat: Number of runs per tool, the median wall time is reported
+
+    Returns:
+        Benchmark report
+    """
+    terrain_file = str(work_dir / "benchmark.rnd")
+    scenario_file = str(work_dir / "benchmark.sce")
+    configuration_file = str(work_dir / "configuration_benchmark.xml")
+
+    print("Generating inputs...")
+    terrain = generate_terrain(
+        terrain_file, parameters["tracks"], parameters["portions"], parameters["lanes"],
+        degree=parameters["degree"], subnetworks=parameters["subnetworks"]
+    )
+    scenario = generate_scenario(scenario_file, configuration_file, parameters["vehicles"], parameters["images"])
+    print(f"Terrain: {terrain['tracks']} tracks, {terrain['lanes']} lanes, {terrain['bytes'] / 1e6:.1f} MB")
+    print(f"Scenario: {scenario['vehicles']} vehicles, {scenario['images']} images, {scenario['bytes'] / 1e6:.1f} MB\n")
+
+    items = {
+        'rnd_extract_connections': ("tracks", terrain["tracks"]),
+        'rnd_import_fix': ("tracks", terrain["tracks"]),
+        'rnd_name_portions': ("tracks", terrain["tracks"]),
+        'scenario_set_initial_speed': ("vehicles", scenario["vehicles"]),
+        'scenario_generator': ("vehicles", scenario["vehicles"]),
+    }
+
+    results = dict()
+    tool_runs = get_tool_runs(work_dir, terrain_file, scenario_file, configuration_file)
+
+    for tool in tools:
+        command, input_file = tool_runs[tool]
+        measurements = [run_command(command) for _ in range(repeat)]
+        wall_time = statistics.median(seconds for seconds, _ in measurements)
+        peak_rss = max((rss for _, rss in measurements if rss is not None), default=None)
+        item_name, item_count = items[tool]
+        input_mb = os.path.getsize(input_file) / 1e6
+
+        results[tool] = {
+            "wall_time": round(wall_time, 4),
+            "wall_times": [round(seconds, 4) for seconds, _ in measurements],
+            "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+            "input_mb": round(input_mb, 2),
+            "mb_per_second": round(input_mb / wall_time, 2),
+            "items": item_name,
+            "items_per_second": round(item_count / wall_time, 1)
+        }
+
+        rss_text = f"{peak_rss:.1f} MB" if peak_rss is not None else "n/a"
+        print(f"{tool}: {wall_time:.2f}s, peak RSS {rss_text}, {item_count / wall_time:.0f} {item_name}/s, {input_mb / wall_time:.1f} MB/s")
+
+    return {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results
+    }
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compare a benchmark report with a baseline report.
+
+    Args:
+        report: Current benchmark report
+        baseline: Baseline benchmark report
+        tolerance: Allowed relative increase of wall time and peak RSS (0.2 = 20 %)
+
+    Returns:
+        List of regression descriptions
+    """
+    regressions = []
+
+    if report["parameters"] != baseline.get("parameters"):
+        print("Warning: baseline was run with different input sizes, results are not comparable")
+
+    print("\nComparison with baseline:")
+    for tool, result in report["results"].items():
+        baseline_result = baseline.get("results", {}).get(tool)
+        if baseline_result is None:
+            print(f"  {tool}: not in baseline")
+            continue
+
+        for metric, unit in (("wall_time", "s"), ("peak_rss_mb", " MB")):
+            value, baseline_value = result.get(metric), baseline_result.get(metric)
+            if value is None or not baseline_value:
+                continue
+            change = value / baseline_value - 1
+            regressed = change > tolerance
+            print(f"  {tool} {metric}: {baseline_value}{unit} -> {value}{unit} ({change:+.1%}){' REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{tool} {metric} {change:+.1%}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the terrain and scenario scripts on synthetic inputs.")
+    parser.add_argument("--tracks", required=False, type=int, default=5000, help="Number of terrain tracks (default: 5000).")
+    parser.add_argument("--portions", required=False, type=int, default=4, help="Number of portions per track (default: 4).")
+    parser.add_argument("--lanes", required=False, type=int, default=3, help="Number of lanes per portion (default: 3).")
+    parser.add_argument("--degree", required=False, type=int, default=3, help="Number of tracks per intersection node (default: 3).")
+    parser.add_argument("--subnetworks", required=False, type=int, default=1, help="Number of terrain SubNetworks (default: 1).")
+    parser.add_argument("--vehicles", required=False, type=int, default=5000, help="Number of scenario vehicles (default: 5000).")
+    parser.add_argument("--images", required=False, type=int, default=500, help="Number of scenario images (default: 500).")
+    parser.add_argument("--tools", required=False, nargs='+', choices=TOOLS, default=TOOLS, help="Tools to benchmark (default: all).")
+    parser.add_argument("--repeat", required=False, type=int, default=3, help="Runs per tool, the median wall time is reported (default: 3).")
+    parser.add_argument("--work_dir", required=False, type=str, help="Directory for generated inputs and outputs (defaults to a temporary directory).")
+    parser.add_argument("--report", required=False, type=str, help="Output JSON report file path.")
+    parser.add_argument("--baseline", required=False, type=str, help="Baseline JSON report to compare with. Exits with status 1 on regressions.")
+    parser.add_argument("--tolerance", required=False, type=float, default=0.2, help="Allowed relative increase of wall time and peak RSS over the baseline (default: 0.2).")
+    args = parser.parse_args()
+
+    parameters = {
+        "tracks": args.tracks,
+        "portions": args.portions,
+        "lanes": args.lanes,
+        "degree": args.degree,
+        "subnetworks": args.subnetworks,
+        "vehicles": args.vehicles,
+        "images": args.images
+    }
+
+    with tempfile.TemporaryDirectory(prefix="scaner-utils-benchmark-") as temp_dir:
+        work_dir = Path(args.work_dir) if args.work_dir else Path(temp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        report = run_benchmarks(parameters, work_dir, args.tools, args.repeat)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved to: {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
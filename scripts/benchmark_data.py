@@ -0,0 +1,185 @@
+"""Synthetic Terrain (.rnd), scenario (.sce) and configuration files for benchmarks."""
+
+import random
+from pathlib import Path
+from typing import Dict
+
+LANE_TYPES = ['paved', 'paved express', 'paved entry', 'emergency', 'sidewalk', 'bike']
+VEHICLE_CATEGORIES = ['car', 'truck', 'bus', 'motorcycle']
+CIRCULATION_WAYS = ['forward', 'backward']
+
+def generate_terrain(
+    file_path: str,
+    tracks: int,
+    portions: int,
+    lanes: int,
+    degree: int = 3,
+    subnetworks: int = 1,
+    intersections: int = 10,
+    seed: int = 0
+) -> Dict[str, int]:
+    """
+    Write a synthetic Terrain (.rnd) file with the layout SCANeR uses.
+
+    Track start/end nodes are drawn so that every node joins about degree
+    tracks. Every portion gets lanes lanes with random type, circulation way,
+    speed limit and vehicle categories, separated by lanes + 1 lane borders.
+    Intersections get banned links for rnd_import_fix.py to remove.
+
+    Args:
+        file_path: Output .rnd file path
+        tracks: Number of tracks
+        portions: Number of portions per track
+        lanes: Number of lanes per portion
+        degree: Number of tracks per intersection node
+        subnetworks: Number of SubNetworks the tracks are split over
+        intersections: Number of Intersection elements per SubNetwork
+        seed: Random seed
+
+    Returns:
+        Dictionary with the number of tracks, portions, lanes and bytes written
+    """
+    rng = random.Random(seed)
+
+    # Every track has two endpoint slots, degree slots share a node
+    slots = list(range(2 * tracks))
+    rng.shuffle(slots)
+    nodes = [f"Node_{slot // max(1, degree)}" for slot in slots]
+
+    output_path = Path(file_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(output_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<Terrain version="1">\n  <Header author="benchmark"/>\n  <Network>\n    <SubNetworks>\n')
+        track_id = 0
+
+        for subnetwork in range(subnetworks):
+            f.write(f'      <SubNetwork name="SubNetwork_{subnetwork}">\n        <RoadNetwork>\n          <Tracks>\n')
+            subnetwork_tracks = tracks // subnetworks + (1 if subnetwork < tracks % subnetworks else 0)
+
+            for _ in range(subnetwork_tracks):
+                f.write(
+                    f'            <Track name="Track_{track_id}" startNode="{nodes[2 * track_id]}" endNode="{nodes[2 * track_id + 1]}">\n'
+                    '              <Portions>\n'
+                )
+                track_id += 1
+                end_distance = 0.0
+
+                for _ in range(portions):
+                    end_distance += rng.uniform(5, 200)
+                    border_distance = -rng.uniform(0, 5)
+                    f.write(
+                        f'                <Portion endDistance="{end_distance:.4f}" name="">\n'
+                        '                  <Profile>\n'
+                        f'                    <LaneBorder distance="{border_distance:.3f}"/>\n'
+                    )
+                    for _ in range(lanes):
+                        categories = ",".join(rng.sample(VEHICLE_CATEGORIES, rng.randint(1, len(VEHICLE_CATEGORIES))))
+                        border_distance += rng.uniform(2.5, 4)
+                        f.write(
+                            f'                    <Lane type="{rng.choice(LANE_TYPES)}" circulationWay="{rng.choice(CIRCULATION_WAYS)}" '
+                            f'speedLimit="{rng.uniform(5, 40):.4f}" name="">\n'
+                            f'                      <VehicleType categories="{categories}"/>\n'
+                            '                    </Lane>\n'
+                            f'                    <LaneBorder distance="{border_distance:.3f}"/>\n'
+                        )
+                    f.write('                  </Profile>\n                </Portion>\n')
+
+                f.write('              </Portions>\n            </Track>\n')
+
+            f.write('          </Tracks>\n          <Intersections>\n')
+            for intersection in range(intersections):
+                f.write(
+                    f'            <Intersection name="Intersection_{subnetwork}_{intersection}">\n'
+                    '              <BannedLinks>\n'
+                    '                <LanePair a="1" b="2"/>\n'
+                    '                <LanePair a="2" b="1"/>\n'
+                    '              </BannedLinks>\n'
+                    '            </Intersection>\n'
+                )
+            f.write('          </Intersections>\n        </RoadNetwork>\n      </SubNetwork>\n')
+
+        f.write('    </SubNetworks>\n  </Network>\n</Terrain>\n')
+
+    return {
+        "tracks": tracks,
+        "portions": tracks * portions,
+        "lanes": tracks * portions * lanes,
+        "bytes": output_path.stat().st_size
+    }
+
+def generate_scenario(
+    scenario_file: str,
+    configuration_file: str,
+    vehicles: int,
+    images: int,
+    swarm_share: float = 0.5,
+    seed: int = 0
+) -> Dict[str, int]:
+    """
+    Write a synthetic scenario (.sce) and a configuration that updates every element of it.
+
+    Vehicles with a '[' in their name are swarm vehicles. The configuration
+    sets the path of every Image and the modelName and initialSpeed of every
+    Vehicle, matched by name.
+
+    Args:
+        scenario_file: Output .sce file path
+        configuration_file: Output configuration .xml file path
+        vehicles: Number of Vehicle elements
+        images: Number of Image elements
+        swarm_share: Share of swarm vehicles
+        seed: Random seed
+
+    Returns:
+        Dictionary with the number of vehicles, images and scenario bytes written
+    """
+    rng = random.Random(seed)
+    vehicle_names = [
+        f"[Swarm] Vehicle_{vehicle}" if rng.random() < swarm_share else f"Vehicle_{vehicle}"
+        for vehicle in range(vehicles)
+    ]
+
+    for file_path in (scenario_file, configuration_file):
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+
+    with open(scenario_file, "w", encoding="utf-8", newline="\n") as scenario, \
+         open(configuration_file, "w", encoding="utf-8", newline="\n") as configuration:
+        scenario.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>\n'
+            '<sce xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="2024.1">\n'
+            '    <Scenario>\n'
+            '        <Ground>\n            <name>benchmark.rnd</name>\n            <Simple/>\n        </Ground>\n'
+        )
+        configuration.write('<sce>\n    <Scenario>\n        <Ground>\n            <name>benchmark_generated.rnd</name>\n        </Ground>\n')
+
+        for image in range(images):
+            scenario.write(
+                f'        <Image>\n            <name>Image_{image}</name>\n            <path>instructions/image_{image}.png</path>\n'
+                '            <UserDataList/>\n        </Image>\n'
+            )
+            configuration.write(
+                f'        <Image>\n            <name>Image_{image}</name>\n            <path>instructions/generated/image_{image}.png</path>\n        </Image>\n'
+            )
+
+        for vehicle, vehicle_name in enumerate(vehicle_names):
+            scenario.write(
+                f'        <Vehicle>\n            <name>{vehicle_name}</name>\n            <id>{vehicle}</id>\n'
+                f'            <modelName>Model_{rng.randrange(10)}</modelName>\n'
+                f'            <initialSpeed>{rng.uniform(0, 30):.3f}</initialSpeed>\n'
+                '            <Model/>\n            <CustomData></CustomData>\n        </Vehicle>\n'
+            )
+            configuration.write(
+                f'        <Vehicle>\n            <name>{vehicle_name}</name>\n'
+                f'            <modelName>Model_{rng.randrange(10)}</modelName>\n'
+                f'            <initialSpeed>{rng.uniform(0, 30):.3f}</initialSpeed>\n        </Vehicle>\n'
+            )
+
+        scenario.write('    </Scenario>\n</sce>\n')
+        configuration.write('    </Scenario>\n</sce>\n')
+
+    return {
+        "vehicles": vehicles,
+        "images": images,
+        "bytes": Path(scenario_file).stat().st_size
+    }
@@ -0,0 +1,267 @@
+"""Phase timers, counters and profiling hooks shared by the scripts."""
+
+from collections import Counter
+from contextlib import contextmanager
+import argparse
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from lxml import etree
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+class _State:
+    """Measurements of the current instrumented run."""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, float] = {}
+        self.phase_calls: Counter = Counter()
+        self.counters: Counter = Counter()
+        self.lxml_calls: Counter = Counter()
+        self.stack: List[str] = []
+
+_state = _State()
+
+def is_enabled() -> bool:
+    """Check whether measurements are being recorded."""
+    return _state.enabled
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Time a phase of the work. Nested phases are recorded as parent/child.
+
+    Does nothing unless instrumentation is enabled.
+
+    Args:
+        name: Phase name, e.g. "parse", "index", "transform", "serialize"
+    """
+    if not _state.enabled:
+        yield
+        return
+
+    _state.stack.append(name)
+    path = "/".join(_state.stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _state.phases[path] = _state.phases.get(path, 0.0) + time.perf_counter() - start
+        _state.phase_calls[path] += 1
+        _state.stack.pop()
+
+def timed(name: str, function: Callable) -> Callable:
+    """
+    Wrap a function so that its calls are timed as a phase, see phase().
+
+    Returns the function itself unless instrumentation is enabled, so hot
+    loops pay nothing when it is off.
+
+    Args:
+        name: Phase name
+        function: Function to time
+
+    Returns:
+        Function to call instead
+    """
+    if not _state.enabled:
+        return function
+
+    def timed_function(*args, **kwargs):
+        with phase(name):
+            return function(*args, **kwargs)
+
+    return timed_function
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Increase a counter, e.g. elements visited. Does nothing unless instrumentation is enabled.
+
+    Args:
+        name: Counter name
+        value: Amount to add
+    """
+    if _state.enabled:
+        _state.counters[name] += value
+
+def get_peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process in MB, None where it cannot be measured."""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class _StackSampler(threading.Thread):
+    """Samples the main thread's Python stack at a fixed interval into folded stack counts."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread_id = threading.main_thread().ident
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+class _CountingElement(etree.ElementBase):
+    """
+    Element class counting the lookup calls made on it.
+
+    lxml methods are compiled and not seen by cProfile, so while measuring,
+    parsed elements are created as this class instead (see instrumented()).
+    """
+
+    def find(self, *args, **kwargs):
+        _state.lxml_calls["find"] += 1
+        return super().find(*args, **kwargs)
+
+    def findall(self, *args, **kwargs):
+        _state.lxml_calls["findall"] += 1
+        return super().findall(*args, **kwargs)
+
+    def findtext(self, *args, **kwargs):
+        _state.lxml_calls["findtext"] += 1
+        return super().findtext(*args, **kwargs)
+
+    def iterfind(self, *args, **kwargs):
+        _state.lxml_calls["iterfind"] += 1
+        return super().iterfind(*args, **kwargs)
+
+    def xpath(self, *args, **kwargs):
+        _state.lxml_calls["xpath"] += 1
+        return super().xpath(*args, **kwargs)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the --stats_json, --profile and --profile_format arguments to a script's parser.
+
+    Args:
+        parser: Argument parser of the script
+    """
+    parser.add_argument("--stats_json", required=False, type=str, help="Write phase timings, counters and peak memory to this JSON file.")
+    parser.add_argument("--profile", required=False, type=str, help="Write a profile of the run to this file (see --profile_format).")
+    parser.add_argument("--profile_format", required=False, choices=["cprofile", "folded"], default="cprofile", help="Profile format: cprofile (pstats file) or folded (sampled stacks for flame graph tools). Default: cprofile")
+
+@contextmanager
+def instrumented(tool: str, args: argparse.Namespace) -> Iterator[None]:
+    """
+    Record measurements of a script run according to its instrumentation arguments.
+
+    Without --stats_json and --profile nothing is recorded. Otherwise phase
+    times, counters, lxml lookup calls and peak memory are printed at the end
+    and written to --stats_json, and the profile to --profile.
+
+    Counting lxml calls routes element lookups through Python, which makes
+    lookup heavy code somewhat slower while measuring.
+
+    Args:
+        tool: Script name for the report
+        args: Parsed arguments, see add_arguments()
+    """
+    stats_json = getattr(args, "stats_json", None)
+    profile = getattr(args, "profile", None)
+    profile_format = getattr(args, "profile_format", "cprofile")
+
+    if not stats_json and not profile:
+        yield
+        return
+
+    global _state
+    _state = _State()
+    _state.enabled = True
+
+    profiler = cProfile.Profile() if profile and profile_format == "cprofile" else None
+    sampler = _StackSampler(DEFAULT_SAMPLE_INTERVAL) if profile and profile_format == "folded" else None
+
+    etree.set_element_class_lookup(etree.ElementDefaultClassLookup(element=_CountingElement))
+
+    start = time.perf_counter()
+    if sampler is not None:
+        sampler.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if sampler is not None:
+            sampler.stop()
+        wall_time = time.perf_counter() - start
+        _state.enabled = False
+        etree.set_element_class_lookup()
+
+        report: Dict[str, Any] = {
+            "tool": tool,
+            "wall_time": wall_time,
+            "phases": {name: {"seconds": seconds, "calls": _state.phase_calls[name]} for name, seconds in sorted(_state.phases.items())},
+            "counters": dict(_state.counters),
+            "lxml_calls": dict(_state.lxml_calls),
+            "peak_rss_mb": get_peak_rss_mb()
+        }
+
+        if profiler is not None:
+            profiler.dump_stats(profile)
+        if sampler is not None:
+            with open(profile, "w", encoding="utf-8") as f:
+                for stack, samples in sampler.stacks.items():
+                    f.write(f"{stack} {samples}\n")
+
+        print_report(report)
+        if profile:
+            print(f"Profile saved to: {profile}")
+        if stats_json:
+            with open(stats_json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Stats saved to: {stats_json}")
+
+def print_report(report: Dict[str, Any]) -> None:
+    """
+    Print an instrumentation report.
+
+    Args:
+        report: Report built by instrumented()
+    """
+    print(f"\n{report['tool']}: {report['wall_time']:.3f}s")
+    if report["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+    if report["phases"]:
+        print("\nPhases:")
+        for name, phase_stats in report["phases"].items():
+            print(f"- {name}: {phase_stats['seconds']:.3f}s ({phase_stats['calls']}x)")
+
+    if report["counters"]:
+        print("\nCounters:")
+        for name, value in sorted(report["counters"].items()):
+            print(f"- {name}: {value}")
+
+    if report["lxml_calls"]:
+        print("\nlxml calls:")
+        for name, value in sorted(report["lxml_calls"].items()):
+            print(f"- {name}: {value}")
@@ -0,0 +1,240 @@
+"""Lane position index of extracted terrain data, for spawn point and lane lookups by bisection."""
+
+import mmap
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from terrain_columns import COLUMNS_VERSION, TerrainColumns, build_columns, map_npz_members
+
+POSITIONS_VERSION = 1
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("numpy is required for the lane position index (pip install numpy)")
+
+def build_position_index(data: Dict[str, Any]) -> Dict[str, "np.ndarray"]:
+    """
+    Build the lane position index of extracted terrain data.
+
+    The index holds the columns of terrain_columns.build_columns() and:
+
+    - portion_start: Start distance of every portion on its track, the end
+      distance is portion_abscissa. Both are sorted within a track
+    - lane_portion: Portion row of every lane
+    - type_offsets, type_lanes: Lane rows by lane type. Lanes of lane type code
+      t are type_lanes[type_offsets[t]:type_offsets[t + 1]], in document order
+    - type_cumulative_length: Portion lengths of those lanes summed up in the
+      same order, for sampling positions by length
+
+    Args:
+        data: Extracted data as written to JSON by rnd_extract_connections.py
+
+    Returns:
+        Dictionary mapping column name to array
+    """
+    _require_numpy()
+
+    columns = build_columns(data)
+    portion_offsets = columns["portion_offsets"]
+    portion_end = columns["portion_abscissa"]
+    lane_offsets = columns["lane_offsets"]
+    lane_type = columns["lane_type"]
+
+    # A portion starts where the previous portion of its track ends
+    portion_start = np.empty_like(portion_end)
+    portion_start[1:] = portion_end[:-1]
+    track_starts = portion_offsets[:-1][portion_offsets[:-1] < len(portion_end)]
+    portion_start[track_starts] = 0.0
+
+    lane_portion = np.repeat(np.arange(len(portion_end), dtype=np.int64), np.diff(lane_offsets))
+
+    type_lanes = np.argsort(lane_type, kind='stable').astype(np.int64)
+    type_offsets = np.searchsorted(lane_type[type_lanes], np.arange(len(columns["lane_type_names"]) + 1)).astype(np.int64)
+    lane_length = portion_end[lane_portion] - portion_start[lane_portion]
+    type_cumulative_length = np.empty(len(type_lanes), dtype=np.float64)
+    for start, end in zip(type_offsets[:-1], type_offsets[1:]):
+        type_cumulative_length[start:end] = np.cumsum(lane_length[type_lanes[start:end]])
+
+    columns.update({
+        "positions_version": np.array([POSITIONS_VERSION], dtype=np.int64),
+        "portion_start": portion_start,
+        "lane_portion": lane_portion,
+        "type_offsets": type_offsets,
+        "type_lanes": type_lanes,
+        "type_cumulative_length": type_cumulative_length
+    })
+    return columns
+
+def save_position_index(data: Dict[str, Any], file_path: str) -> None:
+    """
+    Save the lane position index of extracted terrain data as an uncompressed .npz file.
+
+    Args:
+        data: Extracted data as written to JSON by rnd_extract_connections.py
+        file_path: Output .npz file path
+    """
+    columns = build_position_index(data)
+    output_path = Path(file_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(output_path, "wb") as f:
+        np.savez(f, **columns)
+
+class LanePositionIndex(TerrainColumns):
+    """
+    Lane lookups by track position and spawn position sampling by lane type.
+
+    Every lookup is a bisection on sorted columns, see build_position_index()
+    for the layout. Lanes are rows into the lane_* columns, positions are
+    (track name, portion row, lane row, abscissa on the track).
+    """
+
+    def __init__(self, columns: Dict[str, "np.ndarray"]):
+        super().__init__(columns)
+        self.lane_type_codes: Dict[str, int] = {str(name): code for code, name in enumerate(columns["lane_type_names"])}
+
+    def portion_at(self, track_name: str, abscissa: float) -> Optional[int]:
+        """
+        Get the portion of a track at a distance from its start.
+
+        Args:
+            track_name: Track name
+            abscissa: Distance from the track start
+
+        Returns:
+            Portion row, None if the abscissa is not on the track
+        """
+        portions = self.track_portions(track_name)
+        portion_end = self.columns["portion_abscissa"][portions]
+        if not len(portion_end) or abscissa < 0 or abscissa > portion_end[-1]:
+            return None
+
+        # A portion covers [start, end), the track end belongs to the last portion
+        return portions.start + min(int(np.searchsorted(portion_end, abscissa, side='right')), len(portion_end) - 1)
+
+    def lanes_at(self, track_name: str, abscissa: float, lane_type: Optional[str] = None) -> List[int]:
+        """
+        Get the lanes of a track at a distance from its start.
+
+        Args:
+            track_name: Track name
+            abscissa: Distance from the track start
+            lane_type: Only lanes of this type
+
+        Returns:
+            Lane rows, empty if the abscissa is not on the track
+        """
+        portion = self.portion_at(track_name, abscissa)
+        if portion is None:
+            return []
+
+        lanes = range(*self.portion_lanes(portion).indices(len(self.columns["lane_type"])))
+        if lane_type is None:
+            return list(lanes)
+
+        code = self.lane_type_codes.get(lane_type)
+        return [lane for lane in lanes if self.columns["lane_type"][lane] == code]
+
+    def type_lanes(self, lane_type: str) -> "np.ndarray":
+        """
+        Get all lanes of a lane type.
+
+        Args:
+            lane_type: Lane type
+
+        Returns:
+            Lane rows in document order
+        """
+        code = self.lane_type_codes.get(lane_type)
+        if code is None:
+            return self.columns["type_lanes"][:0]
+
+        offsets = self.columns["type_offsets"]
+        return self.columns["type_lanes"][offsets[code]:offsets[code + 1]]
+
+    def type_length(self, lane_type: str) -> float:
+        """
+        Get the total length of the lanes of a lane type.
+
+        Args:
+            lane_type: Lane type
+
+        Returns:
+            Sum of the lengths of its lanes
+        """
+        code = self.lane_type_codes.get(lane_type)
+        if code is None:
+            return 0.0
+
+        offsets = self.columns["type_offsets"]
+        if offsets[code] == offsets[code + 1]:
+            return 0.0
+        return float(self.columns["type_cumulative_length"][offsets[code + 1] - 1])
+
+    def sample_position(self, lane_type: str, fraction: float) -> Optional[Tuple[str, int, int, float]]:
+        """
+        Map a fraction of the total lane length of a lane type to a position.
+
+        Uniform random fractions give spawn positions spread evenly over the
+        length of those lanes.
+
+        Args:
+            lane_type: Lane type
+            fraction: Value in [0, 1)
+
+        Returns:
+            Tuple of (track name, portion row, lane row, abscissa on the track),
+            None if there are no lanes of the type
+        """
+        code = self.lane_type_codes.get(lane_type)
+        if code is None:
+            return None
+
+        c = self.columns
+        start, end = int(c["type_offsets"][code]), int(c["type_offsets"][code + 1])
+        if start == end:
+            return None
+
+        cumulative_length = c["type_cumulative_length"][start:end]
+        distance = min(max(fraction, 0.0), 1.0) * float(cumulative_length[-1])
+        entry = min(int(np.searchsorted(cumulative_length, distance, side='right')), end - start - 1)
+
+        lane = int(c["type_lanes"][start + entry])
+        portion = int(c["lane_portion"][lane])
+        portion_start = float(c["portion_start"][portion])
+        entry_start = float(cumulative_length[entry - 1]) if entry else 0.0
+        abscissa = min(portion_start + distance - entry_start, float(c["portion_abscissa"][portion]))
+
+        track_id = int(np.searchsorted(c["portion_offsets"], portion, side='right')) - 1
+        return str(c["track_names"][track_id]), portion, lane, abscissa
+
+def load_position_index(file_path: str) -> LanePositionIndex:
+    """
+    Load a lane position index written by save_position_index().
+
+    The file is memory-mapped, every column is a read-only view into it.
+
+    Args:
+        file_path: Input .npz file path
+
+    Returns:
+        LanePositionIndex instance
+
+    Raises:
+        ValueError: If the file has an unsupported format version
+    """
+    _require_numpy()
+
+    with open(file_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    columns = map_npz_members(buffer, file_path)
+
+    if "positions_version" not in columns or int(columns["positions_version"][0]) != POSITIONS_VERSION or int(columns["version"][0]) != COLUMNS_VERSION:
+        raise ValueError(f"Unsupported lane position index version in {file_path}")
+
+    return LanePositionIndex(columns)
@@ -1,110 +1,583 @@
-from lxml import etree
+from concurrent.futures import ProcessPoolExecutor
 import argparse
+import hashlib
 import json
+import os
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from lxml import etree
+
+from instrumentation import add_arguments, count, instrumented, phase, timed
+from lane_positions import save_position_index
+from road_graph import RoadGraph, get_track_endpoints
+from road_routing import RoutingIndex, save_routing_index
+from rnd_stream import batch_track_ranges, iter_track_range, iter_tracks, scan_track_ranges
+from terrain_columns import load_columns, save_columns
+from terrain_geometry import GeometryBatch
+from terrain_model import DEFAULT_MODEL_CACHE_DIR, TerrainModel, Track, load_terrain_model
+
+TRACK_HASHES_VERSION = 1
+
+DEFAULT_LANE_TYPES = [
+    'paved express',
+    'paved entry',
+    'paved',
+    'emergency'
+    ]
 
-def get_intersections(tracks):
-    intersections = dict()
+def get_track_hash(track: etree._Element) -> str:
+    """
+    Hash the XML content of a track.
 
-    for track in tracks:
-        track_name = track.attrib['name']        
-        track_intersections = [track.attrib['startNode'], track.attrib['endNode']]
+    Args:
+        track: Track element
 
-        for intersection in track_intersections:
-            if not intersection:
-                continue
-            if intersection not in intersections:
-                intersections[intersection] = []
-            intersections[intersection].append(track_name)
-                    
-    return intersections
+    Returns:
+        SHA-256 hex digest of the serialized track
+    """
+    return hashlib.sha256(etree.tostring(track, with_tail=False)).hexdigest()
 
-def get_connected_tracks(track, intersections):
-    connected_tracks = set()
-    for intersection_tracks in intersections.values():
-        if track in intersection_tracks:
-            connected_tracks.update(intersection_tracks)
-    connected_tracks.discard(track)
+def get_track_hashes_file(output_file: str) -> str:
+    """Path of the track hash file stored next to an extraction output."""
+    return f"{output_file}.hashes.json"
 
-    return list(connected_tracks)
+def load_previous_extraction(output_file: str, lane_types: list, vehicle_categories: Optional[list] = None) -> Optional[Tuple[Dict[str, Any], Dict[str, str]]]:
+    """
+    Load the output and track hashes of a previous extraction run.
 
+    Args:
+        output_file: Output .json/.npz file path of the previous run
+        lane_types: Lane types of the current run
+        vehicle_categories: Vehicle category filter of the current run
 
-def main():
+    Returns:
+        Tuple of (extracted data, track name to hash mapping), or None if there
+        is no usable previous run (missing files, other version, lane types or
+        vehicle categories)
+    """
+    hashes_file = get_track_hashes_file(output_file)
+    if not os.path.exists(output_file) or not os.path.exists(hashes_file):
+        return None
 
-    tree = etree.parse(input)
-    root = tree.getroot()
+    with open(hashes_file, encoding="utf-8") as f:
+        hashes = json.load(f)
+    if hashes.get("version") != TRACK_HASHES_VERSION or hashes.get("lane_types") != list(lane_types):
+        return None
+    if hashes.get("vehicle_categories") != (list(vehicle_categories) if vehicle_categories is not None else None):
+        return None
 
-    tracks = root.findall('Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/Track')
-    intersections = get_intersections(tracks)
+    if output_file.endswith(".npz"):
+        data = load_columns(output_file).to_dict()
+    else:
+        with open(output_file, encoding="utf-8") as f:
+            data = json.load(f)
 
-    data = dict()
-    portion_id = 0
+    return data, hashes["tracks"]
 
-    for track in tracks:
+def save_track_hashes(output_file: str, lane_types: list, track_hashes: Dict[str, str], vehicle_categories: Optional[list] = None) -> None:
+    """
+    Save the track hashes of an extraction run next to its output.
 
+    Args:
+        output_file: Output .json/.npz file path
+        lane_types: Lane types of the run
+        track_hashes: Track name to hash mapping
+        vehicle_categories: Vehicle category filter of the run
+    """
+    hashes = {"version": TRACK_HASHES_VERSION, "lane_types": list(lane_types), "tracks": track_hashes}
+    if vehicle_categories is not None:
+        hashes["vehicle_categories"] = list(vehicle_categories)
+
+    with open(get_track_hashes_file(output_file), "w", encoding="utf-8") as f:
+        json.dump(hashes, f)
+
+class ConnectionExtractor:
+    """
+    Track data extraction, fed one track at a time.
+
+    Tracks are passed to add_track() in document order and can be released
+    afterwards, only extracted data is kept. Numeric attributes are collected
+    raw and computed for the whole file in result(), together with connectivity.
+    """
+
+    def __init__(
+        self,
+        lane_types: Iterable[str] = DEFAULT_LANE_TYPES,
+        previous: Optional[Tuple[Dict[str, Any], Dict[str, str]]] = None,
+        track_hashes: Optional[Dict[str, str]] = None,
+        vehicle_categories: Optional[Iterable[str]] = None
+    ):
+        """
+        Args:
+            lane_types: Lane types to extract lanes of
+            previous: Result of a previous run as returned by load_previous_extraction().
+                Tracks with an unchanged hash are copied from it instead of being extracted
+            track_hashes: Dictionary that is filled with the track hashes, see
+                get_track_hash(). Required for previous to take effect
+            vehicle_categories: Only extract lanes open to at least one of these
+                vehicle categories, all lanes of the lane types if None
+        """
+        self.lane_types = set(lane_types)
+        self.vehicle_categories = set(vehicle_categories) if vehicle_categories is not None else None
+        # VehicleType categories attribute -> (categories, whether the lane passes the filter),
+        # terrains repeat a few category combinations on every lane
+        self.categories_cache: Dict[str, Tuple[Tuple[str, ...], bool]] = dict()
+        self.track_hashes = track_hashes
+        self.data = dict()
+        self.track_endpoints = []
+        self.portion_id = 0
+        # Entries whose numbers are filled in from the geometry batch, in row order
+        self.geometry = GeometryBatch()
+        self.track_entries, self.portion_entries, self.lane_entries = [], [], []
+
+        # Unchanged tracks are copied from the previous run. Re-extracted tracks keep
+        # their previous portion ids, new portions are numbered after all previous ones.
+        self.previous_data, self.previous_hashes = previous if previous else ({}, {})
+        if self.previous_data:
+            self.portion_id = 1 + max((int(key) for track_data in self.previous_data.values() for key in track_data["portions"]), default=-1)
+
+    def add_track(self, track: etree._Element) -> None:
+        """
+        Extract a track.
+
+        Args:
+            track: Track element
+        """
         track_name = track.attrib['name']
-        track_length = 0
-        portions = track.findall('Portions/Portion')
-        connected_tracks = get_connected_tracks(track_name, intersections)
+        self.track_endpoints.append(get_track_endpoints(track))
+
+        if self.track_hashes is not None:
+            self.track_hashes[track_name] = get_track_hash(track)
+            if track_name in self.previous_data and self.previous_hashes.get(track_name) == self.track_hashes[track_name]:
+                self.data[track_name] = self.previous_data[track_name]
+                count("tracks reused")
+                return
 
-        last_portion_abscissa = 0
+        previous_portion_ids = self._previous_portion_ids(track_name)
+        geometry = self.geometry
+        lane_types = self.lane_types
+        geometry.add_track()
         portions_data = dict()
-        
-        for portion in portions:
-            portion_enddistance = float(portion.attrib['endDistance'])
-            portion_length = portion_enddistance - last_portion_abscissa
-            last_portion_abscissa = portion_enddistance
-            track_length += portion_length
 
-            portion_lanes = portion.find('Profile').findall('Lane')
-            portion_laneborder_distances = [float(laneborder.attrib['distance']) for laneborder in portion.find('Profile').findall('LaneBorder')]
+        for portion in track.iterfind('Portions/Portion'):
+            profile = portion.find('Profile')
+
+            lanes = dict()
+            speed_limits = []
+            for l, lane in enumerate(profile.iterfind('Lane')):
+                lane_attrib = lane.attrib
+                if lane_attrib['type'] not in lane_types:
+                    continue
+                vehicle_types = self._filter_categories(lane.find('VehicleType').attrib['categories'])
+                if vehicle_types is None:
+                    continue
+                lanes[l] = {
+                    "type": lane_attrib['type'],
+                    "vehicle_types" : vehicle_types,
+                    "circulationWay": lane_attrib['circulationWay'],
+                    "speedLimit": None,
+                    "center": None
+                }
+                speed_limits.append(lane_attrib['speedLimit'])
+
+            # Lane borders are only needed for the centers of extracted lanes
+            geometry.add_portion(
+                portion.attrib['endDistance'],
+                [laneborder.attrib['distance'] for laneborder in profile.iterfind('LaneBorder')] if lanes else []
+            )
+            self._add_lanes(lanes, speed_limits)
+            self._add_portion(portions_data, previous_portion_ids, lanes)
+
+        self._add_track_data(track_name, portions_data)
+
+    def add_model_track(self, track: Track) -> None:
+        """
+        Extract a track of a terrain model, see terrain_model.py.
+
+        Gives the same data as add_track() on the Track element. Model tracks
+        have no track hash, so they are always extracted.
 
-            lane_centers = [(portion_laneborder_distances[i] + portion_laneborder_distances[i+1]) / 2 for i in range(len(portion_laneborder_distances) - 1)]
+        Args:
+            track: Track view of a TerrainModel
+        """
+        track_name = track.name
+        self.track_endpoints.append(track.endpoints)
 
+        previous_portion_ids = self._previous_portion_ids(track_name)
+        geometry = self.geometry
+        lane_types = self.lane_types
+        geometry.add_track()
+        portions_data = dict()
+
+        for portion in track.portions:
             lanes = dict()
-            for l in range(len(portion_lanes)):
-                if portion_lanes[l].attrib['type'] not in lane_types:
+            speed_limits = []
+            for l, lane in enumerate(portion.lanes):
+                lane_type = lane.type
+                if lane_type not in lane_types:
+                    continue
+                vehicle_types = lane.vehicle_types
+                if self.vehicle_categories is not None and self.vehicle_categories.isdisjoint(vehicle_types):
                     continue
                 lanes[l] = {
-                    "type": portion_lanes[l].attrib['type'],
-                    "vehicle_types" : portion_lanes[l].find('VehicleType').attrib['categories'].split(","),
-                    "circulationWay": portion_lanes[l].attrib['circulationWay'],
-                    "speedLimit": round(float(portion_lanes[l].attrib['speedLimit']), 2),
-                    "center": round(lane_centers[l], 2)
+                    "type": lane_type,
+                    "vehicle_types" : vehicle_types,
+                    "circulationWay": lane.circulation_way,
+                    "speedLimit": None,
+                    "center": None
                 }
+                speed_limits.append(lane.speed_limit)
 
-            portions_data[portion_id] = {
-                "length": round(portion_length, 2),
-                "abscissa": round(portion_enddistance, 2),
-                "lanes": lanes
-            }
-            
-            portion_id += 1
+            geometry.add_portion(portion.end_distance, portion.lane_borders if lanes else [])
+            self._add_lanes(lanes, speed_limits)
+            self._add_portion(portions_data, previous_portion_ids, lanes)
+
+        self._add_track_data(track_name, portions_data)
+
+    def _filter_categories(self, categories: str) -> Optional[List[str]]:
+        """Split a VehicleType categories attribute, None if the lane does not pass the category filter."""
+        cached = self.categories_cache.get(categories)
+        if cached is None:
+            vehicle_types = tuple(categories.split(","))
+            passes = self.vehicle_categories is None or not self.vehicle_categories.isdisjoint(vehicle_types)
+            cached = self.categories_cache[categories] = (vehicle_types, passes)
 
-        data[track_name] = {
-            "connected_to": connected_tracks,
-            "length": round(track_length, 2),
+        vehicle_types, passes = cached
+        return list(vehicle_types) if passes else None
+
+    def _add_lanes(self, lanes: Dict[int, Any], speed_limits: List[Any]) -> None:
+        """Add the extracted lanes of the portion added last to the geometry batch."""
+        for (l, lane_data), speed_limit in zip(lanes.items(), speed_limits):
+            self.geometry.add_lane(l, speed_limit)
+            self.lane_entries.append(lane_data)
+
+    def _previous_portion_ids(self, track_name: str) -> Iterator[int]:
+        """Portion ids of a track in the previous run, in document order."""
+        return iter(int(key) for key in self.previous_data.get(track_name, {"portions": {}})["portions"])
+
+    def _add_portion(self, portions_data: Dict[int, Any], previous_portion_ids: Iterator[int], lanes: Dict[int, Any]) -> None:
+        track_portion_id = next(previous_portion_ids, None)
+        if track_portion_id is None:
+            track_portion_id = self.portion_id
+            self.portion_id += 1
+
+        portions_data[track_portion_id] = {
+            "length": None,
+            "abscissa": None,
+            "lanes": lanes
+        }
+        self.portion_entries.append(portions_data[track_portion_id])
+
+    def _add_track_data(self, track_name: str, portions_data: Dict[int, Any]) -> None:
+        self.data[track_name] = {
+            "connected_to": [],
+            "length": None,
             "portions": portions_data
         }
+        self.track_entries.append(self.data[track_name])
+        count("tracks extracted")
 
-    with open(output, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    def add_extracted(self, track_endpoints: Tuple[str, str, str], track_data: Dict[str, Any]) -> None:
+        """
+        Add a track extracted by another extractor, see fill_geometry().
 
-default_lane_types = [
-    'paved express',
-    'paved entry',
-    'paved',
-    'emergency'
-    ]
+        Its portions are renumbered as if the track had been extracted here.
+
+        Args:
+            track_endpoints: Track name and end nodes, see get_track_endpoints()
+            track_data: Extracted track data with its geometry filled in
+        """
+        portions_data = dict()
+        for portion_data in track_data["portions"].values():
+            portions_data[self.portion_id] = portion_data
+            self.portion_id += 1
+        track_data["portions"] = portions_data
+
+        self.track_endpoints.append(track_endpoints)
+        self.data[track_endpoints[0]] = track_data
+
+    def fill_geometry(self) -> None:
+        """
+        Compute the numeric attributes of the tracks added so far.
+
+        result() does this as well. Extractors of a part of the terrain call it
+        instead, their tracks are then passed on with add_extracted().
+        """
+        with phase("geometry"):
+            values = self.geometry.compute()
+            for track_data, length in zip(self.track_entries, values["track_length"]):
+                track_data["length"] = length
+            for portion_data, length, abscissa in zip(self.portion_entries, values["portion_length"], values["portion_abscissa"]):
+                portion_data["length"] = length
+                portion_data["abscissa"] = abscissa
+            for lane_data, speed_limit, center in zip(self.lane_entries, values["lane_speed_limit"], values["lane_center"]):
+                lane_data["speedLimit"] = speed_limit
+                lane_data["center"] = center
+        self.geometry = GeometryBatch()
+        self.track_entries, self.portion_entries, self.lane_entries = [], [], []
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Finish the extraction once all tracks are added.
+
+        Returns:
+            Dictionary mapping track name to extracted track data
+        """
+        self.fill_geometry()
+
+        # Connectivity needs every track, so it is filled in after the stream
+        with phase("connectivity"):
+            road_graph = RoadGraph.from_endpoints(self.track_endpoints)
+            for track_name, track_data in self.data.items():
+                track_data["connected_to"] = road_graph.connected_tracks(track_name)
+
+        return self.data
+
+# Track batches per worker process, smaller batches even out the load
+BATCHES_PER_WORKER = 4
+
+def _extract_track_batch(task: Tuple[str, bytes, int, int, Tuple[str, ...], bool, Optional[Tuple[str, ...]]]) -> Tuple[List[Tuple[Tuple[str, str, str], Dict[str, Any]]], List[str]]:
+    """
+    Extract the tracks of a byte range in a worker process.
+
+    Args:
+        task: (terrain file path, XML declaration, start offset, end offset,
+            lane types, whether to hash the tracks, vehicle categories)
+
+    Returns:
+        Tuple of ((track endpoints, track data) per track in document order,
+        track hashes in the same order, empty if not requested)
+    """
+    file_path, declaration, start, end, lane_types, hash_tracks, vehicle_categories = task
+    extractor = ConnectionExtractor(lane_types, vehicle_categories=vehicle_categories)
+    hashes = []
+
+    for track in iter_track_range(file_path, declaration, start, end):
+        if hash_tracks:
+            hashes.append(get_track_hash(track))
+        extractor.add_track(track)
+
+    # Entries are filled in place by fill_geometry()
+    tracks = list(zip(extractor.track_endpoints, extractor.track_entries))
+    extractor.fill_geometry()
+
+    return tracks, hashes
+
+def extract_connections_parallel(
+    file_path: str,
+    lane_types: Iterable[str] = DEFAULT_LANE_TYPES,
+    track_hashes: Optional[Dict[str, str]] = None,
+    workers: Optional[int] = None,
+    track_endpoints: Optional[List[Tuple[str, str, str]]] = None,
+    vehicle_categories: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """
+    Extract track info across a process pool, see extract_connections().
+
+    The file is pre-scanned for the byte ranges of its tracks (see
+    rnd_stream.scan_track_ranges()), and batches of consecutive tracks are
+    extracted in worker processes. Results are added back in document order,
+    so portion numbering and connectivity are the same as in a sequential run.
+
+    Args:
+        file_path: Input .rnd file path
+        lane_types: Lane types to extract lanes of
+        track_hashes: See ConnectionExtractor
+        workers: Number of worker processes (defaults to CPU count)
+        track_endpoints: See extract_connections()
+        vehicle_categories: See ConnectionExtractor
+
+    Returns:
+        Dictionary mapping track name to extracted track data
+
+    Raises:
+        ValueError: If the track tags of the file are not balanced
+    """
+    workers = workers or os.cpu_count() or 1
+    lane_types = tuple(lane_types)
+    vehicle_categories = tuple(vehicle_categories) if vehicle_categories is not None else None
+
+    with phase("scan"):
+        declaration, ranges = scan_track_ranges(str(file_path))
+    batches = batch_track_ranges(ranges, workers * BATCHES_PER_WORKER)
+    count("track batches", len(batches))
+
+    extractor = ConnectionExtractor(lane_types, vehicle_categories=vehicle_categories)
+    tasks = [(str(file_path), declaration, start, end, lane_types, track_hashes is not None, vehicle_categories) for start, end in batches]
+
+    with phase("extract"), ProcessPoolExecutor(max_workers=workers) as executor:
+        for tracks, hashes in executor.map(_extract_track_batch, tasks):
+            for endpoints, track_data in tracks:
+                extractor.add_extracted(endpoints, track_data)
+            if track_hashes is not None:
+                for (endpoints, _), track_hash in zip(tracks, hashes):
+                    track_hashes[endpoints[0]] = track_hash
+            count("tracks extracted", len(tracks))
+
+    if track_endpoints is not None:
+        track_endpoints.extend(extractor.track_endpoints)
+    return extractor.result()
+
+def extract_connections(
+    source,
+    lane_types: Iterable[str] = DEFAULT_LANE_TYPES,
+    previous: Optional[Tuple[Dict[str, Any], Dict[str, str]]] = None,
+    track_hashes: Optional[Dict[str, str]] = None,
+    workers: Optional[int] = 1,
+    track_endpoints: Optional[List[Tuple[str, str, str]]] = None,
+    vehicle_categories: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """
+    Extract track info (connected tracks, length, portions, lanes) needed by custom swarm.
+
+    Args:
+        source: Input .rnd file path, bytes, binary file object, parsed tree or
+            TerrainModel (see terrain_model.py)
+        lane_types: Lane types to extract lanes of
+        previous: See ConnectionExtractor
+        track_hashes: See ConnectionExtractor, not filled for a TerrainModel
+        workers: Number of worker processes, None for CPU count. More than one
+            worker is used for file paths without previous results only, see
+            extract_connections_parallel()
+        track_endpoints: List that (track name, start node, end node) of every
+            track is appended to in document order, e.g. for road_routing.py
+        vehicle_categories: See ConnectionExtractor
+
+    Returns:
+        Dictionary mapping track name to extracted track data
+    """
+    if workers != 1 and previous is None and isinstance(source, (str, os.PathLike)):
+        return extract_connections_parallel(source, lane_types, track_hashes, workers, track_endpoints, vehicle_categories)
+
+    if isinstance(source, TerrainModel):
+        extractor = ConnectionExtractor(lane_types, previous, vehicle_categories=vehicle_categories)
+        with phase("extract"):
+            for track in source:
+                extractor.add_model_track(track)
+    else:
+        extractor = ConnectionExtractor(lane_types, previous, track_hashes, vehicle_categories)
+        add_track = timed("extract", extractor.add_track)
+
+        # Tracks are streamed and released one by one
+        with phase("stream"):
+            for track in iter_tracks(source):
+                add_track(track)
+
+    if track_endpoints is not None:
+        track_endpoints.extend(extractor.track_endpoints)
+    return extractor.result()
+
+def filter_lane_types(data: Dict[str, Any], lane_types: Iterable[str]) -> Dict[str, Any]:
+    """
+    Keep only the lanes of some lane types in extracted data.
+
+    Portions, lengths and connectivity do not depend on the lane types, so for
+    lane types among the extracted ones the result is the same as extracting
+    with those lane types. Several lane type selections can then be saved from
+    a single extraction.
+
+    Args:
+        data: Extracted data, see extract_connections()
+        lane_types: Lane types to keep lanes of
+
+    Returns:
+        Extracted data sharing its lane data with data
+    """
+    lane_types = set(lane_types)
+    return {
+        track_name: {
+            **track_data,
+            "portions": {
+                portion_id: {
+                    **portion_data,
+                    "lanes": {l: lane_data for l, lane_data in portion_data["lanes"].items() if lane_data["type"] in lane_types}
+                }
+                for portion_id, portion_data in track_data["portions"].items()
+            }
+        }
+        for track_name, track_data in data.items()
+    }
+
+def save_extraction(data: Dict[str, Any], output_file: Union[str, BinaryIO], output_format: str = "json") -> None:
+    """
+    Save extracted data.
+
+    Args:
+        data: Extracted data, see extract_connections()
+        output_file: Output file path or binary file object
+        output_format: "json" for nested JSON, "npz" for columnar NumPy arrays (see terrain_columns.py)
+    """
+    with phase("write"):
+        if output_format == "npz":
+            save_columns(data, output_file)
+        elif hasattr(output_file, "write"):
+            output_file.write(json.dumps(data, indent=2).encode("utf-8"))
+        else:
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Terrain file data extraction script.")
+    parser.add_argument("--input", required=True, type=str, help="Input .rnd file path.")
+    parser.add_argument("--output", required=False, type=str, help="Output .json/.npz file path (defaults to input filename with .json/.npz extension).")
+    parser.add_argument("--format", required=False, choices=["json", "npz"], default="json", help="Output format: nested JSON or columnar NumPy .npz (requires numpy). Default: json")
+    parser.add_argument("--lane_types", required=False, nargs='+', type=str, help="List of lane types to generate positions on (e.g., 'paved express' 'paved entry'). Default: paved express, paved entry, paved, emergency")
+    parser.add_argument("--vehicle_categories", required=False, nargs='+', type=str, help="Only extract lanes open to at least one of these vehicle categories (e.g., car truck). Default: all lanes of the lane types")
+    parser.add_argument("--filter_output", required=False, nargs='+', action='append', type=str, help="Also save the lanes of only some of the lane types to another output, given as the output path followed by the lane types (e.g., highway.json 'paved express' 'paved entry'). Can be repeated, every output is taken from the same extraction.")
+    parser.add_argument("-j", "--jobs", required=False, type=int, default=1, help="Number of worker processes, tracks are extracted in batches across them (default: 1, 0 uses the CPU count). Incremental runs with a previous output use one process.")
+    parser.add_argument("--incremental", action="store_true", help="Re-extract only tracks that changed since the previous run into the same output (track hashes are kept in <output>.hashes.json).")
+    parser.add_argument("--routing_output", required=False, type=str, help="Also save a routing index of the tracks to this .npz file (requires numpy).")
+    parser.add_argument("--landmarks", required=False, type=int, default=0, help="Number of landmark distance tables in the routing index (default: 0).")
+    parser.add_argument("--all_pairs", action="store_true", help="Add the all-pairs distance table to the routing index, for small networks only.")
+    parser.add_argument("--positions_output", required=False, type=str, help="Also save a lane position index of the tracks to this .npz file (requires numpy).")
+    parser.add_argument("--model_cache", required=False, type=str, nargs='?', const=DEFAULT_MODEL_CACHE_DIR, help=f"Read the terrain through its model snapshot in this cache directory, built on the first run (default directory: {DEFAULT_MODEL_CACHE_DIR}). Not combined with --incremental.")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    input = args.input
+    output_format = args.format
+    output = args.output if args.output else input.replace(".rnd", f".{output_format}")
+    lane_types = args.lane_types if args.lane_types else DEFAULT_LANE_TYPES
+    filter_outputs = args.filter_output or []
+    for filter_output in filter_outputs:
+        if len(filter_output) < 2:
+            parser.error("--filter_output needs an output path and at least one lane type")
+        unknown_types = [lane_type for lane_type in filter_output[1:] if lane_type not in lane_types]
+        if unknown_types:
+            parser.error(f"--filter_output lane types must be among the extracted lane types: {', '.join(unknown_types)}")
+
+    with instrumented("rnd_extract_connections", args):
+        previous = load_previous_extraction(output, lane_types, args.vehicle_categories) if args.incremental else None
+        track_hashes = dict() if args.incremental else None
+        track_endpoints = [] if args.routing_output else None
+
+        source = load_terrain_model(input, args.model_cache) if args.model_cache and not args.incremental else input
+        data = extract_connections(source, lane_types, previous, track_hashes, args.jobs or None, track_endpoints, args.vehicle_categories)
+        save_extraction(data, output, output_format)
+        if args.incremental:
+            save_track_hashes(output, lane_types, track_hashes, args.vehicle_categories)
+
+        for filter_output, *output_lane_types in filter_outputs:
+            save_extraction(filter_lane_types(data, output_lane_types), filter_output, output_format)
+            print(f"Saved {', '.join(output_lane_types)} lanes to: {filter_output}")
+
+        if args.routing_output:
+            with phase("routing"):
+                routing_index = RoutingIndex.from_extraction(track_endpoints, data, args.landmarks, args.all_pairs)
+                save_routing_index(routing_index, args.routing_output)
+            print(f"Saved routing index to: {args.routing_output}")
+
+        if args.positions_output:
+            with phase("positions"):
+                save_position_index(data, args.positions_output)
+            print(f"Saved lane position index to: {args.positions_output}")
 
-parser = argparse.ArgumentParser(description="Terrain file data extraction script.")
-parser.add_argument("--input", required=True, type=str, help="Input .rnd file path.")
-parser.add_argument("--output", required=False, type=str, help="Output .json file path (defaults to input filename with .json extension).")
-parser.add_argument("--lane_types", required=False, nargs='+', type=str, help="List of lane types to generate positions on (e.g., 'paved express' 'paved entry'). Default: paved express, paved entry, paved, emergency")
-args = parser.parse_args()
+    if not args.incremental:
+        return
 
-input = args.input
-output = args.output if args.output else input.replace(".rnd", ".json")
-lane_types = args.lane_types if args.lane_types else default_lane_types
+    previous_data, previous_hashes = previous if previous else ({}, {})
+    reused_tracks = sum(1 for track_name, track_hash in track_hashes.items() if track_name in previous_data and previous_hashes.get(track_name) == track_hash)
+    print(f"Tracks reused: {reused_tracks}, extracted: {len(track_hashes) - reused_tracks}")
 
-if __name__ == "__main__":    
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
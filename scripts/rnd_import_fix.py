@@ -1,39 +1,56 @@
-from lxml import etree
 import argparse
+from typing import BinaryIO, Optional, Union
+
+from instrumentation import add_arguments, instrumented
+from rnd_stream import transform_terrain
+
+def remove_banned_links(intersection):
+    """Remove all authorizations (LanePair elements) of an intersection."""
+    banned_links = intersection.find('BannedLinks')
+    for lane_pair in banned_links.findall('LanePair'):
+        banned_links.remove(lane_pair)
+
+def name_lanes(track):
+    """Name the lanes of every portion profile in a track (Lane 1, Lane 2, ...)."""
+    for portion in track.findall('Portions/Portion'):
+        for profile in portion.findall('Profile'):
+            lane_name_counter = 1
+            for lane in profile.findall('Lane'):
+                lane.attrib['name'] = f'Lane {lane_name_counter}'
+                lane_name_counter += 1
+
+IMPORT_FIX_HANDLERS = {
+    'Network/SubNetworks/SubNetwork/RoadNetwork/Intersections/*': remove_banned_links,
+    'Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/*': name_lanes
+}
+
+def fix_import(source, output: Optional[Union[str, BinaryIO]] = None):
+    """
+    Remove intersection authorizations and name lanes of an imported terrain.
+
+    Intersections and tracks are edited and written one by one while streaming.
+
+    Args:
+        source: Input .rnd file path, bytes, binary file object or parsed tree
+        output: Output .rnd file path or binary file object
+
+    Returns:
+        See rnd_stream.transform_terrain()
+    """
+    return transform_terrain(source, output, IMPORT_FIX_HANDLERS)
 
 def main():
+    parser = argparse.ArgumentParser(description="Terrain file lane naming and removal of links in intersections.")
+    parser.add_argument("--input", required=True, type=str, help="Input .rnd file path.")
+    parser.add_argument("--output", required=False, type=str, help="Output .rnd file path (defaults to input filename).")
+    add_arguments(parser)
+    args = parser.parse_args()
 
-    tree = etree.parse(input)
-    root = tree.getroot()
+    input = args.input
+    output = args.output if args.output else args.input
 
-    intersections = root.findall('Network/SubNetworks/SubNetwork/RoadNetwork/Intersections/')
-    tracks = root.findall('Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/')
+    with instrumented("rnd_import_fix", args):
+        fix_import(input, output)
 
-    # Remove all authorizations in all intersections
-    for intersection in intersections:
-        banned_links = intersection.find('BannedLinks')
-        for lane_pair in banned_links.findall('LanePair'):
-            banned_links.remove(lane_pair)
-
-    # Name lanes
-    for track in tracks:
-        for portion in track.findall('Portions/Portion'):
-            for profile in portion.findall('Profile'):
-                lane_name_counter = 1
-                for lane in profile.findall('Lane'):
-                    lane.attrib['name'] = f'Lane {lane_name_counter}'
-                    lane_name_counter += 1
-
-    # Save updated xml
-    tree.write(output, encoding='utf-8', xml_declaration=True, pretty_print=True)
-
-parser = argparse.ArgumentParser(description="Terrain file lane naming and removal of links in intersections.")
-parser.add_argument("--input", required=True, type=str, help="Input .rnd file path.")
-parser.add_argument("--output", required=False, type=str, help="Output .rnd file path (defaults to input filename).")
-args = parser.parse_args()
-
-input = args.input
-output = args.output if args.output else args.input
-
-if __name__ == "__main__":    
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,63 @@
-from lxml import etree
 import argparse
+from typing import BinaryIO, Callable, Optional, Union
+
+from lxml import etree
 
-def name_portions(input_path, output_path):
+from instrumentation import add_arguments, instrumented
+from rnd_stream import transform_terrain
+
+def portion_namer() -> Callable[[etree._Element], None]:
     """
-    Assign unique names (IDs) to all portions in the tracks of a Terrain (.rnd) file.
+    Create a track handler that names portions with consecutive IDs.
 
-    Args:
-        input_path (str): Path to the input .rnd file.
-        output_path (str): Path to the output .rnd file.
+    IDs continue across all tracks the handler is called on, in call order.
+
+    Returns:
+        Function that names the portions of a Track element in place
     """
-    try:
-        # Parse the input .rnd file
-        tree = etree.parse(input_path)
-        root = tree.getroot()
+    portion_id = 0
 
-        portion_id = 0
-        tracks = root.findall('Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/')
+    def name_track_portions(track):
+        nonlocal portion_id
+        for portion in track.findall('Portions/Portion'):
+            portion.attrib['name'] = str(portion_id)
+            portion_id += 1
 
-        # Name portions in each track
-        for track in tracks:
-            for portion in track.findall('Portions/Portion'):
-                portion.attrib['name'] = str(portion_id)
-                portion_id += 1
+    return name_track_portions
 
-        # Save the updated .rnd file
-        tree.write(output_path, encoding='utf-8', xml_declaration=True, pretty_print=True)
-        print(f"Successfully named portions and saved to {output_path}")
+def name_portions(source, output: Optional[Union[str, BinaryIO]] = None):
+    """
+    Assign unique names (IDs) to all portions in the tracks of a Terrain (.rnd) file.
 
-    except Exception as e:
-        print(f"Error processing file: {e}")
+    Args:
+        source: Input .rnd file path, bytes, binary file object or parsed tree
+        output: Output .rnd file path or binary file object
+
+    Returns:
+        See rnd_stream.transform_terrain()
+    """
+    # Stream tracks, naming their portions, into the updated .rnd file
+    return transform_terrain(source, output, {
+        'Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/*': portion_namer()
+    })
 
 def main():
     parser = argparse.ArgumentParser(description="Terrain file portion naming.")
     parser.add_argument("--input", required=True, type=str, help="Input .rnd file path.")
     parser.add_argument("--output", required=False, type=str, help="Output .rnd file path (defaults to input filename).")
+    add_arguments(parser)
     args = parser.parse_args()
 
     input = args.input
     output = args.output if args.output else args.input
 
-    name_portions(input, output)
+    try:
+        with instrumented("rnd_name_portions", args):
+            name_portions(input, output)
+        print(f"Successfully named portions and saved to {output}")
+
+    except Exception as e:
+        print(f"Error processing file: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
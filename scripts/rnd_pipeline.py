@@ -0,0 +1,126 @@
+import argparse
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+from lxml import etree
+
+from instrumentation import add_arguments, instrumented, phase, timed
+from rnd_extract_connections import DEFAULT_LANE_TYPES, ConnectionExtractor, save_extraction
+from rnd_import_fix import name_lanes, remove_banned_links
+from rnd_name_portions import portion_namer
+from rnd_stream import iter_tracks, transform_terrain
+
+INTERSECTIONS_PATH = 'Network/SubNetworks/SubNetwork/RoadNetwork/Intersections/*'
+TRACKS_PATH = 'Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/*'
+
+# Stages in the order of the separate import flow scripts
+STAGES = ['fix_links', 'name_lanes', 'name_portions', 'extract']
+
+def _chain(handlers: List[Callable[[etree._Element], None]]) -> Callable[[etree._Element], None]:
+    """Combine element handlers into one that runs them in order."""
+    def run_handlers(element: etree._Element) -> None:
+        for handler in handlers:
+            handler(element)
+    return run_handlers
+
+def run_pipeline(
+    source,
+    output: Optional[Union[str, BinaryIO]] = None,
+    stages: List[str] = STAGES,
+    lane_types: List[str] = DEFAULT_LANE_TYPES
+) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """
+    Run terrain preparation stages in one pass over the terrain.
+
+    Every intersection and track is parsed once, passed through the stages in
+    the given order and written to the output, so the terrain is read and
+    written once instead of once per script. Stages:
+
+    - fix_links: Remove intersection authorizations (rnd_import_fix.py)
+    - name_lanes: Name lanes Lane 1, Lane 2, ... (rnd_import_fix.py)
+    - name_portions: Name portions with consecutive IDs (rnd_name_portions.py)
+    - extract: Extract track data for custom swarm (rnd_extract_connections.py)
+
+    Without any of the first three stages, nothing is rewritten and the terrain
+    is only read for extraction.
+
+    Args:
+        source: Input .rnd file path, bytes, binary file object or parsed tree
+        output: Output .rnd file path or binary file object
+        stages: Stage names, applied to every element in this order
+        lane_types: Lane types to extract lanes of
+
+    Returns:
+        Tuple of (terrain result, see rnd_stream.transform_terrain(), or None if
+        nothing is rewritten; extracted data, or None without the extract stage)
+
+    Raises:
+        ValueError: If a stage name is unknown or given more than once
+    """
+    intersection_handlers = []
+    track_handlers = []
+    extractor = None
+
+    duplicates = sorted({stage for stage in stages if list(stages).count(stage) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate pipeline stages: {', '.join(duplicates)}")
+
+    # Handlers are timed per stage when instrumentation is enabled
+    for stage in stages:
+        if stage == 'fix_links':
+            intersection_handlers.append(timed(stage, remove_banned_links))
+        elif stage == 'name_lanes':
+            track_handlers.append(timed(stage, name_lanes))
+        elif stage == 'name_portions':
+            track_handlers.append(timed(stage, portion_namer()))
+        elif stage == 'extract':
+            extractor = ConnectionExtractor(lane_types)
+            track_handlers.append(timed(stage, extractor.add_track))
+        else:
+            raise ValueError(f"Unknown pipeline stage: {stage}")
+
+    if set(stages) == {'extract'}:
+        handle_track = _chain(track_handlers)
+        with phase("stream"):
+            for track in iter_tracks(source):
+                handle_track(track)
+        return None, extractor.result()
+
+    handlers = dict()
+    if intersection_handlers:
+        handlers[INTERSECTIONS_PATH] = _chain(intersection_handlers)
+    if track_handlers:
+        handlers[TRACKS_PATH] = _chain(track_handlers)
+
+    terrain = transform_terrain(source, output, handlers)
+
+    return terrain, extractor.result() if extractor is not None else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Terrain import fix, portion naming and data extraction in one pass.")
+    parser.add_argument("--input", required=True, type=str, help="Input .rnd file path.")
+    parser.add_argument("--output", required=False, type=str, help="Output .rnd file path (defaults to input filename).")
+    parser.add_argument("--stages", required=False, nargs='+', choices=STAGES, default=STAGES, help="Stages to run, in this order (default: all).")
+    parser.add_argument("--extract_output", required=False, type=str, help="Output .json/.npz file path of the extract stage (defaults to input filename with .json/.npz extension).")
+    parser.add_argument("--format", required=False, choices=["json", "npz"], default="json", help="Output format of the extract stage: nested JSON or columnar NumPy .npz (requires numpy). Default: json")
+    parser.add_argument("--lane_types", required=False, nargs='+', type=str, help="List of lane types to generate positions on (e.g., 'paved express' 'paved entry'). Default: paved express, paved entry, paved, emergency")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if len(set(args.stages)) != len(args.stages):
+        parser.error("--stages: each stage can be given only once")
+
+    input = args.input
+    output = args.output if args.output else args.input
+    extract_output = args.extract_output if args.extract_output else input.replace(".rnd", f".{args.format}")
+    lane_types = args.lane_types if args.lane_types else DEFAULT_LANE_TYPES
+
+    with instrumented("rnd_pipeline", args):
+        _, data = run_pipeline(input, output, args.stages, lane_types)
+
+        if any(stage != 'extract' for stage in args.stages):
+            print(f"Saved terrain to: {output}")
+        if data is not None:
+            save_extraction(data, extract_output, args.format)
+            print(f"Saved extracted data to: {extract_output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""Streaming readers for Terrain (.rnd) files."""
+
+import io
+import mmap
+import os
+import re
+import tempfile
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from lxml import etree
+
+from instrumentation import count, phase, timed
+
+TRACK_PATH = 'Network/SubNetworks/SubNetwork/RoadNetwork/Tracks/Track'
+
+# Tags on the track path, and markup whose content is skipped by scan_track_ranges()
+_TRACK_SCAN_PATTERN = re.compile(rb'<(/?)(' + '|'.join(TRACK_PATH.split('/')).encode() + rb')(?=[\s/>])|<!--|<!\[CDATA\[|<\?')
+# Rest of a start tag, '>' may appear in quoted attribute values
+_TAG_END_PATTERN = re.compile(rb'(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+def is_parsed(source) -> bool:
+    """Check whether a source is an already parsed tree or element instead of file content."""
+    return isinstance(source, (etree._ElementTree, etree._Element))
+
+def _open_source(source):
+    """Make bytes readable by iterparse, paths and file objects are passed through."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+def _release(element: etree._Element) -> None:
+    """Free an element's subtree together with the already processed siblings before it."""
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is None:
+        return
+    while element.getprevious() is not None:
+        del parent[0]
+
+def iter_elements(source, path: Union[str, Sequence[str]]) -> Iterator[etree._Element]:
+    """
+    Stream complete elements at the given path (or paths) with iterparse.
+
+    Each element is yielded once its end tag is parsed, with its whole subtree
+    available. It is cleared as soon as the consumer asks for the next one, as
+    is every subtree outside the path, so memory stays bounded by the largest
+    single element instead of the file size. Yielded elements must not be kept
+    beyond the current iteration.
+
+    A parsed tree or element is not streamed, its matching elements are
+    yielded as they are and stay intact.
+
+    Args:
+        source: File path, bytes, binary file object or parsed tree
+        path: Element path relative to the root, e.g. TRACK_PATH, or a sequence
+            of such paths to stream the elements of all of them in one pass
+
+    Yields:
+        Elements matching the path, in document order
+    """
+    paths = [path] if isinstance(path, str) else list(path)
+
+    if is_parsed(source):
+        root = source.getroot() if isinstance(source, etree._ElementTree) else source
+        if len(paths) == 1:
+            yield from root.iterfind(paths[0])
+        else:
+            # An XPath union keeps document order across the paths
+            yield from root.xpath(' | '.join(paths))
+        return
+
+    targets = {tuple(target_path.split('/')) for target_path in paths}
+    # Elements on the way to a target are kept until their end tag
+    prefixes = {target[:depth] for target in targets for depth in range(1, len(target))}
+    target_depth = max(len(target) for target in targets)
+    stack = []
+    elements_parsed = 0
+    elements_yielded = 0
+
+    try:
+        for event, element in etree.iterparse(_open_source(source), events=('start', 'end')):
+            if event == 'start':
+                stack.append(element.tag)
+                elements_parsed += 1
+                continue
+
+            depth = len(stack) - 1
+            if 0 < depth <= target_depth:
+                element_path = tuple(stack[1:])
+                if element_path in targets:
+                    elements_yielded += 1
+                    yield element
+                    _release(element)
+                elif element_path not in prefixes:
+                    _release(element)
+
+            stack.pop()
+    finally:
+        count("elements parsed", elements_parsed)
+        count("elements streamed", elements_yielded)
+
+def iter_tracks(source) -> Iterator[etree._Element]:
+    """
+    Stream Track elements (with their Portions, Profiles and Lanes) one at a time.
+
+    Args:
+        source: File path, bytes, binary file object or parsed tree
+
+    Yields:
+        Track elements in document order, see iter_elements()
+    """
+    return iter_elements(source, TRACK_PATH)
+
+def scan_track_ranges(file_path: str) -> Tuple[bytes, List[Tuple[int, int, int]]]:
+    """
+    Find the byte ranges of the Track elements of a Terrain file without parsing it.
+
+    Only the tags on the track path are looked at, so the scan runs at regex
+    speed. Elements of the same names elsewhere in the file are assumed not to
+    contain the track path.
+
+    Args:
+        file_path: Terrain (.rnd) file path
+
+    Returns:
+        Tuple of (XML declaration, empty if there is none; (Tracks element number,
+        start offset, end offset) of every track in document order)
+
+    Raises:
+        ValueError: If the track path tags are not balanced
+    """
+    track_parents = TRACK_PATH.encode().split(b'/')[:-1]
+    ranges = []
+    declaration = b''
+    stack = []
+    tracks_number = -1
+    track_start = None
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:5] == b'<?xml':
+            declaration = data[:data.find(b'?>') + 2]
+
+        position = 0
+        while True:
+            match = _TRACK_SCAN_PATTERN.search(data, position)
+            if match is None:
+                break
+            markup = match.group(0)
+
+            if markup == b'<!--':
+                position = data.find(b'-->', match.end()) + 3
+            elif markup == b'<![CDATA[':
+                position = data.find(b']]>', match.end()) + 3
+            elif markup == b'<?':
+                position = data.find(b'?>', match.end()) + 2
+            elif match.group(1):
+                tag = match.group(2)
+                position = data.find(b'>', match.end()) + 1
+                if not stack or stack[-1] != tag:
+                    raise ValueError(f"Unbalanced </{tag.decode()}> at byte {match.start()} of {file_path}")
+                stack.pop()
+                if tag == b'Track' and stack == track_parents:
+                    ranges.append((tracks_number, track_start, position))
+            else:
+                tag = match.group(2)
+                tag_end = _TAG_END_PATTERN.match(data, match.end())
+                if tag_end is None:
+                    raise ValueError(f"Unterminated <{tag.decode()}> at byte {match.start()} of {file_path}")
+                position = tag_end.end()
+                self_closing = data[position - 2:position - 1] == b'/'
+
+                if tag == b'Tracks' and stack == track_parents[:-1]:
+                    tracks_number += 1
+                if tag == b'Track' and stack == track_parents:
+                    if self_closing:
+                        ranges.append((tracks_number, match.start(), position))
+                    track_start = match.start()
+                if not self_closing:
+                    stack.append(tag)
+
+            if position < match.end():
+                raise ValueError(f"Unterminated markup at byte {match.start()} of {file_path}")
+
+    if stack:
+        raise ValueError(f"Unclosed <{stack[-1].decode()}> in {file_path}")
+
+    return declaration, ranges
+
+def batch_track_ranges(ranges: List[Tuple[int, int, int]], batches: int) -> List[Tuple[int, int]]:
+    """
+    Group consecutive tracks into byte ranges of similar size.
+
+    Batches never span two Tracks elements, so a file with many small
+    SubNetworks can give more batches than asked for.
+
+    Args:
+        ranges: Track ranges from scan_track_ranges()
+        batches: Number of batches to aim for
+
+    Returns:
+        List of (start offset, end offset) in document order
+    """
+    if not ranges:
+        return []
+
+    target_size = sum(end - start for _, start, end in ranges) / max(1, batches)
+    result = []
+    batch_tracks, batch_start, batch_end = ranges[0]
+
+    for tracks_number, start, end in ranges[1:]:
+        if tracks_number != batch_tracks or end - batch_start > target_size:
+            result.append((batch_start, batch_end))
+            batch_tracks, batch_start = tracks_number, start
+        batch_end = end
+    result.append((batch_start, batch_end))
+
+    return result
+
+def iter_track_range(file_path: str, declaration: bytes, start: int, end: int) -> Iterator[etree._Element]:
+    """
+    Stream the Track elements of a byte range found by scan_track_ranges().
+
+    Args:
+        file_path: Terrain (.rnd) file path
+        declaration: XML declaration of the file, for its encoding
+        start: Start offset of the first track
+        end: End offset of the last track
+
+    Yields:
+        Track elements in document order, see iter_elements()
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start)
+
+    return iter_elements(b''.join((declaration, b'<Tracks>', content, b'</Tracks>')), 'Track')
+
+class _OpenElement:
+    """Parser stack entry for an element copied by transform_elements()."""
+
+    __slots__ = ('element', 'path', 'is_container', 'context', 'text_written', 'pending', 'pending_whole')
+
+    def __init__(self, element: Optional[etree._Element], path: Tuple[str, ...], is_container: bool):
+        self.element = element
+        self.path = path
+        self.is_container = is_container
+        self.context = None
+        self.text_written = False
+        self.pending: Optional[etree._Element] = None
+        self.pending_whole = False
+
+# Stack entry shared by all elements nested inside a subtree that is copied whole
+_SUBTREE = _OpenElement(None, (), False)
+
+def _path_matches(pattern: Tuple[str, ...], path: Tuple[str, ...]) -> bool:
+    return len(pattern) == len(path) and all(part in ('*', tag) for part, tag in zip(pattern, path))
+
+def edit_elements(
+    source: Union[etree._ElementTree, etree._Element],
+    handlers: Dict[str, Callable[[etree._Element], None]]
+) -> None:
+    """
+    Edit elements of a parsed terrain in place, see transform_elements().
+
+    Args:
+        source: Parsed tree or root element
+        handlers: Element path (relative to the root, '*' matches any tag) to
+            function that edits the element in place
+    """
+    root = source.getroot() if isinstance(source, etree._ElementTree) else source
+    for path, handler in handlers.items():
+        handler = timed("transform", handler)
+        for element in root.iterfind(path):
+            count("elements transformed")
+            handler(element)
+
+def _output_mode(output_path: Path) -> int:
+    """Permission bits for a file written over output_path: those of the existing file, otherwise the umask default."""
+    try:
+        return output_path.stat().st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+@contextmanager
+def _open_output(output: Union[str, BinaryIO]) -> Iterator[BinaryIO]:
+    """Open an output path through a temporary file that replaces it on success, file objects are used as they are."""
+    if not isinstance(output, (str, os.PathLike)):
+        yield output
+        return
+
+    output_path = Path(output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        # mkstemp creates the file with mode 0600
+        os.chmod(temp_path, _output_mode(output_path))
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def transform_elements(
+    source,
+    output: Union[str, BinaryIO],
+    handlers: Dict[str, Callable[[etree._Element], None]]
+) -> None:
+    """
+    Stream a terrain file to output, editing elements at the given paths on the way.
+
+    Ancestors of the handled paths are streamed as open tags through
+    lxml.etree.xmlfile. Every other subtree is parsed completely, passed to
+    the matching handler (if any), written to the output and released, so
+    memory stays bounded by the largest single subtree. Text and tails are
+    copied as parsed, which keeps the layout of the input.
+
+    An output path is written through a temporary file next to it that is
+    moved into place at the end, so output may be the same path as source.
+
+    Args:
+        source: Input .rnd file path, bytes or binary file object
+        output: Output .rnd file path or binary file object
+        handlers: Element path (relative to the root, '*' matches any tag) to
+            function that edits the element in place
+    """
+    patterns = [(tuple(path.split('/')), timed("transform", handler)) for path, handler in handlers.items()]
+    container_patterns = {pattern[:depth] for pattern, _ in patterns for depth in range(len(pattern))}
+
+    elements_parsed = 0
+    elements_transformed = 0
+
+    with phase("stream"), _open_output(output) as f:
+        with ExitStack() as writer_stack:
+            f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+            xf = None
+            stack = []
+
+            def flush(entry: _OpenElement) -> None:
+                # Start tags are written lazily so that childless elements stay self-closing
+                if entry.context is None:
+                    attrib = dict(entry.element.attrib)
+                    nsmap = entry.element.nsmap if not entry.path else None
+                    entry.context = xf.element(entry.element.tag, attrib, nsmap=nsmap or None)
+                    entry.context.__enter__()
+                if not entry.text_written:
+                    if entry.element.text:
+                        xf.write(entry.element.text)
+                    entry.text_written = True
+                if entry.pending is not None:
+                    # Children are written one event late, once their tail is parsed as well
+                    if entry.pending_whole:
+                        xf.write(entry.pending)
+                        _release(entry.pending)
+                    elif entry.pending.tail:
+                        xf.write(entry.pending.tail)
+                    entry.pending = None
+
+            for event, element in etree.iterparse(_open_source(source), events=('start', 'end', 'comment', 'pi')):
+
+                if event == 'start':
+                    elements_parsed += 1
+                    parent = stack[-1] if stack else None
+                    if parent is None:
+                        xf = writer_stack.enter_context(etree.xmlfile(f, encoding='UTF-8'))
+                        stack.append(_OpenElement(element, (), True))
+                    elif not parent.is_container:
+                        stack.append(_SUBTREE)
+                    else:
+                        flush(parent)
+                        path = parent.path + (element.tag,)
+                        is_container = any(_path_matches(pattern, path) for pattern in container_patterns)
+                        stack.append(_OpenElement(element, path, is_container))
+                    continue
+
+                if event != 'end':
+                    # Comments and processing instructions
+                    parent = stack[-1] if stack else None
+                    if parent is None:
+                        f.write(etree.tostring(element, with_tail=False) + b"\n")
+                    elif parent.is_container:
+                        flush(parent)
+                        parent.pending, parent.pending_whole = element, True
+                    continue
+
+                entry = stack.pop()
+                if entry is _SUBTREE:
+                    continue
+
+                if entry.context is not None:
+                    flush(entry)
+                    entry.context.__exit__(None, None, None)
+                    whole = False
+                else:
+                    for pattern, handler in patterns:
+                        if _path_matches(pattern, entry.path):
+                            handler(element)
+                            elements_transformed += 1
+                            break
+                    whole = True
+
+                if stack:
+                    stack[-1].pending, stack[-1].pending_whole = element, whole
+                else:
+                    if whole:
+                        xf.write(element)
+                    writer_stack.close()
+                    f.write(b"\n")
+
+    count("elements parsed", elements_parsed)
+    count("elements transformed", elements_transformed)
+
+def transform_terrain(
+    source,
+    output: Optional[Union[str, BinaryIO]],
+    handlers: Dict[str, Callable[[etree._Element], None]]
+):
+    """
+    Apply element handlers to a terrain given as a file, bytes or parsed tree.
+
+    Files and bytes are streamed with transform_elements(), parsed trees are
+    edited in place with edit_elements().
+
+    Args:
+        source: Input .rnd file path, bytes, binary file object or parsed tree
+        output: Output .rnd file path or binary file object. Ignored for a parsed
+            tree, which is edited in place
+        handlers: Element path (relative to the root, '*' matches any tag) to
+            function that edits the element in place
+
+    Returns:
+        The edited tree for a parsed source, the output .rnd content as bytes if
+        no output is given, otherwise None
+    """
+    if is_parsed(source):
+        edit_elements(source, handlers)
+        return source
+
+    if output is None:
+        buffer = io.BytesIO()
+        transform_elements(source, buffer, handlers)
+        return buffer.getvalue()
+
+    transform_elements(source, output, handlers)
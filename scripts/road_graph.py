@@ -0,0 +1,174 @@
+"""Track connectivity graph of a Terrain (.rnd) road network."""
+
+from collections import deque
+from typing import Dict, Iterable, List, Set, Tuple
+
+from lxml import etree
+
+def get_track_endpoints(track: etree._Element) -> Tuple[str, str, str]:
+    """
+    Get the name and end nodes of a track.
+
+    Args:
+        track: Track element
+
+    Returns:
+        Tuple of (track name, start node, end node)
+    """
+    return track.attrib['name'], track.attrib['startNode'], track.attrib['endNode']
+
+def get_intersections(track_endpoints: Iterable[Tuple[str, str, str]]) -> Dict[str, List[str]]:
+    """
+    Collect the tracks attached to every intersection node.
+
+    Args:
+        track_endpoints: (track name, start node, end node) tuples, see get_track_endpoints()
+
+    Returns:
+        Dictionary mapping node name to list of track names
+    """
+    intersections = dict()
+
+    for track_name, start_node, end_node in track_endpoints:
+        track_intersections = [start_node, end_node]
+
+        for intersection in track_intersections:
+            if not intersection:
+                continue
+            if intersection not in intersections:
+                intersections[intersection] = []
+            intersections[intersection].append(track_name)
+
+    return intersections
+
+class RoadGraph:
+    """
+    Adjacency index over tracks and intersection nodes.
+
+    Tracks are numbered in document order. Node -> tracks and track -> neighbour
+    adjacency are kept as integer ids, so connectivity queries never scan the
+    intersection list. Query results are returned in track document order.
+    """
+
+    def __init__(self, track_names: Iterable[str], intersections: Dict[str, List[str]]):
+        """
+        Build the adjacency index.
+
+        Args:
+            track_names: Track names in document order
+            intersections: Node name to track names mapping, see get_intersections()
+        """
+        self.track_names: List[str] = list(track_names)
+        self.track_ids: Dict[str, int] = {name: track_id for track_id, name in enumerate(self.track_names)}
+        self.node_tracks: Dict[str, List[int]] = {}
+        self.neighbours: List[Set[int]] = [set() for _ in self.track_names]
+
+        for node, node_track_names in intersections.items():
+            node_track_ids = sorted({self.track_ids[name] for name in node_track_names})
+            self.node_tracks[node] = node_track_ids
+            for track_id in node_track_ids:
+                self.neighbours[track_id].update(node_track_ids)
+
+        for track_id, track_neighbours in enumerate(self.neighbours):
+            track_neighbours.discard(track_id)
+
+    @classmethod
+    def from_endpoints(cls, track_endpoints: Iterable[Tuple[str, str, str]]) -> "RoadGraph":
+        """
+        Build the graph from (track name, start node, end node) tuples.
+
+        Args:
+            track_endpoints: Track endpoints in document order
+
+        Returns:
+            RoadGraph instance
+        """
+        track_endpoints = list(track_endpoints)
+        return cls((endpoints[0] for endpoints in track_endpoints), get_intersections(track_endpoints))
+
+    @classmethod
+    def from_tracks(cls, tracks: Iterable[etree._Element]) -> "RoadGraph":
+        """
+        Build the graph from Track elements.
+
+        Args:
+            tracks: Track elements of the terrain
+
+        Returns:
+            RoadGraph instance
+        """
+        return cls.from_endpoints(get_track_endpoints(track) for track in tracks)
+
+    def __len__(self) -> int:
+        return len(self.track_names)
+
+    def _names(self, track_ids: Iterable[int]) -> List[str]:
+        return [self.track_names[track_id] for track_id in sorted(track_ids)]
+
+    def connected_tracks(self, track_name: str) -> List[str]:
+        """
+        Get tracks sharing an intersection node with the given track.
+
+        Args:
+            track_name: Track name
+
+        Returns:
+            List of connected track names
+        """
+        return self._names(self.neighbours[self.track_ids[track_name]])
+
+    def _reachable_ids(self, start_id: int) -> Set[int]:
+        visited = {start_id}
+        queue = deque([start_id])
+
+        while queue:
+            for neighbour_id in self.neighbours[queue.popleft()]:
+                if neighbour_id not in visited:
+                    visited.add(neighbour_id)
+                    queue.append(neighbour_id)
+
+        return visited
+
+    def reachable_tracks(self, track_name: str) -> List[str]:
+        """
+        Get all tracks reachable from the given track, the track itself included.
+
+        Args:
+            track_name: Track name
+
+        Returns:
+            List of reachable track names
+        """
+        return self._names(self._reachable_ids(self.track_ids[track_name]))
+
+    def is_reachable(self, from_track: str, to_track: str) -> bool:
+        """
+        Check whether one track can be reached from another.
+
+        Args:
+            from_track: Start track name
+            to_track: Target track name
+
+        Returns:
+            True if both tracks are in the same connected component
+        """
+        return self.track_ids[to_track] in self._reachable_ids(self.track_ids[from_track])
+
+    def connected_components(self) -> List[List[str]]:
+        """
+        Split the network into connected components.
+
+        Returns:
+            List of components, each a list of track names, ordered by first track
+        """
+        components = []
+        assigned: Set[int] = set()
+
+        for track_id in range(len(self.track_names)):
+            if track_id in assigned:
+                continue
+            component = self._reachable_ids(track_id)
+            assigned.update(component)
+            components.append(self._names(component))
+
+        return components
@@ -0,0 +1,496 @@
+"""Directed routing index over the tracks of an extracted Terrain (.rnd) road network."""
+
+from functools import lru_cache
+from heapq import heappop, heappush
+import math
+import mmap
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from terrain_columns import map_npz_members
+
+ROUTING_VERSION = 1
+DEFAULT_CACHE_SIZE = 65536
+# Landmarks used per query, see RoutingIndex._search()
+ACTIVE_LANDMARKS = 3
+
+INF = math.inf
+
+# Track directions, the state of track t in direction d is 2 * t + d
+FORWARD = 0
+BACKWARD = 1
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("numpy is required for the routing index file format (pip install numpy)")
+
+def get_track_directions(track_data: Dict[str, Any]) -> Tuple[bool, bool]:
+    """
+    Get the directions a track can be driven in from its extracted lanes.
+
+    Args:
+        track_data: Extracted track data, see rnd_extract_connections.py
+
+    Returns:
+        Tuple of (forward allowed, backward allowed). A lane with a circulation
+        way other than forward or backward allows both
+    """
+    forward = backward = False
+
+    for portion_data in track_data["portions"].values():
+        for lane_data in portion_data["lanes"].values():
+            circulation_way = lane_data["circulationWay"]
+            forward = forward or circulation_way != "backward"
+            backward = backward or circulation_way != "forward"
+
+    return forward, backward
+
+def build_state_graph(
+    track_endpoints: Sequence[Tuple[str, str, str]],
+    track_directions: Sequence[Tuple[bool, bool]],
+    track_length: Sequence[float]
+) -> Tuple[List[int], List[int], List[float]]:
+    """
+    Build the CSR adjacency of driving directions.
+
+    A track driven forward goes from its start node to its end node. A state
+    leads to every state of another track that enters the node it exits, with
+    the length of that track as weight. Targets are ordered by state.
+
+    Args:
+        track_endpoints: (track name, start node, end node) in track order
+        track_directions: (forward, backward) allowed per track
+        track_length: Track lengths in track order
+
+    Returns:
+        Tuple of (offsets, targets, weights). Targets of state s are
+        targets[offsets[s]:offsets[s + 1]]
+    """
+    entering: Dict[str, List[int]] = dict()
+    exits: List[Optional[str]] = [None] * (2 * len(track_endpoints))
+
+    for track_id, ((_, start_node, end_node), directions) in enumerate(zip(track_endpoints, track_directions)):
+        for direction, entry_node, exit_node in ((FORWARD, start_node, end_node), (BACKWARD, end_node, start_node)):
+            if not directions[direction]:
+                continue
+            state = 2 * track_id + direction
+            exits[state] = exit_node or None
+            if entry_node:
+                entering.setdefault(entry_node, []).append(state)
+
+    offsets, targets, weights = [0], [], []
+
+    for state, exit_node in enumerate(exits):
+        if exit_node is not None:
+            for target in entering.get(exit_node, ()):
+                if target >> 1 != state >> 1:
+                    targets.append(target)
+                    weights.append(track_length[target >> 1])
+        offsets.append(len(targets))
+
+    return offsets, targets, weights
+
+def _shortest_distances(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float], source: int) -> List[float]:
+    """Distances from a state to every state (INF if unreachable), source length excluded."""
+    distances = [INF] * (len(offsets) - 1)
+    distances[source] = 0.0
+    queue = [(0.0, source)]
+
+    while queue:
+        distance, state = heappop(queue)
+        if distance > distances[state]:
+            continue
+        for edge in range(offsets[state], offsets[state + 1]):
+            target = targets[edge]
+            target_distance = distance + weights[edge]
+            if target_distance < distances[target]:
+                distances[target] = target_distance
+                heappush(queue, (target_distance, target))
+
+    return distances
+
+def _reverse_graph(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float]) -> Tuple[List[int], List[int], List[float]]:
+    """CSR adjacency with every edge reversed."""
+    state_count = len(offsets) - 1
+    incoming: List[List[Tuple[int, float]]] = [[] for _ in range(state_count)]
+
+    for state in range(state_count):
+        for edge in range(offsets[state], offsets[state + 1]):
+            incoming[targets[edge]].append((state, weights[edge]))
+
+    reverse_offsets, reverse_targets, reverse_weights = [0], [], []
+    for edges in incoming:
+        for source, weight in edges:
+            reverse_targets.append(source)
+            reverse_weights.append(weight)
+        reverse_offsets.append(len(reverse_targets))
+
+    return reverse_offsets, reverse_targets, reverse_weights
+
+class RoutingIndex:
+    """
+    Shortest route queries between tracks.
+
+    A route starts at the beginning of the origin track and ends at the end of
+    the destination track, in any allowed directions, and its length includes
+    both tracks. Searches run on the CSR state graph (see build_state_graph()),
+    guided by landmark distance tables if there are any, and are answered
+    from an all-pairs table when it was built.
+
+    Queries, memoised in an LRU cache per (origin, destination):
+
+    - route_length(origin, destination): Route length, None if unreachable
+    - route(origin, destination): Track names of the route, None if unreachable
+    """
+
+    def __init__(
+        self,
+        track_names: Sequence[str],
+        track_length: Sequence[float],
+        track_directions: Sequence[int],
+        offsets: Sequence[int],
+        targets: Sequence[int],
+        weights: Sequence[float],
+        landmarks: Sequence[int] = (),
+        landmark_from: Optional[Sequence[Sequence[float]]] = None,
+        landmark_to: Optional[Sequence[Sequence[float]]] = None,
+        all_pairs: Optional[Any] = None,
+        cache_size: int = DEFAULT_CACHE_SIZE
+    ):
+        """
+        Args:
+            track_names: Track names in track order
+            track_length: Track lengths in track order
+            track_directions: Allowed directions per track, a bit mask of
+                1 << FORWARD and 1 << BACKWARD
+            offsets, targets, weights: State graph, see build_state_graph()
+            landmarks: Landmark states
+            landmark_from: Distances from every landmark to every state
+            landmark_to: Distances from every state to every landmark
+            all_pairs: State by state distance matrix, see build_all_pairs()
+            cache_size: Number of memoised queries
+        """
+        def as_list(values) -> list:
+            return values.tolist() if hasattr(values, "tolist") else list(values)
+
+        # Searches index single values, which is faster on lists than on arrays
+        self.track_names: List[str] = as_list(track_names)
+        self.track_ids: Dict[str, int] = {name: track_id for track_id, name in enumerate(self.track_names)}
+        self.track_length: List[float] = as_list(track_length)
+        self.track_directions: List[int] = as_list(track_directions)
+        self.offsets: List[int] = as_list(offsets)
+        self.targets: List[int] = as_list(targets)
+        self.weights: List[float] = as_list(weights)
+        self.landmarks: List[int] = as_list(landmarks)
+        self.landmark_from: List[List[float]] = [as_list(row) for row in landmark_from] if landmark_from is not None else []
+        self.landmark_to: List[List[float]] = [as_list(row) for row in landmark_to] if landmark_to is not None else []
+        self.all_pairs = all_pairs if all_pairs is not None and len(all_pairs) else None
+
+        self.route_length = lru_cache(maxsize=cache_size)(self._route_length)
+        self.route = lru_cache(maxsize=cache_size)(self._route)
+
+    @classmethod
+    def from_extraction(
+        cls,
+        track_endpoints: Sequence[Tuple[str, str, str]],
+        data: Dict[str, Any],
+        landmarks: int = 0,
+        all_pairs: bool = False,
+        cache_size: int = DEFAULT_CACHE_SIZE
+    ) -> "RoutingIndex":
+        """
+        Build the index from extracted track data.
+
+        Args:
+            track_endpoints: (track name, start node, end node) in document order,
+                see rnd_extract_connections.extract_connections()
+            data: Extracted data, track lengths and lane circulation ways are used
+            landmarks: Number of landmark distance tables to build
+            all_pairs: Whether to build the all-pairs distance table. It needs
+                (2 * tracks)^2 floats, for small networks only
+            cache_size: Number of memoised queries
+
+        Returns:
+            RoutingIndex instance
+        """
+        track_names = [endpoints[0] for endpoints in track_endpoints]
+        track_length = [data[track_name]["length"] for track_name in track_names]
+        track_directions = [get_track_directions(data[track_name]) for track_name in track_names]
+        offsets, targets, weights = build_state_graph(track_endpoints, track_directions, track_length)
+
+        track_directions = [(forward << FORWARD) | (backward << BACKWARD) for forward, backward in track_directions]
+
+        index = cls(track_names, track_length, track_directions, offsets, targets, weights, cache_size=cache_size)
+        if landmarks:
+            index.build_landmarks(landmarks)
+        if all_pairs:
+            index.build_all_pairs()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.track_names)
+
+    def _states(self, track_name: str) -> List[int]:
+        """Drivable states of a track."""
+        track_id = self.track_ids[track_name]
+        directions = self.track_directions[track_id]
+        return [2 * track_id + direction for direction in (FORWARD, BACKWARD) if directions >> direction & 1]
+
+    def _drivable_states(self) -> List[int]:
+        return [
+            2 * track_id + direction
+            for track_id, directions in enumerate(self.track_directions)
+            for direction in (FORWARD, BACKWARD) if directions >> direction & 1
+        ]
+
+    def build_landmarks(self, count: int) -> None:
+        """
+        Select landmark states and compute their distance tables.
+
+        Landmarks are picked farthest first: each next landmark is the state
+        farthest from the landmarks picked so far, unreachable states first,
+        so every part of the network gets one.
+
+        Args:
+            count: Number of landmarks
+        """
+        reverse = _reverse_graph(self.offsets, self.targets, self.weights)
+        drivable = self._drivable_states()
+        self.landmarks, self.landmark_from, self.landmark_to = [], [], []
+        if not drivable:
+            return
+
+        closest = {state: INF for state in drivable}
+        distances = _shortest_distances(self.offsets, self.targets, self.weights, drivable[0])
+        candidate = max(drivable, key=lambda state: (distances[state] if distances[state] < INF else -1.0, -state))
+
+        for _ in range(min(count, len(drivable))):
+            landmark_from = _shortest_distances(self.offsets, self.targets, self.weights, candidate)
+            self.landmarks.append(candidate)
+            self.landmark_from.append(landmark_from)
+            self.landmark_to.append(_shortest_distances(*reverse, candidate))
+
+            for state in drivable:
+                closest[state] = min(closest[state], landmark_from[state])
+            candidate = max(drivable, key=lambda state: (closest[state], -state))
+            if candidate in self.landmarks:
+                break
+
+        self.route_length.cache_clear()
+        self.route.cache_clear()
+
+    def build_all_pairs(self) -> None:
+        """Compute the distance between every pair of states."""
+        state_count = len(self.offsets) - 1
+        rows = [_shortest_distances(self.offsets, self.targets, self.weights, state) for state in range(state_count)]
+        self.all_pairs = np.array(rows, dtype=np.float64).reshape(state_count, state_count) if np is not None else rows
+
+        self.route_length.cache_clear()
+        self.route.cache_clear()
+
+    def _search(self, origin: str, destination: str) -> Tuple[Optional[int], Dict[int, float], Dict[int, int]]:
+        """
+        A* (Dijkstra without landmarks) from the origin states to the first destination state.
+
+        Distances exclude the origin track, as in the landmark and all-pairs tables.
+        """
+        origin_states = self._states(origin)
+        destination_states = self._states(destination)
+
+        distances: Dict[int, float] = dict()
+        previous: Dict[int, int] = dict()
+        queue = []
+
+        if not destination_states:
+            return None, distances, previous
+
+        # Landmark lower bound of the distance to the closest destination state, INF if unreachable:
+        # d(state, target) >= d(landmark, target) - d(landmark, state) and
+        # d(state, target) >= d(state, landmark) - d(target, landmark)
+        landmark_rows = list(zip(self.landmark_from, self.landmark_to))
+        if len(landmark_rows) > ACTIVE_LANDMARKS and origin_states:
+            # Only the landmarks with the best bounds at the origin are used, the others rarely
+            # tighten the bound and would cost time on every state
+            def origin_bound(row: Tuple[List[float], List[float]]) -> float:
+                landmark_from, landmark_to = row
+                bounds = [0.0]
+                for state in origin_states:
+                    for target in destination_states:
+                        if landmark_from[state] < INF and landmark_from[target] < INF:
+                            bounds.append(landmark_from[target] - landmark_from[state])
+                        if landmark_to[state] < INF and landmark_to[target] < INF:
+                            bounds.append(landmark_to[state] - landmark_to[target])
+                return max(bounds)
+            landmark_rows = sorted(landmark_rows, key=origin_bound, reverse=True)[:ACTIVE_LANDMARKS]
+        target_rows = [[(landmark_from[target], landmark_to[target]) for landmark_from, landmark_to in landmark_rows] for target in destination_states]
+
+        def heuristic(state: int) -> float:
+            if not landmark_rows:
+                return 0.0
+
+            best = INF
+            for target_values in target_rows:
+                bound = 0.0
+                for (landmark_from, landmark_to), (from_target, target_to) in zip(landmark_rows, target_values):
+                    from_state = landmark_from[state]
+                    if from_state < INF:
+                        if from_target == INF:
+                            bound = INF
+                            break
+                        bound = max(bound, from_target - from_state)
+                    if target_to < INF:
+                        state_to = landmark_to[state]
+                        if state_to == INF:
+                            bound = INF
+                            break
+                        bound = max(bound, state_to - target_to)
+                best = min(best, bound)
+            return best
+
+        for state in origin_states:
+            distances[state] = 0.0
+            if state in destination_states:
+                return state, distances, previous
+            estimate = heuristic(state)
+            if estimate < INF:
+                heappush(queue, (estimate, 0.0, state))
+
+        destinations = set(destination_states)
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+
+        while queue:
+            _, distance, state = heappop(queue)
+            if distance > distances[state]:
+                continue
+            if state in destinations:
+                return state, distances, previous
+
+            for edge in range(offsets[state], offsets[state + 1]):
+                target = targets[edge]
+                target_distance = distance + weights[edge]
+                if target_distance < distances.get(target, INF):
+                    estimate = heuristic(target)
+                    if estimate == INF:
+                        continue
+                    distances[target] = target_distance
+                    previous[target] = state
+                    heappush(queue, (target_distance + estimate, target_distance, target))
+
+        return None, distances, previous
+
+    def _route_length(self, origin: str, destination: str) -> Optional[float]:
+        if self.all_pairs is not None:
+            destination_states = self._states(destination)
+            distance = INF
+            for state in self._states(origin):
+                for target in destination_states:
+                    distance = min(distance, 0.0 if state == target else float(self.all_pairs[state][target]))
+        else:
+            state, distances, _ = self._search(origin, destination)
+            distance = distances[state] if state is not None else INF
+
+        if distance == INF:
+            return None
+        return distance + self.track_length[self.track_ids[origin]]
+
+    def _route(self, origin: str, destination: str) -> Optional[Tuple[str, ...]]:
+        state, _, previous = self._search(origin, destination)
+        if state is None:
+            return None
+
+        states = [state]
+        while states[-1] in previous:
+            states.append(previous[states[-1]])
+        return tuple(self.track_names[state >> 1] for state in reversed(states))
+
+    def is_reachable(self, origin: str, destination: str) -> bool:
+        """
+        Check whether a destination track can be driven to from an origin track.
+
+        Args:
+            origin: Origin track name
+            destination: Destination track name
+
+        Returns:
+            True if there is a route
+        """
+        return self.route_length(origin, destination) is not None
+
+    def cache_info(self) -> Dict[str, Any]:
+        """
+        Get the memo counters of route_length() and route().
+
+        Returns:
+            Dictionary mapping query to its lru_cache statistics
+        """
+        return {"route_length": self.route_length.cache_info()._asdict(), "route": self.route.cache_info()._asdict()}
+
+def save_routing_index(index: RoutingIndex, file_path: str) -> None:
+    """
+    Save a routing index as an uncompressed .npz file, see load_routing_index().
+
+    Args:
+        index: Routing index
+        file_path: Output .npz file path
+    """
+    _require_numpy()
+
+    state_count = len(index.offsets) - 1
+    arrays = {
+        "version": np.array([ROUTING_VERSION], dtype=np.int64),
+        "track_names": np.array(index.track_names, dtype=str),
+        "track_length": np.array(index.track_length, dtype=np.float64),
+        "track_directions": np.array(index.track_directions, dtype=np.uint8),
+        "offsets": np.array(index.offsets, dtype=np.int64),
+        "targets": np.array(index.targets, dtype=np.int64),
+        "weights": np.array(index.weights, dtype=np.float64),
+        "landmarks": np.array(index.landmarks, dtype=np.int64),
+        "landmark_from": np.array(index.landmark_from, dtype=np.float64).reshape(len(index.landmarks), state_count),
+        "landmark_to": np.array(index.landmark_to, dtype=np.float64).reshape(len(index.landmarks), state_count),
+        "all_pairs": np.asarray(index.all_pairs if index.all_pairs is not None else np.empty((0, 0)), dtype=np.float64),
+    }
+
+    output_path = Path(file_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Stored members can be mapped in place, see terrain_columns.map_npz_members()
+    with open(output_path, "wb") as f:
+        np.savez(f, **arrays)
+
+def load_routing_index(file_path: str, cache_size: int = DEFAULT_CACHE_SIZE) -> RoutingIndex:
+    """
+    Load a routing index written by save_routing_index().
+
+    The file is memory-mapped. The graph and landmark tables are copied into
+    lists for the searches, the all-pairs table stays a view into the file.
+
+    Args:
+        file_path: Input .npz file path
+        cache_size: Number of memoised queries
+
+    Returns:
+        RoutingIndex instance
+
+    Raises:
+        ValueError: If the file has an unsupported format version
+    """
+    _require_numpy()
+
+    with open(file_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    arrays = map_npz_members(buffer, file_path)
+
+    if int(arrays["version"][0]) != ROUTING_VERSION:
+        raise ValueError(f"Unsupported routing index version {int(arrays['version'][0])} in {file_path}")
+
+    return RoutingIndex(
+        arrays["track_names"], arrays["track_length"], arrays["track_directions"],
+        arrays["offsets"], arrays["targets"], arrays["weights"],
+        arrays["landmarks"], arrays["landmark_from"], arrays["landmark_to"], arrays["all_pairs"],
+        cache_size=cache_size
+    )
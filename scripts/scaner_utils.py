@@ -0,0 +1,54 @@
+"""
+Library API of the SCANeR utility scripts.
+
+Importing this module does no work: every function is imported from its
+script module (and lxml, numpy, ... with it) on first access, and no
+argument parsing happens outside the scripts' main(). Files can be given
+as paths, bytes or parsed lxml trees.
+
+    import scaner_utils
+
+    data = scaner_utils.extract_connections("btc_lrn.rnd")
+    scaner_utils.fix_import("btc_lrn.rnd", "btc_lrn_fixed.rnd")
+    scaner_utils.name_portions("btc_lrn_fixed.rnd", "btc_lrn_named.rnd")
+    root, changed = scaner_utils.set_initial_speed("scenario.sce", None, 100, False, False)
+    root, stats = scaner_utils.merge_configuration("configs/configuration_de.xml", root, "scenario_de.sce")
+"""
+
+import importlib
+
+# Public name -> module it is defined in
+_EXPORTS = {
+    'extract_connections': 'rnd_extract_connections',
+    'save_extraction': 'rnd_extract_connections',
+    'filter_lane_types': 'rnd_extract_connections',
+    'fix_import': 'rnd_import_fix',
+    'name_portions': 'rnd_name_portions',
+    'set_initial_speed': 'scenario_set_initial_speed',
+    'edit_vehicles': 'scenario_vehicle_editor',
+    'load_vehicle_rules': 'scenario_vehicle_editor',
+    'merge_configuration': 'scenario_generator',
+    'run_pipeline': 'rnd_pipeline',
+    'load_columns': 'terrain_columns',
+    'RoadGraph': 'road_graph',
+    'RoutingIndex': 'road_routing',
+    'load_routing_index': 'road_routing',
+    'LanePositionIndex': 'lane_positions',
+    'load_position_index': 'lane_positions',
+    'TerrainModel': 'terrain_model',
+    'load_terrain_model': 'terrain_model',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    # Later lookups find the attribute directly
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
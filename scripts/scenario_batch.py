@@ -0,0 +1,198 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from copy import deepcopy
+from itertools import groupby
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import load_xml_tree
+from scenario_generator import apply_patch_plan, load_patch_plan, write_scenario
+
+# Per-worker cache of loaded configurations, shared by all scenarios the worker merges
+_patch_plans: Dict[str, Dict[str, Any]] = {}
+
+def get_job_output(configuration_file: str, scenario_input_file: str, output_dir: Optional[str]) -> str:
+    """
+    Build the default output path of a batch job.
+
+    The configuration file stem without its 'configuration_' prefix is appended
+    to the scenario file stem, e.g. scenario_si.sce + configuration_de.xml ->
+    scenario_si_de.sce.
+
+    Args:
+        configuration_file: Configuration XML file path
+        scenario_input_file: Input scenario file path
+        output_dir: Output directory (defaults to the input scenario directory)
+
+    Returns:
+        Output scenario file path
+    """
+    scenario_path = Path(scenario_input_file)
+    config_name = Path(configuration_file).stem.replace("configuration_", "", 1)
+    directory = Path(output_dir) if output_dir else scenario_path.parent
+    return str(directory / f"{scenario_path.stem}_{config_name}{scenario_path.suffix}")
+
+def load_manifest(manifest_file: str, output_dir: Optional[str]) -> List[Tuple[str, str, str]]:
+    """
+    Load batch jobs from a JSON manifest.
+
+    The manifest is a list of objects with "config" and "input" keys and an
+    optional "output" key.
+
+    Args:
+        manifest_file: Manifest file path
+        output_dir: Output directory for jobs without an explicit output
+
+    Returns:
+        List of (configuration file, input scenario file, output scenario file) jobs
+    """
+    with open(manifest_file, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    return [
+        (entry["config"], entry["input"], entry.get("output") or get_job_output(entry["config"], entry["input"], output_dir))
+        for entry in entries
+    ]
+
+def run_job(job: Tuple[str, str, str], template: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    Merge one configuration into one scenario, reusing configurations parsed earlier by this worker.
+
+    Args:
+        job: (configuration file, input scenario file, output scenario file)
+        template: Parsed root of the input scenario, left untouched (parsed from the input file if None)
+
+    Returns:
+        Job result with timing and merge statistics, or the error
+    """
+    configuration_file, scenario_input_file, scenario_output_file = job
+    start = time.perf_counter()
+
+    try:
+        plan = _patch_plans.get(configuration_file)
+        if plan is None:
+            plan = load_patch_plan(configuration_file)
+            _patch_plans[configuration_file] = plan
+
+        # The template must stay untouched for the next configuration
+        scenario_root = deepcopy(template) if template is not None else load_xml_tree(scenario_input_file)[1]
+        stats = apply_patch_plan(plan, scenario_root, verbose=False)
+        write_scenario(scenario_root, scenario_output_file)
+
+        return {"job": job, "seconds": time.perf_counter() - start, "stats": stats, "error": None}
+
+    except Exception as e:
+        return {"job": job, "seconds": time.perf_counter() - start, "stats": None, "error": f"{type(e).__name__}: {e}"}
+
+def run_scenario_jobs(jobs: List[Tuple[str, str, str]]) -> List[Dict[str, Any]]:
+    """
+    Merge several configurations into the same scenario, parsing the scenario once.
+
+    Worker output is silenced, progress is reported by the parent process.
+
+    Args:
+        jobs: (configuration file, input scenario file, output scenario file) jobs sharing one input scenario
+
+    Returns:
+        Job results, in the order of jobs
+    """
+    start = time.perf_counter()
+
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        try:
+            template = load_xml_tree(jobs[0][1])[1]
+        except Exception as e:
+            # Every job of the scenario fails the same way, the parse time is charged to the first
+            error = f"{type(e).__name__}: {e}"
+            seconds = time.perf_counter() - start
+            return [
+                {"job": job, "seconds": seconds if index == 0 else 0.0, "stats": None, "error": error}
+                for index, job in enumerate(jobs)
+            ]
+        parse_time = time.perf_counter() - start
+
+        results = [run_job(job, template) for job in jobs]
+
+    results[0]["seconds"] += parse_time
+    return results
+
+def run_batch(jobs: List[Tuple[str, str, str]], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Run merge jobs across a process pool and report per-job timing and a summary.
+
+    Args:
+        jobs: List of (configuration file, input scenario file, output scenario file)
+        workers: Number of worker processes (defaults to CPU count)
+
+    Returns:
+        Job results, ordered by input scenario
+    """
+    # All jobs on the same scenario go to the same worker in one task
+    jobs = sorted(jobs, key=lambda job: job[1])
+    scenario_jobs = [list(group) for _, group in groupby(jobs, key=lambda job: job[1])]
+    workers = workers or os.cpu_count() or 1
+
+    print(f"Jobs: {len(jobs)}, workers: {workers}\n")
+
+    results = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        scenario_results = executor.map(run_scenario_jobs, scenario_jobs)
+        for index, result in enumerate((result for group in scenario_results for result in group), start=1):
+            configuration_file, scenario_input_file, scenario_output_file = result["job"]
+            if result["error"]:
+                print(f"[{index}/{len(jobs)}] FAILED {configuration_file} + {scenario_input_file}: {result['error']}")
+            else:
+                stats = result["stats"]
+                print(
+                    f"[{index}/{len(jobs)}] {configuration_file} + {scenario_input_file} -> {scenario_output_file} "
+                    f"({result['seconds']:.2f}s, updated {stats['elements_updated']}, unmatched {len(stats['unmatched_entries'])})"
+                )
+            results.append(result)
+
+    wall_time = time.perf_counter() - start
+    job_time = sum(result["seconds"] for result in results)
+    failed = sum(1 for result in results if result["error"])
+
+    # Summary
+    print(f"\nJobs succeeded: {len(results) - failed}")
+    print(f"Jobs failed: {failed}")
+    print(f"Total job time: {job_time:.2f}s")
+    print(f"Wall time: {wall_time:.2f}s")
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge many configuration XML files into many scenario files in parallel.")
+    parser.add_argument("-c", "--configs", required=False, nargs='+', type=str, help="Configuration XML file paths.")
+    parser.add_argument("-i", "--inputs", required=False, nargs='+', type=str, help="Input scenario .sce file paths.")
+    parser.add_argument("-m", "--manifest", required=False, type=str, help="JSON manifest with a list of {\"config\", \"input\", \"output\"} jobs (used instead of --configs/--inputs).")
+    parser.add_argument("-o", "--output_dir", required=False, type=str, help="Output directory (defaults to each input directory). Outputs are named <input>_<config>.sce.")
+    parser.add_argument("-j", "--jobs", required=False, type=int, help="Number of worker processes (defaults to CPU count).")
+
+    args = parser.parse_args()
+
+    if args.manifest:
+        jobs = load_manifest(args.manifest, args.output_dir)
+    elif args.configs and args.inputs:
+        jobs = [
+            (config, scenario, get_job_output(config, scenario, args.output_dir))
+            for scenario in args.inputs
+            for config in args.configs
+        ]
+    else:
+        parser.error("either --manifest or both --configs and --inputs are required")
+
+    results = run_batch(jobs, args.jobs)
+
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""Resident scenario tools server with a cache of parsed configurations and scenarios."""
+
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import argparse
+import io
+import ipaddress
+import json
+import os
+import signal
+import socketserver
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils import load_xml_tree
+from scenario_generator import (
+    IDENTIFIER_TAGS,
+    apply_patch_plan,
+    build_scenario_index,
+    compile_configuration,
+    restore_changes,
+    write_scenario,
+    write_scenario_changes
+)
+from scenario_set_initial_speed import set_initial_speed
+
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE_MB = 512
+
+def _is_loopback_host(host: str) -> bool:
+    """Check that a Host header names a loopback address, with or without a port."""
+    if host.startswith("["):
+        host = host[1:].split("]", 1)[0]
+    elif host.count(":") == 1:
+        host = host.split(":", 1)[0]
+
+    if host.lower() == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class DocumentCache:
+    """
+    LRU cache of values loaded from files, invalidated when the file changes.
+
+    Entries are keyed by kind and path and cost their file size. The least
+    recently used entries are evicted once the total size exceeds max_bytes.
+    A file whose modification time or size differs from when it was loaded is
+    loaded again.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: Cache size limit in bytes of cached files
+        """
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[Tuple[int, int], int, Any]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, kind: str, path: str, load: Callable[[str], Any]) -> Any:
+        """
+        Get the cached value of a file, loading it on a miss.
+
+        Args:
+            kind: Kind of value, files can be cached as more than one kind
+            path: File path
+            load: Function that loads the value from the path
+
+        Returns:
+            Cached value
+        """
+        key = (kind, os.path.abspath(path))
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == version:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[2]
+            self.invalidations += 1
+            self._remove(key)
+
+        self.misses += 1
+        value = load(path)
+        self.entries[key] = (version, stat.st_size, value)
+        self.size += stat.st_size
+
+        # The entry just added is kept even if it alone exceeds the limit
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+        return value
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def clear(self) -> None:
+        """Remove all entries, counters are kept."""
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the cache counters.
+
+        Returns:
+            Dictionary with hits, misses, invalidations, evictions, entries, size and max size in bytes
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes
+        }
+
+def _load_patch_plan(configuration_file: str) -> Dict[str, Any]:
+    return compile_configuration(load_xml_tree(configuration_file)[1], IDENTIFIER_TAGS)
+
+def _load_scenario(scenario_file: str) -> Dict[str, Any]:
+    # Scenario indexes are built on first use, per identifier tags
+    return {"root": load_xml_tree(scenario_file)[1], "indexes": {}}
+
+class ScenarioTools:
+    """
+    Scenario tool requests served from a DocumentCache.
+
+    Configurations are cached as compiled patch plans and scenarios as parsed
+    templates with their identifier index. Merges are applied to the template
+    itself and undone once the output is written, speed setting works on a
+    copy, so cached scenarios are left as loaded.
+    """
+
+    def __init__(self, cache: DocumentCache):
+        self.cache = cache
+
+    def merge(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Merge a configuration into a scenario, see scenario_generator.py.
+
+        Args:
+            request: "config" and "input" file paths, optional "output" (defaults to
+                input filename with _generated suffix), "verbose" and "patch"
+                (see scenario_generator.write_scenario_changes())
+
+        Returns:
+            Output path and merge statistics
+        """
+        plan = self.cache.get("configuration", request["config"], _load_patch_plan)
+        scenario = self.cache.get("scenario", request["input"], _load_scenario)
+        output_file = request.get("output") or request["input"].replace(".sce", "_generated.sce")
+
+        identifier_tags = tuple(plan["identifier_tags"])
+        if identifier_tags not in scenario["indexes"]:
+            scenario["indexes"][identifier_tags] = build_scenario_index(scenario["root"], identifier_tags)
+
+        changes = []
+        try:
+            stats = apply_patch_plan(
+                plan, scenario["root"], request.get("verbose", False),
+                scenario_index=scenario["indexes"][identifier_tags], changes=changes
+            )
+            if request.get("patch", False):
+                write_scenario_changes(scenario["root"], request["input"], output_file, changes)
+            else:
+                write_scenario(scenario["root"], output_file)
+        finally:
+            restore_changes(changes)
+
+        return {"output": output_file, "stats": stats}
+
+    def set_initial_speed(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Set initial speed of vehicles in a scenario, see scenario_set_initial_speed.py.
+
+        Args:
+            request: "input" file path, "speed" in km/h, optional "output" (defaults to
+                input filename with _initial_speed_set suffix), "swarm_only" and "verbose"
+
+        Returns:
+            Output path and number of vehicles changed
+        """
+        scenario_root = deepcopy(self.cache.get("scenario", request["input"], _load_scenario)["root"])
+        output_file = request.get("output") or request["input"].replace(".sce", "_initial_speed_set.sce")
+
+        _, vehicles_changed = set_initial_speed(
+            scenario_root, output_file, float(request["speed"]),
+            request.get("swarm_only", False), request.get("verbose", False)
+        )
+
+        return {"output": output_file, "vehicles_changed": vehicles_changed}
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP interface of ScenarioTools.
+
+    POST /merge and POST /set_initial_speed take the request as a JSON body and
+    answer with the result, the printed log and the time taken. GET /stats
+    returns the cache counters, POST /clear empties the cache.
+
+    Requests write files as the user running the server, so only local,
+    non-browser clients are served: requests with an Origin header, with a
+    Host that is not a loopback address (on TCP) and POSTs that are not
+    application/json, which browsers cannot send cross-origin without a
+    preflight, are refused.
+    """
+
+    tools: ScenarioTools
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _refuse_request(self) -> bool:
+        """Answer requests that may come from a browser page with an error, returns True if refused."""
+        if self.headers.get("Origin") is not None:
+            self._send(403, {"error": "Cross-origin requests are not allowed"})
+            return True
+
+        # Unix socket clients have no address and send any Host
+        if isinstance(self.client_address, tuple) and not _is_loopback_host(self.headers.get("Host", "")):
+            self._send(403, {"error": f"Host is not a loopback address: {self.headers.get('Host', '')}"})
+            return True
+
+        if self.command == "POST":
+            content_type = self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+            if content_type != "application/json":
+                self._send(415, {"error": f"Content-Type must be application/json, not {content_type or 'missing'}"})
+                return True
+
+        return False
+
+    def do_GET(self) -> None:
+        if self._refuse_request():
+            return
+        if self.path == "/stats":
+            self._send(200, self.tools.cache.stats())
+        else:
+            self._send(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self) -> None:
+        # Path -> (operation, required request fields)
+        operations = {
+            "/merge": (self.tools.merge, ("config", "input")),
+            "/set_initial_speed": (self.tools.set_initial_speed, ("input", "speed")),
+        }
+
+        if self._refuse_request():
+            return
+        if self.path == "/clear":
+            self.tools.cache.clear()
+            self._send(200, self.tools.cache.stats())
+            return
+        if self.path not in operations:
+            self._send(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON request: {e}"})
+            return
+
+        operation, required_fields = operations[self.path]
+        missing_fields = [field for field in required_fields if field not in request]
+        if missing_fields:
+            self._send(400, {"error": f"Missing request fields: {', '.join(missing_fields)}"})
+            return
+
+        start = time.perf_counter()
+        log = io.StringIO()
+        try:
+            with redirect_stdout(log):
+                result = operation(request)
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}", "log": log.getvalue()})
+            return
+
+        result["log"] = log.getvalue()
+        result["seconds"] = time.perf_counter() - start
+        self._send(200, result)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        print(f"{self.log_date_time_string()} {self.address_string()} {format % args}")
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTP server on a Unix domain socket, only the owner can connect."""
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+def create_server(tools: ScenarioTools, host: str = "127.0.0.1", port: int = DEFAULT_PORT, socket_path: Optional[str] = None) -> socketserver.BaseServer:
+    """
+    Create the HTTP server, on a Unix socket if socket_path is given.
+
+    Requests are handled one at a time, so cached trees are never used by two
+    requests at once.
+
+    Args:
+        tools: Request handlers with their cache
+        host: Host to listen on
+        port: Port to listen on
+        socket_path: Unix socket path, used instead of host and port
+
+    Returns:
+        Server, run it with serve_forever()
+    """
+    handler = type("RequestHandler", (_RequestHandler,), {"tools": tools})
+
+    if socket_path:
+        return UnixHTTPServer(socket_path, handler)
+    return HTTPServer((host, port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident scenario generator and initial speed server with a parsed document cache.")
+    parser.add_argument("--host", required=False, type=str, default="127.0.0.1", help="Host to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", required=False, type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT}).")
+    parser.add_argument("--socket", required=False, type=str, help="Unix socket path to listen on instead of host and port.")
+    parser.add_argument("--cache_size", required=False, type=int, default=DEFAULT_CACHE_SIZE_MB, help=f"Cache size limit in MB of cached files (default: {DEFAULT_CACHE_SIZE_MB}).")
+    args = parser.parse_args()
+
+    tools = ScenarioTools(DocumentCache(args.cache_size * 1024 * 1024))
+    server = create_server(tools, args.host, args.port, args.socket)
+    print(f"Listening on {args.socket or f'http://{args.host}:{args.port}'}")
+
+    # Stop cleanly on kill as well, so the socket file is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,42 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree
+from pathlib import Path
 import argparse
-from typing import Optional, DefaultDict
+import hashlib
+import io
+import json
+import os
+from typing import Any, BinaryIO, Optional, DefaultDict, Dict, List, Tuple, Union
 
+from instrumentation import add_arguments, count, instrumented, phase
 from utils import (
     load_xml_tree,
-    format_xml_output,
-    save_xml
+    parse_xml_source,
+    patch_xml_text,
+    scan_child_elements,
+    serialize_children,
+    write_xml
 )
 
+# Configuration constants
+IDENTIFIER_TAGS = ('name', 'id')
+SELF_CLOSING_EXCEPTIONS = ['Simple', 'Model', 'ScanerNetRecorder', 'UserDataList', 'CustomData', 'Intermediate']
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>\n'
+ENCODING = 'UTF-8'
+
+# Patch plans are cached per configuration content, bump the version when the plan format changes
+PATCH_PLAN_VERSION = 1
+DEFAULT_PLAN_CACHE_DIR = str(Path.home() / ".cache" / "scaner-utils" / "patch_plans")
+
+# Scenario children that merge_configuration_sharded() splits across worker processes
+SHARD_PARENT = 'Scenario'
+SHARD_TAGS = ('Vehicle', 'Image', 'Sound')
+# Shards per worker, smaller shards even out the load
+SHARDS_PER_WORKER = 4
+# Stands in for a shard in the rest of the document
+SHARD_PLACEHOLDER = b'<?scaner-shard?>'
+
 def get_identifier_tag(element: etree._Element, identifier_tags: tuple = ('name', 'id')) -> Optional[str]:
     """
     Determine which identifier tag ('name' or 'id') the element uses.
@@ -63,214 +91,782 @@ def get_element_path(element: etree._Element, root: etree._Element) -> str:
     
     return f"./{'/'.join(parts)}" if parts else "."
 
-def update_scenario_element(
-    config_element: etree._Element,
-    scenario_element: etree._Element,
-    identifier_tag: str,
-    tag_stats: Optional[DefaultDict[str, int]],
-    verbose: bool = True
-) -> int:
+def build_scenario_index(
+    scenario_root: etree._Element,
+    identifier_tags: tuple = ('name', 'id')
+) -> Dict[Tuple[str, str, Optional[str]], etree._Element]:
     """
-    Update scenario element's children with values from config element.
+    Index identifiable scenario elements in a single pass.
 
-    The update runs recursively so nested elements (e.g. Flow/distribution) are
-    also synchronized.
+    Every element with an identifier child is registered under each identifier
+    tag it carries. Paths use the same format as get_element_path(), and the
+    first element in document order wins, matching the findall() scan it replaces.
     
     Args:
-        config_element: Source element from configuration
-        scenario_element: Target element in scenario
-        identifier_tag: Tag name of the identifier (to skip updating at root)
-        tag_stats: Accumulator for tag update counts (path -> count)
-        verbose: Whether to print update information
+        scenario_root: Root element of the scenario
+        identifier_tags: Tuple of possible identifier tags
         
     Returns:
-        Number of elements updated
+        Dictionary mapping (path, identifier tag, identifier value) to element
     """
+    index: Dict[Tuple[str, str, Optional[str]], etree._Element] = {}
+
+    def _index_element(element: etree._Element, path: str) -> int:
+        # Returns the number of elements visited below element
+        visited = 0
+        seen_tags = set()
+        for child in element:
+            if not isinstance(child.tag, str):
+                continue
 
-    skip_tags = {identifier_tag} if identifier_tag else set()
-    return _update_element_recursive(
-        config_element,
-        scenario_element,
-        skip_tags,
-        tag_stats,
-        verbose,
-        config_element.tag,
-        depth=0
-    )
+            if child.tag in identifier_tags and child.tag not in seen_tags:
+                seen_tags.add(child.tag)
+                index.setdefault((path, child.tag, child.text), element)
 
+            visited += 1 + _index_element(child, f"{path}/{child.tag}")
+        return visited
 
-def _update_element_recursive(
+    with phase("index"):
+        count("elements indexed", 1 + _index_element(scenario_root, "."))
+    return index
+
+def _collect_element_updates(
     config_element: etree._Element,
-    scenario_element: etree._Element,
     skip_tags: set,
-    tag_stats: Optional[DefaultDict[str, int]],
-    verbose: bool,
     path: str,
-    depth: int
-) -> int:
-    """Recursively copy text values from config_element into scenario_element."""
-
-    updated_count = 0
+    depth: int,
+    updates: List[List[Optional[str]]]
+) -> None:
+    """Recursively flatten config_element's leaf values into [child path, text] pairs."""
 
     for config_child in config_element:
-        if not isinstance(config_child, etree._Element):
+        if not isinstance(config_child.tag, str):
             continue
 
         if depth == 0 and config_child.tag in skip_tags:
             continue
 
-        scenario_child = scenario_element.find(config_child.tag)
+        child_path = f"{path}/{config_child.tag}" if path else config_child.tag
+
+        has_element_children = any(isinstance(sub_child.tag, str) for sub_child in config_child)
 
-        if scenario_child is None:
+        if has_element_children:
+            _collect_element_updates(config_child, skip_tags, child_path, depth + 1, updates)
             continue
 
-        child_path = f"{path}/{config_child.tag}" if path else config_child.tag
+        updates.append([child_path, config_child.text])
 
-        has_element_children = any(isinstance(sub_child, etree._Element) for sub_child in config_child)
+def compile_configuration(config_root: etree._Element, identifier_tags: tuple = IDENTIFIER_TAGS) -> Dict[str, Any]:
+    """
+    Compile a configuration into a serialisable patch plan.
 
-        if has_element_children:
-            updated_count += _update_element_recursive(
-                config_child,
-                scenario_child,
-                skip_tags,
-                tag_stats,
-                verbose,
-                child_path,
-                depth + 1
-            )
+    Every identifiable configuration element becomes one operation
+    [path, identifier tag, identifier value, [[child path, text], ...]].
+    Nested children are flattened into child paths (e.g. Flow/distribution),
+    so applying the plan needs neither the configuration tree nor recursion.
+    Ground is matched by path only and has no identifier tag.
+    
+    Args:
+        config_root: Root element of the configuration
+        identifier_tags: Tuple of possible identifier tags
+        
+    Returns:
+        Patch plan dictionary (JSON serialisable)
+    """
+    operations = []
+
+    for element in config_root.iter():
+        
+        # Skip non-identifiable elements
+        if not is_element_identifiable(element, identifier_tags):
+            continue
+
+        element_path = get_element_path(element, config_root)
+
+        # Ground
+        if element.tag == 'Ground':
+            ground_name = element.find('name')
+            if ground_name is None:
+                print(f"Warning: Ground element without name in configuration, skipped")
+                continue
+            operations.append([element_path, None, None, [['name', ground_name.text]]])
+            continue
+
+        identifier_tag = get_identifier_tag(element, identifier_tags)
+        identifier_value = element.find(identifier_tag).text
+
+        updates: List[List[Optional[str]]] = []
+        _collect_element_updates(element, {identifier_tag}, "", 0, updates)
+        operations.append([element_path, identifier_tag, identifier_value, updates])
+
+    return {
+        "version": PATCH_PLAN_VERSION,
+        "root_tag": config_root.tag,
+        "identifier_tags": list(identifier_tags),
+        "operations": operations
+    }
+
+def _find_child_path(element: etree._Element, child_path: str) -> Optional[etree._Element]:
+    """Follow a child path one tag at a time, taking the first child with each tag."""
+    for tag in child_path.split('/'):
+        element = element.find(tag)
+        if element is None:
+            return None
+    return element
+
+def _diff_operations(
+    plan: Dict[str, Any],
+    scenario_root: etree._Element,
+    scenario_index: Dict[Tuple[str, str, Optional[str]], etree._Element]
+) -> List[Tuple[Optional[str], Any, int]]:
+    """
+    Resolve every operation of a patch plan against a parsed scenario.
+
+    Returns:
+        (entry label, [(element, tag path or None for Ground, old text, new text), ...],
+        fields unchanged) per operation in plan order. The label is None for an
+        operation without a scenario element, with the unmatched entry in place of
+        the updates, or None for a Ground operation
+    """
+
+    # Paths keep the configuration root tag if it differs from the scenario root
+    path_prefix = "" if plan["root_tag"] == scenario_root.tag else f"/{plan['root_tag']}"
+
+    outcomes = []
+
+    # Texts as left by earlier updates, when the plan sets a field more than once
+    pending_texts: Dict[etree._Element, Optional[str]] = dict()
+
+    for element_path, identifier_tag, identifier_value, entry_updates in plan["operations"]:
+
+        count("patch operations")
+        element_path = f".{path_prefix}{element_path[1:]}"
+        element_tag = element_path.rsplit('/', 1)[-1]
+        
+        # Ground
+        if identifier_tag is None:
+            ground_element = scenario_root.find(element_path)
+            ground_element_name = ground_element.find('name') if ground_element is not None else None
+            if ground_element_name is None:
+                outcomes.append((None, None, 0))
+                continue
+            label = "Ground"
+            fields = [(ground_element_name, None, entry_updates[0][1])]
+
+        # Find by identifier
+        else:
+            scenario_element = scenario_index.get((element_path, identifier_tag, identifier_value))
+            if scenario_element is None:
+                outcomes.append((None, f"{element_path}({identifier_tag}={identifier_value})", 0))
+                continue
+
+            label = f"{element_tag}({identifier_tag}={identifier_value})"
+            fields = []
+            for child_path, text in entry_updates:
+                scenario_child = _find_child_path(scenario_element, child_path)
+                if scenario_child is not None:
+                    fields.append((scenario_child, f"{element_tag}/{child_path}", text))
+
+        element_updates = []
+        fields_unchanged = 0
+        for scenario_child, tag_path, text in fields:
+            old_text = pending_texts.get(scenario_child, scenario_child.text)
+            if old_text == text:
+                if tag_path is not None:
+                    fields_unchanged += 1
+                continue
+            pending_texts[scenario_child] = text
+            element_updates.append((scenario_child, tag_path, old_text, text))
+
+        outcomes.append((label, element_updates, fields_unchanged))
+
+    return outcomes
+
+def _change_set(outcomes: List[Tuple[Optional[str], Any, int]]) -> Dict[str, Any]:
+    """Sum up the operation outcomes of _diff_operations() into a change set, see diff_patch_plan()."""
+    updates = []
+    elements_unchanged = 0
+    fields_unchanged = 0
+    unmatched_entries = []
+    tag_update_counts: DefaultDict[str, int] = defaultdict(int)
+
+    for label, element_updates, unchanged in outcomes:
+        if label is None:
+            if element_updates is not None:
+                unmatched_entries.append(element_updates)
+            continue
+
+        fields_unchanged += unchanged
+        if not element_updates:
+            elements_unchanged += 1
             continue
 
-        old_text = scenario_child.text
-        scenario_child.text = config_child.text
-        updated_count += 1
+        updates.append((label, element_updates))
+        for _, tag_path, _, _ in element_updates:
+            if tag_path is not None:
+                tag_update_counts[tag_path] += 1
+
+    return {
+        "updates": updates,
+        "elements_processed": len(outcomes),
+        "elements_updated": len(updates),
+        "elements_unchanged": elements_unchanged,
+        "fields_unchanged": fields_unchanged,
+        "tag_update_counts": dict(tag_update_counts),
+        "unmatched_entries": unmatched_entries
+    }
+
+def diff_patch_plan(
+    plan: Dict[str, Any],
+    scenario_root: etree._Element,
+    scenario_index: Optional[Dict[Tuple[str, str, Optional[str]], etree._Element]] = None
+) -> Dict[str, Any]:
+    """
+    Compare a compiled patch plan with a parsed scenario, without changing it.
+
+    Every operation is resolved against the scenario index and its child values
+    are compared with the scenario's. Values the scenario already has are left
+    out, so the change set holds only the updates that change a text.
+
+    Args:
+        plan: Patch plan from compile_configuration()
+        scenario_root: Root element of the scenario
+        scenario_index: Index of the scenario built by build_scenario_index() with the
+            plan's identifier tags, built here if None
+
+    Returns:
+        Change set: updates (list of (entry label, [(element, tag path or None for
+        Ground, old text, new text), ...]) in plan order), elements_processed,
+        elements_updated, elements_unchanged (matched without changes),
+        fields_unchanged, tag_update_counts (path -> count, without Ground) and
+        unmatched_entries
+    """
+
+    # Index scenario once, lookups below are constant time
+    if scenario_index is None:
+        scenario_index = build_scenario_index(scenario_root, tuple(plan["identifier_tags"]))
 
-        if tag_stats is not None:
-            tag_stats[child_path] += 1
+    return _change_set(_diff_operations(plan, scenario_root, scenario_index))
 
+def apply_patch_plan(
+    plan: Dict[str, Any],
+    scenario_root: etree._Element,
+    verbose: bool = True,
+    scenario_index: Optional[Dict[Tuple[str, str, Optional[str]], etree._Element]] = None,
+    changes: Optional[List[Tuple[etree._Element, Optional[str]]]] = None
+) -> Dict[str, Any]:
+    """
+    Apply a compiled patch plan to a parsed scenario in place.
+
+    Only the updates of diff_patch_plan() are applied, values the scenario
+    already has are not set again.
+    
+    Args:
+        plan: Patch plan from compile_configuration()
+        scenario_root: Root element of the scenario (modified in place)
+        verbose: Whether to print detailed information
+        scenario_index: Index of the scenario built by build_scenario_index() with the
+            plan's identifier tags, built here if None
+        changes: List that (element, previous text) is appended to for every text set,
+            see restore_changes()
+        
+    Returns:
+        Merge statistics: elements_processed, elements_updated, elements_unchanged,
+        fields_unchanged, tag_update_counts (path -> count) and unmatched_entries
+    """
+    change_set = diff_patch_plan(plan, scenario_root, scenario_index)
+
+    for label, element_updates in change_set.pop("updates"):
         if verbose:
-            print(f"{child_path}: {old_text} -> {config_child.text}\n")
+            print(label)
+
+        for scenario_child, tag_path, old_text, text in element_updates:
+            if changes is not None:
+                changes.append((scenario_child, old_text))
+            scenario_child.text = text
+            count("fields updated")
+
+            if verbose:
+                print(f"{tag_path or 'name'}: {old_text} -> {text}\n")
+
+    return change_set
+
+def restore_changes(changes: List[Tuple[etree._Element, Optional[str]]]) -> None:
+    """
+    Undo the text changes recorded by apply_patch_plan(), newest first.
+
+    Args:
+        changes: (element, previous text) list filled by apply_patch_plan()
+    """
+    for element, text in reversed(changes):
+        element.text = text
+
+def _shard_ranges(data: bytes, elements: List[Tuple[int, int]], shards: int) -> List[Tuple[int, int]]:
+    """
+    Group consecutive sibling elements into byte ranges of similar size.
+
+    A range starts with the whitespace before its first element and never
+    spans anything but whitespace between elements.
+    """
+    target_size = sum(end - start for start, end in elements) / max(1, shards)
+    ranges = []
+    previous_end = None
+
+    for start, end in elements:
+        adjacent = previous_end is not None and not data[previous_end:start].strip(b' \t\r\n')
+        if adjacent and ranges[-1][1] - ranges[-1][0] < target_size:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            range_start = previous_end if adjacent else start
+            while not adjacent and range_start > 0 and data[range_start - 1] in b' \t\r\n':
+                range_start -= 1
+            ranges.append((range_start, end))
+        previous_end = end
+
+    return ranges
+
+def _merge_shard(task: Tuple[str, bytes, int, int, bytes, Dict[str, Any]]) -> Tuple[Optional[bytes], List[Tuple[int, str, list, int]]]:
+    """
+    Merge a patch plan into a byte range of Scenario children in a worker process.
+
+    The range is parsed between the root and Scenario start and end tags, so
+    element paths are the same as in the whole scenario.
+
+    Args:
+        task: (scenario file path, document up to the root start tag followed by
+            the Scenario start tag, start offset, end offset, Scenario and root
+            end tags, patch plan)
+
+    Returns:
+        Tuple of (merged range serialized as in the whole scenario, None if it
+        cannot be, see utils.serialize_children(); (operation number, entry label,
+        [(None, tag path, old text, new text), ...], fields unchanged) of every
+        operation matched in the range)
+    """
+    file_path, head, start, end, tail, plan = task
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start)
+
+    root = etree.fromstring(head + content + tail)
+    outcomes = _diff_operations(plan, root, build_scenario_index(root, tuple(plan["identifier_tags"])))
+
+    matched = []
+    for number, (label, element_updates, fields_unchanged) in enumerate(outcomes):
+        if label is None:
+            continue
+        for scenario_child, _, _, text in element_updates:
+            scenario_child.text = text
+        matched.append((number, label, [(None, tag_path, old_text, text) for _, tag_path, old_text, text in element_updates], fields_unchanged))
+
+    return serialize_children(root[0], SELF_CLOSING_EXCEPTIONS, ENCODING), matched
+
+def merge_configuration_sharded(
+    plan: Dict[str, Any],
+    scenario_input_file: str,
+    workers: Optional[int] = None
+) -> Optional[Tuple[Dict[str, Any], etree._Element, List[bytes]]]:
+    """
+    Merge a patch plan into a scenario file across a process pool.
+
+    The file is pre-scanned for the byte ranges of the Vehicle, Image and Sound
+    children of Scenario (see utils.scan_child_elements()). Shards of
+    consecutive children are merged and serialized in worker processes, the
+    rest of the scenario is parsed with a placeholder for every shard and
+    merged here. Write the result with write_sharded_scenario(); it is byte
+    for byte what a single process merge writes.
+
+    Sharding is given up (None is returned) if the children do not sit directly
+    in Scenario, an identifier is found in more than one shard, or the
+    children would be indented by depth (a scenario without whitespace between
+    its elements).
 
-    return updated_count
+    Args:
+        plan: Patch plan from compile_configuration()
+        scenario_input_file: Path to input scenario file
+        workers: Number of worker processes (defaults to CPU count)
+
+    Returns:
+        Tuple of (change set, see diff_patch_plan(), with None in place of the
+        elements of sharded updates; merged root of the rest of the scenario;
+        serialized shards in document order), or None if the scenario cannot
+        be sharded
+    """
+    workers = workers or os.cpu_count() or 1
+
+    with phase("scan"):
+        data = Path(scenario_input_file).read_bytes()
+        scan = scan_child_elements(data, SHARD_PARENT, SHARD_TAGS) if SHARD_PLACEHOLDER not in data else None
+    if scan is None or not scan[2]:
+        return None
+
+    (root_start, root_end), (parent_start, parent_end), elements = scan
+    ranges = _shard_ranges(data, elements, workers * SHARDS_PER_WORKER)
+    count("scenario shards", len(ranges))
+
+    skeleton = []
+    position = 0
+    for start, end in ranges:
+        skeleton += [data[position:start], SHARD_PLACEHOLDER]
+        position = end
+    skeleton.append(data[position:])
+
+    with phase("parse"):
+        skeleton_root = etree.fromstring(b''.join(skeleton))
+    parent = skeleton_root.find(SHARD_PARENT)
+    placeholders = skeleton_root.xpath('//processing-instruction("scaner-shard")')
+    if (
+        parent is None or len(placeholders) != len(ranges)
+        or any(placeholder.getparent() is not parent for placeholder in placeholders)
+        or (parent.text is None and all(child.tail is None for child in parent))
+    ):
+        return None
+
+    root_tag = data[root_start + 1:root_end].split(None, 1)[0].rstrip(b'/>')
+    head = data[:root_end] + data[parent_start:parent_end]
+    tail = b'</' + SHARD_PARENT.encode() + b'></' + root_tag + b'>'
+    tasks = [(str(scenario_input_file), head, start, end, tail, plan) for start, end in ranges]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_merge_shard, tasks)
+
+        outcomes = _diff_operations(plan, skeleton_root, build_scenario_index(skeleton_root, tuple(plan["identifier_tags"])))
+        shard_contents = []
+        sharded_operations = set()
+        for content, matched in results:
+            shard_contents.append(content)
+            for number, label, element_updates, fields_unchanged in matched:
+                # The first match in document order wins in a single process merge
+                if number in sharded_operations or outcomes[number][0] is not None:
+                    return None
+                sharded_operations.add(number)
+                outcomes[number] = (label, element_updates, fields_unchanged)
+
+    if any(content is None for content in shard_contents):
+        return None
+
+    change_set = _change_set(outcomes)
+    for _, element_updates in change_set["updates"]:
+        for scenario_child, _, _, text in element_updates:
+            if scenario_child is not None:
+                scenario_child.text = text
+        count("fields updated", len(element_updates))
+
+    return change_set, skeleton_root, shard_contents
+
+def write_sharded_scenario(skeleton_root: etree._Element, shard_contents: List[bytes], scenario_output_file: str) -> None:
+    """
+    Serialize a scenario merged by merge_configuration_sharded() and save it.
+
+    Args:
+        skeleton_root: Merged root of the scenario without its shards
+        shard_contents: Serialized shards in document order
+        scenario_output_file: Path to output scenario file
+    """
+    buffer = io.BytesIO()
+    write_scenario(skeleton_root, buffer)
+    parts = buffer.getvalue().split(SHARD_PLACEHOLDER)
+    if len(parts) != len(shard_contents) + 1:
+        raise ValueError("Shard placeholders do not match the shards")
+
+    try:
+        output_path = Path(scenario_output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(output_path, 'wb') as f:
+            f.write(parts[0])
+            for content, part in zip(shard_contents, parts[1:]):
+                f.write(content)
+                f.write(part)
+
+        print(f"Saved to: {scenario_output_file}")
+    except IOError as e:
+        raise IOError(f"Failed to write output file {scenario_output_file}: {e}")
+
+def load_patch_plan(
+    configuration_file: str,
+    cache_dir: Optional[str] = DEFAULT_PLAN_CACHE_DIR,
+    identifier_tags: tuple = IDENTIFIER_TAGS
+) -> Dict[str, Any]:
+    """
+    Get the patch plan of a configuration file, compiling it only on a cache miss.
+
+    Plans are cached as JSON files named after the SHA-256 of the configuration
+    content (plus plan version and identifier tags), so an edited configuration
+    always gets a fresh plan. The cache file used is printed, and a cache that
+    cannot be written only prints a warning.
+    
+    Args:
+        configuration_file: Path to configuration XML file
+        cache_dir: Plan cache directory, None disables the cache
+        identifier_tags: Tuple of possible identifier tags
+        
+    Returns:
+        Patch plan dictionary
+        
+    Raises:
+        FileNotFoundError: If the configuration file doesn't exist
+        etree.XMLSyntaxError: If the configuration is malformed
+    """
+    path = Path(configuration_file)
+
+    if not path.exists():
+        raise FileNotFoundError(f"XML file not found: {configuration_file}")
+
+    cache_file = None
+    if cache_dir:
+        digest = hashlib.sha256(path.read_bytes())
+        digest.update(f"{PATCH_PLAN_VERSION}:{','.join(identifier_tags)}".encode())
+        cache_file = Path(cache_dir) / f"{digest.hexdigest()}.json"
+
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                plan = json.load(f)
+            print(f"Patch plan loaded from cache: {cache_file}")
+            return plan
+        except (OSError, ValueError):
+            pass
+
+    _, config_root = load_xml_tree(configuration_file)
+    with phase("compile"):
+        plan = compile_configuration(config_root, identifier_tags)
+
+    if cache_file is not None:
+        temp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(plan, f)
+            os.replace(temp_file, cache_file)
+            print(f"Patch plan cached in: {cache_file}")
+        except OSError as e:
+            if temp_file.exists():
+                temp_file.unlink()
+            print(f"Warning: Failed to cache patch plan in {cache_dir}: {e}")
+
+    return plan
+
+def merge_configuration_tree(
+    config_root: etree._Element,
+    scenario_root: etree._Element,
+    verbose: bool = True,
+    identifier_tags: tuple = IDENTIFIER_TAGS
+) -> Dict[str, Any]:
+    """
+    Merge a parsed configuration into a parsed scenario in place.
+    
+    Args:
+        config_root: Root element of the configuration
+        scenario_root: Root element of the scenario (modified in place)
+        verbose: Whether to print detailed information
+        identifier_tags: Tuple of possible identifier tags
+        
+    Returns:
+        Merge statistics, see apply_patch_plan()
+    """
+    return apply_patch_plan(compile_configuration(config_root, identifier_tags), scenario_root, verbose)
 
-def merge_configuration_to_scenario(configuration_file: str, scenario_input_file: str, scenario_output_file: str, verbose: bool = True) -> None:
+def print_merge_summary(stats: Dict[str, Any]) -> None:
+    """
+    Print the statistics returned by merge_configuration_tree() or diff_patch_plan().
+    
+    Args:
+        stats: Merge statistics or change set
+    """
+    tag_update_counts = stats["tag_update_counts"]
+    unmatched_entries = stats["unmatched_entries"]
+
+    print(f"Elements processed: {stats['elements_processed']}")
+    print(f"Elements updated: {stats['elements_updated']}")
+    print(f"Elements unchanged: {stats['elements_unchanged']}")
+    print(f"Elements unmatched: {len(unmatched_entries)}")
+
+    total_field_updates = sum(tag_update_counts.values())
+    print(f"Field updates: {total_field_updates}")
+    print(f"Fields already up to date: {stats['fields_unchanged']}")
+
+    if tag_update_counts:
+        print("\nUpdated tag summary:")
+        for tag_path in sorted(tag_update_counts):
+            print(f"- {tag_path}: {tag_update_counts[tag_path]}")
+
+    if unmatched_entries:
+        print("\nUnmatched configuration entries:")
+        for entry in unmatched_entries:
+            print(f"- {entry}")
+
+def print_updates(updates: List[Tuple[str, List[Tuple[Optional[etree._Element], Optional[str], Optional[str], Optional[str]]]]]) -> None:
+    """
+    Print the updates of a change set like a verbose merge does.
+
+    Args:
+        updates: Updates of a change set, see diff_patch_plan()
+    """
+    for label, element_updates in updates:
+        print(label)
+        for _, tag_path, old_text, text in element_updates:
+            print(f"{tag_path or 'name'}: {old_text} -> {text}\n")
+
+def write_scenario(scenario_root: etree._Element, scenario_output_file: Union[str, BinaryIO]) -> None:
+    """
+    Serialize a scenario in SCANeR format and save it.
+    
+    Args:
+        scenario_root: Root element of the scenario
+        scenario_output_file: Path to output scenario file or binary file object
+    """
+    write_xml(scenario_root, scenario_output_file, XML_DECLARATION, SELF_CLOSING_EXCEPTIONS, ENCODING)
+
+def write_scenario_changes(
+    scenario_root: etree._Element,
+    scenario_input_file: str,
+    scenario_output_file: str,
+    changes: List[Tuple[etree._Element, Optional[str]]]
+) -> None:
+    """
+    Save an edited scenario by patching its changed texts into a copy of the input file.
+
+    The input's formatting is kept byte for byte, see utils.patch_xml_text().
+    Falls back to write_scenario() if the changes cannot be patched in.
+
+    Args:
+        scenario_root: Root element of the edited scenario
+        scenario_input_file: Path to the scenario file it was parsed from
+        scenario_output_file: Path to output scenario file
+        changes: (element, previous text) list filled by apply_patch_plan()
+    """
+    if not patch_xml_text(scenario_input_file, scenario_output_file, changes):
+        print("Changes cannot be patched into the input file, serializing the whole scenario")
+        write_scenario(scenario_root, scenario_output_file)
+
+def merge_configuration(
+    configuration,
+    scenario,
+    output: Optional[str] = None,
+    verbose: bool = False,
+    plan_cache_dir: Optional[str] = DEFAULT_PLAN_CACHE_DIR,
+    identifier_tags: tuple = IDENTIFIER_TAGS
+) -> Tuple[etree._Element, Dict[str, Any]]:
+    """
+    Merge a configuration into a scenario given as files, bytes or parsed trees.
+
+    Args:
+        configuration: Configuration XML file path (patch plan loaded through the
+            cache), bytes, parsed tree or a patch plan from compile_configuration()
+        scenario: Scenario file path, bytes, binary file object or parsed tree.
+            A parsed tree is modified in place
+        output: Output scenario file path, nothing is written if None
+        verbose: Whether to print detailed information
+        plan_cache_dir: Patch plan cache directory, None disables the cache
+        identifier_tags: Tuple of possible identifier tags
+
+    Returns:
+        Tuple of (merged scenario root element, merge statistics, see apply_patch_plan())
+    """
+    if isinstance(configuration, dict):
+        plan = configuration
+    elif isinstance(configuration, (str, os.PathLike)):
+        plan = load_patch_plan(str(configuration), plan_cache_dir, identifier_tags)
+    else:
+        plan = compile_configuration(parse_xml_source(configuration)[1], identifier_tags)
+
+    _, scenario_root = parse_xml_source(scenario)
+    stats = apply_patch_plan(plan, scenario_root, verbose)
+
+    if output:
+        write_scenario(scenario_root, output)
+
+    return scenario_root, stats
+
+def merge_configuration_to_scenario(
+    configuration_file: str,
+    scenario_input_file: str,
+    scenario_output_file: str,
+    verbose: bool = True,
+    plan_cache_dir: Optional[str] = DEFAULT_PLAN_CACHE_DIR,
+    patch: bool = False,
+    dry_run: bool = False,
+    jobs: Optional[int] = 1
+) -> None:
     """
     Merge configuration XML into scenario XML.
+
+    Nothing is written if the merge changes nothing and the output is the input
+    file, as when regenerating a scenario in place.
     
     Args:
         configuration_file: Path to configuration XML file
         scenario_input_file: Path to input scenario file
         scenario_output_file: Path to output scenario file
         verbose: Whether to print detailed information
+        plan_cache_dir: Patch plan cache directory, None disables the cache
+        patch: Patch the changed texts into a copy of the input file instead of
+            serializing the scenario, see write_scenario_changes()
+        dry_run: Only print the changes the merge would make, see diff_patch_plan()
+        jobs: Number of worker processes, None for CPU count. More than one worker
+            shards the scenario, see merge_configuration_sharded(). Not used with
+            patch or dry_run
         
     Raises:
         Various exceptions from helper functions
     """
-
-    # Configuration constants
-    identifier_tags = ('name', 'id')
-    self_closing_exceptions = ['Simple', 'Model', 'ScanerNetRecorder', 'UserDataList', 'CustomData', 'Intermediate']
-    xml_declaration = '<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>\n'
-    encoding = 'UTF-8'
     
     try:
         print(f"Configuration: {configuration_file}")
-        _, config_root = load_xml_tree(configuration_file)
+        with phase("configuration"):
+            plan = load_patch_plan(configuration_file, plan_cache_dir)
         
         print(f"Scenario: {scenario_input_file}")
-        _, scenario_root = load_xml_tree(scenario_input_file)
-        
-        # Process elements
-        elements_processed = 0
-        elements_updated = 0
-        tag_update_counts: DefaultDict[str, int] = defaultdict(int)
+        sharded = None
+        if jobs != 1 and not patch and not dry_run:
+            with phase("merge"):
+                sharded = merge_configuration_sharded(plan, scenario_input_file, jobs)
+            if sharded is None:
+                print("Scenario cannot be sharded, merging in a single process")
+        if sharded is None:
+            _, scenario_root = load_xml_tree(scenario_input_file)
+
+        if dry_run:
+            print("\nComparing elements...\n")
+            with phase("diff"):
+                change_set = diff_patch_plan(plan, scenario_root)
+
+            if verbose:
+                print_updates(change_set["updates"])
+
+            print_merge_summary(change_set)
+            print("\nDry run, nothing written")
+            return
         
         print("\nProcessing elements...\n")
-        
-        for element in config_root.iter():
-            
-            # Skip non-identifiable elements
-            if not is_element_identifiable(element, identifier_tags):
-                continue
-            
-            elements_processed += 1
-            element_tag = element.tag
-            element_path = get_element_path(element, scenario_root)
-            
-            # Ground
-            if element_tag == 'Ground':
-                try:
-                    ground_element = scenario_root.find(element_path)
-                    if ground_element is not None:
-                        ground_element_name = ground_element.find('name')
-                        if ground_element_name is not None:
-                            ground_element_name_old = ground_element_name.text
-                            ground_element_name.text = element.find('name').text
-                            elements_updated += 1
-                            if verbose:
-                                print(f"Ground")
-                                print(f"name:{ground_element_name_old} -> {element.find('name').text}\n")
-                except AttributeError as e:
-                    print(f"Warning: Failed to update Ground element: {e}")
-                continue
-            
-            # Elements in scenario template
-            scenario_elements = scenario_root.findall(element_path)
-            if not scenario_elements:
-                print(f"Warning: No matching elements found in scenario for path: {element_path}")
-                continue
-            
-            # Identifier type
-            identifier_tag = get_identifier_tag(element, identifier_tags)
-            identifier_value = element.find(identifier_tag).text
-            
-            # Find by identifier and update
-            for scenario_element in scenario_elements:
-                scenario_identifier = scenario_element.find(identifier_tag)
-                
-                if scenario_identifier is None or scenario_identifier.text != identifier_value:
-                    continue
-
-                if verbose:
-                    print(f"{element_tag}({identifier_tag}={identifier_value})")
-                
-                children_updated = update_scenario_element(
-                    element,
-                    scenario_element,
-                    identifier_tag,
-                    tag_update_counts,
-                    verbose
-                )
-                
-                if children_updated > 0:
-                    elements_updated += 1
-                
-                break
+        if sharded is not None:
+            stats, skeleton_root, shard_contents = sharded
+            updates = stats.pop("updates")
+            if verbose:
+                print_updates(updates)
+        else:
+            changes = [] if patch else None
+            with phase("merge"):
+                stats = apply_patch_plan(plan, scenario_root, verbose, changes=changes)
         
         # Summary
-        print(f"Elements processed: {elements_processed}")
-        print(f"Elements updated: {elements_updated}")
-
-        total_field_updates = sum(tag_update_counts.values())
-        print(f"Field updates: {total_field_updates}")
-
-        if tag_update_counts:
-            print("\nUpdated tag summary:")
-            for tag_path in sorted(tag_update_counts):
-                print(f"- {tag_path}: {tag_update_counts[tag_path]}")
-
-        # Serialize and format XML
-        print("\nSerializing XML...")
-        xml_text = etree.tostring(
-            scenario_root,
-            encoding="unicode",
-            xml_declaration=False,
-            pretty_print=True
-        )
-        
-        xml_text = format_xml_output(xml_text, self_closing_exceptions)
-        
-        # Save output
-        save_xml(xml_text, scenario_output_file, xml_declaration, encoding)
+        print_merge_summary(stats)
+
+        if stats["elements_updated"] == 0 and os.path.exists(scenario_output_file) and os.path.samefile(scenario_input_file, scenario_output_file):
+            print("\nScenario unchanged, nothing written")
+            return
+
+        # Serialize, format and save XML
+        with phase("write"):
+            if sharded is not None:
+                print("\nSerializing XML...")
+                write_sharded_scenario(skeleton_root, shard_contents, scenario_output_file)
+            elif patch:
+                print("\nPatching XML...")
+                write_scenario_changes(scenario_root, scenario_input_file, scenario_output_file, changes)
+            else:
+                print("\nSerializing XML...")
+                write_scenario(scenario_root, scenario_output_file)
         
     except Exception as e:
         print(f"Error during processing: {type(e).__name__}: {e}")
@@ -283,6 +879,12 @@ def main():
     parser.add_argument("-i", "--input", required=True, type=str, help="Input scenario .sce file path.")
     parser.add_argument("-o", "--output", required=False, type=str, help="Output scenario .sce file path (defaults to input filename with _generated suffix).")
     parser.add_argument("-v", "--verbose", action='store_true', help="Print detailed information about changes.")
+    parser.add_argument("--plan_cache", required=False, type=str, default=DEFAULT_PLAN_CACHE_DIR, help=f"Compiled configuration cache directory (default: {DEFAULT_PLAN_CACHE_DIR}).")
+    parser.add_argument("--no_plan_cache", action='store_true', help="Always compile the configuration, do not read or write the cache (e.g. on a read-only or shared home directory).")
+    parser.add_argument("--patch", action='store_true', help="Patch the changed texts into a copy of the input file, keeping its formatting, instead of rewriting the whole scenario.")
+    parser.add_argument("--dry_run", action='store_true', help="Only compare the configuration with the scenario and print the changes a merge would make, without writing.")
+    parser.add_argument("-j", "--jobs", required=False, type=int, default=1, help="Number of worker processes, the Vehicle, Image and Sound elements are merged in shards across them (default: 1, 0 uses the CPU count). Not used with --patch or --dry_run.")
+    add_arguments(parser)
     
     args = parser.parse_args()
     
@@ -290,7 +892,9 @@ def main():
     output_file = args.output if args.output else input_file.replace(".sce", "_generated.sce")
     
     try:
-        merge_configuration_to_scenario(args.config, input_file, output_file, args.verbose)
+        plan_cache_dir = None if args.no_plan_cache else args.plan_cache
+        with instrumented("scenario_generator", args):
+            merge_configuration_to_scenario(args.config, input_file, output_file, args.verbose, plan_cache_dir, args.patch, args.dry_run, args.jobs or None)
     except Exception as e:
         print(f"Fatal error: {e}")
         import traceback
@@ -1,45 +1,55 @@
 from lxml import etree
 import argparse
+import os
+from typing import Optional, Tuple
 
+from instrumentation import add_arguments, instrumented, phase
+from scenario_vehicle_editor import compile_rules, edit_vehicles
+from utils import patch_xml_text
 
-def set_initial_speed(input_file, output_file, initial_speed, swarm_only, verbose):
+
+def set_initial_speed(input_file, output_file: Optional[str], initial_speed, swarm_only, verbose, patch: bool = False) -> Tuple[etree._Element, int]:
     """
     Set initial speed for vehicles in a scenario file.
+
+    A single rule of the vehicle editor, see scenario_vehicle_editor.py.
     
     Args:
-        input_file: Path to input .sce file
-        output_file: Path to output .sce file
+        input_file: Path to input .sce file, or its content as bytes, a binary file
+            object or a parsed tree (modified in place)
+        output_file: Path to output .sce file, nothing is written if None
         initial_speed: Initial speed value in km/h
-        swarm_only: If True, only modify swarm vehicles (vehicles with "[" in name)
+        swarm_only: If True, only modify swarm vehicles (vehicles with "[" in name),
+            otherwise all vehicles
         verbose: If True, print detailed information about changes
-    """
-    tree = etree.parse(input_file)
-    root = tree.getroot()
-
-    vehicles = root.findall('Scenario/Vehicle')
-    vehicles_changed_counter = 0
+        patch: If True and input_file is a path, patch the changed speeds into a copy
+            of it instead of rewriting the whole scenario, see utils.patch_xml_text()
 
-    for vehicle in vehicles:
-        vehicle_name = vehicle.find('name').text
-        vehicle_initial_speed = vehicle.find('initialSpeed')
-
-        if swarm_only and "[" in vehicle_name:
-            continue
-
-        if not swarm_only and "[" in vehicle_name:
-            continue
+    Returns:
+        Tuple of (scenario root element, number of vehicles changed)
+    """
+    rule = {"set": {"initialSpeed": initial_speed / 3.6}}
+    if swarm_only:
+        rule["select"] = {"swarm": True}
 
-        if vehicle_initial_speed is not None:
-            vehicle_initial_speed_value = float(vehicle_initial_speed.text) * 3.6
-            vehicle_initial_speed.text = str(initial_speed / 3.6)
-            vehicles_changed_counter += 1
+    changes = []
+    tree, stats = edit_vehicles(input_file, compile_rules([rule]), changes=changes)
+    vehicles_changed_counter = stats["vehicles_updated"]
 
-            if verbose:
-                print(f"{vehicle_initial_speed_value:.2f} > {initial_speed} {vehicle_name}")
+    if verbose:
+        for vehicle_initial_speed, old_text in changes:
+            vehicle_name = vehicle_initial_speed.getparent().findtext('name')
+            print(f"{float(old_text) * 3.6:.2f} > {initial_speed} {vehicle_name}")
 
     print(f"\nTotal vehicles with initial speed set: {vehicles_changed_counter}")
 
-    tree.write(output_file, encoding='utf-8', xml_declaration=True, pretty_print=True)
+    if output_file:
+        with phase("write"):
+            patched = patch and isinstance(input_file, (str, os.PathLike)) and patch_xml_text(input_file, output_file, changes)
+            if not patched:
+                tree.write(output_file, encoding='utf-8', xml_declaration=True, pretty_print=True)
+
+    return tree.getroot(), vehicles_changed_counter
 
 
 def main():
@@ -47,14 +57,17 @@ def main():
     parser.add_argument("-i", "--input", required=True, type=str, help="Input .sce file path.")
     parser.add_argument("-o", "--output", required=False, type=str, help="Output .sce file path (defaults to input filename with _initial_speed_set suffix).")
     parser.add_argument("-s", "--speed", required=True, type=float, help="Initial speed value in km/h.")
-    parser.add_argument("-w", "--swarm_only", action='store_true', help="Only modify non-swarm vehicles (exclude vehicles with '[' in name).")
+    parser.add_argument("-w", "--swarm_only", action='store_true', help="Only modify swarm vehicles (vehicles with '[' in name).")
     parser.add_argument("-v", "--verbose", action='store_true', help="Print detailed information about changes.")
+    parser.add_argument("--patch", action='store_true', help="Patch the changed speeds into a copy of the input file, keeping its formatting, instead of rewriting the whole scenario.")
+    add_arguments(parser)
     args = parser.parse_args()
 
     input_file = args.input
     output_file = args.output if args.output else input_file.replace(".sce", "_initial_speed_set.sce")
     
-    set_initial_speed(input_file, output_file, args.speed, args.swarm_only, args.verbose)
+    with instrumented("scenario_set_initial_speed", args):
+        set_initial_speed(input_file, output_file, args.speed, args.swarm_only, args.verbose, args.patch)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,295 @@
+"""Bulk editing of scenario Vehicle fields by rules."""
+
+from collections import defaultdict
+from pathlib import Path
+import argparse
+import csv
+import json
+import re
+from typing import Any, DefaultDict, Dict, List, Optional, Tuple
+
+from lxml import etree
+
+from instrumentation import add_arguments, count, instrumented, phase
+from utils import parse_xml_source
+from scenario_generator import write_scenario, write_scenario_changes
+
+VEHICLE_PATH = 'Scenario/Vehicle'
+
+# Rule keys and selector keys accepted by compile_rules()
+RULE_KEYS = ('select', 'set', 'table')
+SELECTOR_KEYS = ('name', 'model', 'swarm')
+
+def is_swarm_vehicle(vehicle_name: Optional[str]) -> bool:
+    """
+    Check whether a vehicle belongs to the swarm.
+
+    Args:
+        vehicle_name: Vehicle name
+
+    Returns:
+        True for swarm vehicles (vehicles with "[" in name)
+    """
+    return vehicle_name is not None and "[" in vehicle_name
+
+def load_vehicle_table(table_file: str) -> Dict[str, Dict[str, str]]:
+    """
+    Load per-vehicle field values from a CSV file.
+
+    The file needs a "name" column with vehicle names, every other column is a
+    Vehicle field. Empty cells leave the field unchanged.
+
+    Args:
+        table_file: CSV file path
+
+    Returns:
+        Dictionary mapping vehicle name to field values
+
+    Raises:
+        ValueError: If the table has no name column
+    """
+    table = dict()
+
+    with open(table_file, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or 'name' not in reader.fieldnames:
+            raise ValueError(f"Vehicle table without name column: {table_file}")
+
+        for row in reader:
+            table[row['name']] = {field: value for field, value in row.items() if field != 'name' and value}
+
+    return table
+
+def _field_text(value: Any, number: int, field: str) -> str:
+    """Convert a rule value to the text of a scenario field, JSON booleans as true/false."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return repr(value)
+    raise ValueError(f"Invalid value of {field} in vehicle rule {number}: {json.dumps(value)}")
+
+def compile_rules(rules: List[Dict[str, Any]], base_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Validate vehicle rules and prepare them for edit_vehicles().
+
+    A rule has an optional "select" with any of:
+
+    - "name": Regular expression the whole vehicle name has to match
+    - "model": Regular expression the whole modelName has to match
+    - "swarm": true for swarm vehicles only, false for the others
+
+    and "set" (field -> value for every selected vehicle) and/or "table" (CSV
+    file with per-vehicle values, see load_vehicle_table()). Fields are Vehicle
+    child tags or paths below the Vehicle, e.g. "initialSpeed". Values are
+    strings, numbers or booleans (written as true/false).
+
+    Args:
+        rules: Rules as loaded from JSON
+        base_dir: Directory that table paths are relative to
+
+    Returns:
+        Compiled rules
+
+    Raises:
+        ValueError: If a rule has unknown keys, changes nothing or sets a null,
+            list or object value
+    """
+    compiled = []
+
+    for number, rule in enumerate(rules, start=1):
+        unknown_keys = set(rule) - set(RULE_KEYS)
+        selector = rule.get('select', {})
+        unknown_keys |= set(selector) - set(SELECTOR_KEYS)
+        if unknown_keys:
+            raise ValueError(f"Unknown keys in vehicle rule {number}: {', '.join(sorted(unknown_keys))}")
+        if 'set' not in rule and 'table' not in rule:
+            raise ValueError(f"Vehicle rule {number} has neither set nor table")
+
+        table = None
+        if 'table' in rule:
+            table_file = Path(base_dir) / rule['table'] if base_dir else Path(rule['table'])
+            table = load_vehicle_table(str(table_file))
+
+        compiled.append({
+            "name": re.compile(selector['name']) if 'name' in selector else None,
+            "model": re.compile(selector['model']) if 'model' in selector else None,
+            "swarm": selector.get('swarm'),
+            "set": {field: _field_text(value, number, field) for field, value in rule.get('set', {}).items()},
+            "table": table
+        })
+
+    return compiled
+
+def load_vehicle_rules(rules_file: str) -> List[Dict[str, Any]]:
+    """
+    Load and compile vehicle rules from a JSON file with a list of rules.
+
+    Table paths are relative to the rules file. Decimal numbers are kept as
+    they are written in the file.
+
+    Args:
+        rules_file: Rules JSON file path
+
+    Returns:
+        Compiled rules, see compile_rules()
+    """
+    with open(rules_file, encoding="utf-8") as f:
+        rules = json.load(f, parse_float=str)
+
+    return compile_rules(rules, str(Path(rules_file).parent))
+
+def edit_vehicles(
+    source,
+    rules: List[Dict[str, Any]],
+    verbose: bool = False,
+    changes: Optional[List[Tuple[etree._Element, Optional[str]]]] = None
+) -> Tuple[etree._ElementTree, Dict[str, Any]]:
+    """
+    Apply vehicle rules to a scenario in one pass over its Vehicles.
+
+    Rules are applied in order, so a later rule overrides the values of an
+    earlier one for the same field. Each Vehicle's children are indexed once
+    and every field is set at most once.
+
+    Args:
+        source: Scenario file path, bytes, binary file object or parsed tree.
+            A parsed tree is modified in place
+        rules: Compiled rules, see compile_rules()
+        verbose: Whether to print every change
+        changes: List that (element, previous text) is appended to for every
+            text set, see scenario_generator.restore_changes()
+
+    Returns:
+        Tuple of (scenario tree; statistics: vehicles_processed, vehicles_updated,
+        field_update_counts (field -> count), missing_field_counts (field -> count of
+        selected vehicles without it) and unmatched_table_rows)
+    """
+    tree, root = parse_xml_source(source)
+
+    vehicles_processed = 0
+    vehicles_updated = 0
+    field_update_counts: DefaultDict[str, int] = defaultdict(int)
+    missing_field_counts: DefaultDict[str, int] = defaultdict(int)
+    table_names_matched = [set() for _ in rules]
+
+    with phase("transform"):
+        for vehicle in root.iterfind(VEHICLE_PATH):
+            vehicles_processed += 1
+
+            fields = dict()
+            for child in vehicle:
+                if isinstance(child.tag, str) and child.tag not in fields:
+                    fields[child.tag] = child
+
+            name_element = fields.get('name')
+            vehicle_name = name_element.text if name_element is not None else None
+            model_element = fields.get('modelName')
+            model_name = model_element.text if model_element is not None else None
+            swarm = is_swarm_vehicle(vehicle_name)
+
+            values = dict()
+            for rule, names_matched in zip(rules, table_names_matched):
+                if rule["swarm"] is not None and rule["swarm"] != swarm:
+                    continue
+                if rule["name"] is not None and (vehicle_name is None or not rule["name"].fullmatch(vehicle_name)):
+                    continue
+                if rule["model"] is not None and (model_name is None or not rule["model"].fullmatch(model_name)):
+                    continue
+
+                values.update(rule["set"])
+                if rule["table"] is not None and vehicle_name in rule["table"]:
+                    values.update(rule["table"][vehicle_name])
+                    names_matched.add(vehicle_name)
+
+            fields_updated = 0
+            for field, text in values.items():
+                element = vehicle.find(field) if '/' in field else fields.get(field)
+                if element is None:
+                    missing_field_counts[field] += 1
+                    continue
+
+                old_text = element.text
+                if changes is not None:
+                    changes.append((element, old_text))
+                element.text = text
+                fields_updated += 1
+                field_update_counts[field] += 1
+
+                if verbose:
+                    print(f"{vehicle_name}/{field}: {old_text} -> {text}")
+
+            if fields_updated > 0:
+                vehicles_updated += 1
+
+    count("vehicles visited", vehicles_processed)
+    count("fields updated", sum(field_update_counts.values()))
+
+    unmatched_table_rows = [
+        name
+        for rule, names_matched in zip(rules, table_names_matched) if rule["table"] is not None
+        for name in rule["table"] if name not in names_matched
+    ]
+
+    return tree, {
+        "vehicles_processed": vehicles_processed,
+        "vehicles_updated": vehicles_updated,
+        "field_update_counts": dict(field_update_counts),
+        "missing_field_counts": dict(missing_field_counts),
+        "unmatched_table_rows": unmatched_table_rows
+    }
+
+def print_edit_summary(stats: Dict[str, Any]) -> None:
+    """
+    Print the statistics returned by edit_vehicles().
+
+    Args:
+        stats: Edit statistics
+    """
+    print(f"Vehicles processed: {stats['vehicles_processed']}")
+    print(f"Vehicles updated: {stats['vehicles_updated']}")
+    print(f"Field updates: {sum(stats['field_update_counts'].values())}")
+
+    if stats["field_update_counts"]:
+        print("\nUpdated field summary:")
+        for field in sorted(stats["field_update_counts"]):
+            print(f"- {field}: {stats['field_update_counts'][field]}")
+
+    if stats["missing_field_counts"]:
+        print("\nSelected vehicles without the field:")
+        for field in sorted(stats["missing_field_counts"]):
+            print(f"- {field}: {stats['missing_field_counts'][field]}")
+
+    if stats["unmatched_table_rows"]:
+        print("\nTable rows without a selected vehicle:")
+        for name in stats["unmatched_table_rows"]:
+            print(f"- {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Edit scenario vehicle fields by rules in one pass.")
+    parser.add_argument("-i", "--input", required=True, type=str, help="Input scenario .sce file path.")
+    parser.add_argument("-o", "--output", required=False, type=str, help="Output scenario .sce file path (defaults to input filename with _edited suffix).")
+    parser.add_argument("-r", "--rules", required=True, type=str, help="Rules JSON file path.")
+    parser.add_argument("-v", "--verbose", action='store_true', help="Print detailed information about changes.")
+    parser.add_argument("--patch", action='store_true', help="Patch the changed fields into a copy of the input file, keeping its formatting, instead of rewriting the whole scenario.")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    input_file = args.input
+    output_file = args.output if args.output else input_file.replace(".sce", "_edited.sce")
+
+    with instrumented("scenario_vehicle_editor", args):
+        rules = load_vehicle_rules(args.rules)
+        changes = [] if args.patch else None
+        tree, stats = edit_vehicles(input_file, rules, args.verbose, changes)
+        print_edit_summary(stats)
+
+        with phase("write"):
+            if args.patch:
+                write_scenario_changes(tree.getroot(), input_file, output_file, changes)
+            else:
+                write_scenario(tree.getroot(), output_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Columnar (.npz) export of extracted terrain data, loadable with zero copies through mmap."""
+
+import mmap
+import struct
+import zipfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS_VERSION = 1
+
+# Fixed part of a zip local file header, followed by the file name and extra field
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5HLLLHH')
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("numpy is required for the columnar terrain format (pip install numpy)")
+
+def _codes(names: List[str], value: str) -> int:
+    """Index of value in names, appended on first use."""
+    try:
+        return names.index(value)
+    except ValueError:
+        names.append(value)
+        return len(names) - 1
+
+def build_columns(data: Dict[str, Any]) -> Dict[str, "np.ndarray"]:
+    """
+    Flatten extracted terrain data into column arrays.
+
+    Tracks, portions and lanes are stored as flat arrays in document order.
+    Portions of track t are portion_offsets[t]:portion_offsets[t + 1], lanes of
+    portion p are lane_offsets[p]:lane_offsets[p + 1] and connected tracks of
+    track t are connected_to[connected_offsets[t]:connected_offsets[t + 1]] (track
+    indices). Lane types and circulation ways are integer codes into the
+    lane_type_names and circulation_way_names tables, vehicle types are a bit
+    mask over vehicle_category_names.
+
+    Args:
+        data: Extracted data as written to JSON by rnd_extract_connections.py
+
+    Returns:
+        Dictionary mapping column name to array
+
+    Raises:
+        ValueError: If there are more than 64 vehicle categories
+    """
+    _require_numpy()
+
+    track_ids = {track_name: track_id for track_id, track_name in enumerate(data)}
+    lane_type_names: List[str] = []
+    circulation_way_names: List[str] = []
+    vehicle_category_names: List[str] = []
+
+    track_length, portion_offsets, connected_offsets, connected_to = [], [0], [0], []
+    portion_id, portion_length, portion_abscissa, lane_offsets = [], [], [], [0]
+    lane_index, lane_type, lane_circulation_way, lane_vehicle_categories = [], [], [], []
+    lane_speed_limit, lane_center = [], []
+
+    for track_name, track_data in data.items():
+        track_length.append(track_data["length"])
+        connected_to.extend(track_ids[connected] for connected in track_data["connected_to"])
+        connected_offsets.append(len(connected_to))
+
+        for key, portion_data in track_data["portions"].items():
+            portion_id.append(int(key))
+            portion_length.append(portion_data["length"])
+            portion_abscissa.append(portion_data["abscissa"])
+
+            for index, lane_data in portion_data["lanes"].items():
+                categories = 0
+                for category in lane_data["vehicle_types"]:
+                    categories |= 1 << _codes(vehicle_category_names, category)
+
+                lane_index.append(int(index))
+                lane_type.append(_codes(lane_type_names, lane_data["type"]))
+                lane_circulation_way.append(_codes(circulation_way_names, lane_data["circulationWay"]))
+                lane_vehicle_categories.append(categories)
+                lane_speed_limit.append(lane_data["speedLimit"])
+                lane_center.append(lane_data["center"])
+
+            lane_offsets.append(len(lane_index))
+
+        portion_offsets.append(len(portion_id))
+
+    if len(vehicle_category_names) > 64:
+        raise ValueError(f"Too many vehicle categories for a 64 bit mask: {len(vehicle_category_names)}")
+
+    return {
+        "version": np.array([COLUMNS_VERSION], dtype=np.int32),
+        "track_names": np.array(list(data), dtype=str),
+        "track_length": np.array(track_length, dtype=np.float64),
+        "portion_offsets": np.array(portion_offsets, dtype=np.int64),
+        "connected_offsets": np.array(connected_offsets, dtype=np.int64),
+        "connected_to": np.array(connected_to, dtype=np.int32),
+        "portion_id": np.array(portion_id, dtype=np.int64),
+        "portion_length": np.array(portion_length, dtype=np.float64),
+        "portion_abscissa": np.array(portion_abscissa, dtype=np.float64),
+        "lane_offsets": np.array(lane_offsets, dtype=np.int64),
+        "lane_index": np.array(lane_index, dtype=np.int16),
+        "lane_type": np.array(lane_type, dtype=np.uint8),
+        "lane_circulation_way": np.array(lane_circulation_way, dtype=np.uint8),
+        "lane_vehicle_categories": np.array(lane_vehicle_categories, dtype=np.uint64),
+        "lane_speed_limit": np.array(lane_speed_limit, dtype=np.float64),
+        "lane_center": np.array(lane_center, dtype=np.float64),
+        "lane_type_names": np.array(lane_type_names, dtype=str),
+        "circulation_way_names": np.array(circulation_way_names, dtype=str),
+        "vehicle_category_names": np.array(vehicle_category_names, dtype=str),
+    }
+
+def save_columns(data: Dict[str, Any], file_path: Union[str, BinaryIO]) -> None:
+    """
+    Save extracted terrain data as an uncompressed .npz file, see build_columns().
+
+    Args:
+        data: Extracted data as written to JSON by rnd_extract_connections.py
+        file_path: Output .npz file path or binary file object
+    """
+    columns = build_columns(data)
+    if hasattr(file_path, "write"):
+        np.savez(file_path, **columns)
+        return
+
+    output_path = Path(file_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Stored (not deflated) members can be mapped in place by load_columns()
+    with open(output_path, "wb") as f:
+        np.savez(f, **columns)
+
+def map_npz_members(buffer: mmap.mmap, file_path: str) -> Dict[str, "np.ndarray"]:
+    """Create read-only arrays over the .npy members of a stored .npz archive."""
+    arrays = {}
+
+    with zipfile.ZipFile(file_path) as archive:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Compressed member {info.filename} cannot be memory-mapped")
+
+            header = _ZIP_LOCAL_HEADER.unpack_from(buffer, info.header_offset)
+            name_length, extra_length = header[-2], header[-1]
+            offset = info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length
+
+            with archive.open(info) as member:
+                version = np.lib.format.read_magic(member)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(member)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(member)
+                offset += member.tell()
+
+            name = info.filename[:-len(".npy")] if info.filename.endswith(".npy") else info.filename
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset, order='F' if fortran_order else 'C')
+
+    return arrays
+
+class TerrainColumns:
+    """
+    Columnar terrain data loaded from an .npz file, see build_columns() for the layout.
+
+    Columns are available as items, e.g. columns["lane_center"].
+    """
+
+    def __init__(self, columns: Dict[str, "np.ndarray"]):
+        self.columns = columns
+        self.track_ids: Dict[str, int] = {str(name): track_id for track_id, name in enumerate(columns["track_names"])}
+
+    def __getitem__(self, name: str) -> "np.ndarray":
+        return self.columns[name]
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    def track_portions(self, track_name: str) -> slice:
+        """
+        Get the portion rows of a track.
+
+        Args:
+            track_name: Track name
+
+        Returns:
+            Slice into the portion_* columns
+        """
+        track_id = self.track_ids[track_name]
+        offsets = self.columns["portion_offsets"]
+        return slice(int(offsets[track_id]), int(offsets[track_id + 1]))
+
+    def portion_lanes(self, portion: int) -> slice:
+        """
+        Get the lane rows of a portion.
+
+        Args:
+            portion: Portion row (not portion_id)
+
+        Returns:
+            Slice into the lane_* columns
+        """
+        offsets = self.columns["lane_offsets"]
+        return slice(int(offsets[portion]), int(offsets[portion + 1]))
+
+    def connected_tracks(self, track_name: str) -> List[str]:
+        """
+        Get the tracks connected to a track.
+
+        Args:
+            track_name: Track name
+
+        Returns:
+            List of connected track names
+        """
+        track_id = self.track_ids[track_name]
+        offsets = self.columns["connected_offsets"]
+        track_names = self.columns["track_names"]
+        return [str(track_names[connected]) for connected in self.columns["connected_to"][offsets[track_id]:offsets[track_id + 1]]]
+
+    def vehicle_categories(self, lane: int) -> List[str]:
+        """
+        Decode the vehicle category mask of a lane.
+
+        Args:
+            lane: Lane row
+
+        Returns:
+            List of vehicle category names
+        """
+        categories = int(self.columns["lane_vehicle_categories"][lane])
+        return [str(name) for bit, name in enumerate(self.columns["vehicle_category_names"]) if categories >> bit & 1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Rebuild the nested structure written to JSON by rnd_extract_connections.py.
+
+        Returns:
+            Extracted data dictionary (portion and lane keys as int)
+        """
+        c = self.columns
+        data = dict()
+
+        for track_name, track_id in self.track_ids.items():
+            portions_data = dict()
+
+            for portion in range(*self.track_portions(track_name).indices(len(c["portion_id"]))):
+                lanes = dict()
+                for lane in range(*self.portion_lanes(portion).indices(len(c["lane_index"]))):
+                    lanes[int(c["lane_index"][lane])] = {
+                        "type": str(c["lane_type_names"][c["lane_type"][lane]]),
+                        "vehicle_types": self.vehicle_categories(lane),
+                        "circulationWay": str(c["circulation_way_names"][c["lane_circulation_way"][lane]]),
+                        "speedLimit": float(c["lane_speed_limit"][lane]),
+                        "center": float(c["lane_center"][lane])
+                    }
+
+                portions_data[int(c["portion_id"][portion])] = {
+                    "length": float(c["portion_length"][portion]),
+                    "abscissa": float(c["portion_abscissa"][portion]),
+                    "lanes": lanes
+                }
+
+            data[track_name] = {
+                "connected_to": self.connected_tracks(track_name),
+                "length": float(c["track_length"][track_id]),
+                "portions": portions_data
+            }
+
+        return data
+
+def load_columns(file_path: str, use_mmap: bool = True) -> TerrainColumns:
+    """
+    Load a columnar terrain file written by save_columns().
+
+    With use_mmap the file is mapped read-only and every column is a view into
+    the mapping, so nothing is copied or parsed up front and pages are read on
+    first access.
+
+    Args:
+        file_path: Input .npz file path
+        use_mmap: Map the file instead of reading the columns into memory
+
+    Returns:
+        TerrainColumns instance
+
+    Raises:
+        ValueError: If the file has an unsupported format version
+    """
+    _require_numpy()
+
+    if use_mmap:
+        with open(file_path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        columns = map_npz_members(buffer, file_path)
+    else:
+        with np.load(file_path) as archive:
+            columns = {name: archive[name] for name in archive.files}
+
+    if int(columns["version"][0]) != COLUMNS_VERSION:
+        raise ValueError(f"Unsupported columnar terrain version {int(columns['version'][0])} in {file_path}")
+
+    return TerrainColumns(columns)
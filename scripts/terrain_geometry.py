@@ -0,0 +1,179 @@
+"""Batched portion/lane geometry for terrain data extraction, vectorised with NumPy when available."""
+
+from typing import Any, Dict, List, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Scaled values closer than this to a rounding boundary are rounded by Python's round(),
+# for the rest rint(x * 100) / 100 gives the same result
+_ROUNDING_MARGIN = 1e-6
+_ROUNDING_LIMIT = 1e9
+
+class GeometryBatch:
+    """
+    Raw numeric attributes of a terrain, collected during parsing and computed in one go.
+
+    Tracks, portions and lanes are added in document order. compute() derives
+    portion lengths, track lengths and lane centers, and rounds the results to
+    two decimals exactly like round(value, 2) on the per-value computation would.
+    """
+
+    def __init__(self, use_numpy: bool = True):
+        """
+        Args:
+            use_numpy: Use NumPy if it is installed, otherwise plain Python
+        """
+        self.use_numpy = use_numpy and np is not None
+        self.portion_counts: List[int] = []
+        self.end_distances: List[Union[str, float]] = []
+        self.border_offsets: List[int] = [0]
+        self.border_distances: List[Union[str, float]] = []
+        self.lane_portions: List[int] = []
+        self.lane_indices: List[int] = []
+        self.speed_limits: List[Union[str, float]] = []
+
+    def add_track(self) -> None:
+        """Start a new track, following portions belong to it."""
+        self.portion_counts.append(0)
+
+    def add_portion(self, end_distance: Union[str, float], border_distances: Sequence[Union[str, float]]) -> int:
+        """
+        Add a portion to the current track.
+
+        Args:
+            end_distance: Portion endDistance attribute, as text or number
+            border_distances: LaneBorder distance attributes of the portion profile, as text or numbers
+
+        Returns:
+            Portion row
+        """
+        self.portion_counts[-1] += 1
+        self.end_distances.append(end_distance)
+        self.border_distances.extend(border_distances)
+        self.border_offsets.append(len(self.border_distances))
+        return len(self.end_distances) - 1
+
+    def add_lane(self, lane_index: int, speed_limit: Union[str, float]) -> int:
+        """
+        Add a lane to the current portion.
+
+        Args:
+            lane_index: Lane position in the portion profile
+            speed_limit: Lane speedLimit attribute, as text or number
+
+        Returns:
+            Lane row
+        """
+        self.lane_portions.append(len(self.end_distances) - 1)
+        self.lane_indices.append(lane_index)
+        self.speed_limits.append(speed_limit)
+        return len(self.lane_indices) - 1
+
+    def compute(self) -> Dict[str, List[Union[float, int]]]:
+        """
+        Compute the rounded geometry.
+
+        Returns:
+            Dictionary with track_length, portion_length, portion_abscissa,
+            lane_speed_limit and lane_center lists, indexed by row
+
+        Raises:
+            IndexError: If a lane has no lane border on either side
+        """
+        if self.use_numpy:
+            return self._compute_numpy()
+        return self._compute_python()
+
+    def _compute_python(self) -> Dict[str, List[Union[float, int]]]:
+        end_distances = [float(distance) for distance in self.end_distances]
+        border_distances = [float(distance) for distance in self.border_distances]
+
+        track_length, portion_length = [], []
+        portion = 0
+        for portion_count in self.portion_counts:
+            length = 0
+            last_portion_abscissa = 0
+            for end_distance in end_distances[portion:portion + portion_count]:
+                portion_length.append(end_distance - last_portion_abscissa)
+                last_portion_abscissa = end_distance
+                length += portion_length[-1]
+            track_length.append(length)
+            portion += portion_count
+
+        lane_center = []
+        for portion, lane_index in zip(self.lane_portions, self.lane_indices):
+            border = self.border_offsets[portion] + lane_index
+            if border + 1 >= self.border_offsets[portion + 1]:
+                raise IndexError(f"Lane {lane_index} of portion row {portion} has no lane borders")
+            lane_center.append((border_distances[border] + border_distances[border + 1]) / 2)
+
+        return {
+            "track_length": [round(value, 2) for value in track_length],
+            "portion_length": [round(value, 2) for value in portion_length],
+            "portion_abscissa": [round(value, 2) for value in end_distances],
+            "lane_speed_limit": [round(float(value), 2) for value in self.speed_limits],
+            "lane_center": [round(value, 2) for value in lane_center]
+        }
+
+    def _compute_numpy(self) -> Dict[str, List[Union[float, int]]]:
+        portion_counts = np.array(self.portion_counts, dtype=np.int64)
+        end_distances = np.array(self.end_distances, dtype=np.float64)
+        border_offsets = np.array(self.border_offsets, dtype=np.int64)
+        border_distances = np.array(self.border_distances, dtype=np.float64)
+        lane_portions = np.array(self.lane_portions, dtype=np.int64)
+        lane_indices = np.array(self.lane_indices, dtype=np.int64)
+
+        # Portion lengths, the first portion of every track starts at 0
+        track_starts = np.cumsum(portion_counts) - portion_counts
+        previous_ends = np.zeros_like(end_distances)
+        previous_ends[1:] = end_distances[:-1]
+        previous_ends[track_starts[portion_counts > 0]] = 0.0
+        portion_length = end_distances - previous_ends
+
+        # Track lengths are summed portion by portion like in a sequential loop,
+        # one vectorised step per portion position, so the float result is the same
+        track_of_portion = np.repeat(np.arange(len(portion_counts)), portion_counts)
+        portion_positions = np.arange(len(end_distances)) - track_starts[track_of_portion]
+        order = np.argsort(portion_positions, kind='stable')
+        bounds = np.searchsorted(portion_positions[order], np.arange(int(portion_counts.max(initial=0)) + 1))
+        track_length = np.zeros(len(portion_counts))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            portions = order[start:end]
+            track_length[track_of_portion[portions]] += portion_length[portions]
+
+        # Lane centers are midpoints of the borders on both sides of the lane
+        borders = border_offsets[lane_portions] + lane_indices
+        invalid = np.flatnonzero(borders + 1 >= border_offsets[lane_portions + 1])
+        if len(invalid):
+            lane = invalid[0]
+            raise IndexError(f"Lane {lane_indices[lane]} of portion row {lane_portions[lane]} has no lane borders")
+        lane_center = (border_distances[borders] + border_distances[borders + 1]) / 2
+
+        rounded_track_length = _round(track_length)
+        # Tracks without portions keep an integer length
+        for track in np.flatnonzero(portion_counts == 0):
+            rounded_track_length[track] = 0
+
+        return {
+            "track_length": rounded_track_length,
+            "portion_length": _round(portion_length),
+            "portion_abscissa": _round(end_distances),
+            "lane_speed_limit": _round(np.array(self.speed_limits, dtype=np.float64)),
+            "lane_center": _round(lane_center)
+        }
+
+def _round(values: "np.ndarray") -> List[Any]:
+    """Round to two decimals with the same results as round(value, 2)."""
+    with np.errstate(invalid='ignore'):
+        scaled = values * 100
+        rounded = np.rint(scaled) / 100
+        # NaN and infinity fail both comparisons and are left to round() as well
+        unsafe = ~(np.abs(scaled - np.floor(scaled) - 0.5) > _ROUNDING_MARGIN) | ~(np.abs(scaled) < _ROUNDING_LIMIT)
+
+    result = rounded.tolist()
+    for index in np.flatnonzero(unsafe):
+        result[index] = round(float(values[index]), 2)
+    return result
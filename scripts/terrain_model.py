@@ -0,0 +1,450 @@
+"""Compact in-memory model of a Terrain (.rnd) road network, with a snapshot cache for reuse between runs."""
+
+import hashlib
+import os
+import pickle
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from instrumentation import count, phase
+from rnd_stream import TRACK_PATH, iter_elements
+
+MODEL_VERSION = 1
+
+INTERSECTION_PATH = 'Network/SubNetworks/SubNetwork/RoadNetwork/Intersections/Intersection'
+
+DEFAULT_MODEL_CACHE_DIR = str(Path.home() / ".cache" / "scaner-utils" / "terrain_models")
+
+class Track:
+    """View of a track of a TerrainModel."""
+
+    __slots__ = ('model', 'row')
+
+    def __init__(self, model: "TerrainModel", row: int):
+        self.model = model
+        self.row = row
+
+    def __repr__(self) -> str:
+        return f"Track({self.name!r})"
+
+    @property
+    def name(self) -> str:
+        return self.model.columns["track_names"][self.row]
+
+    @property
+    def start_node(self) -> str:
+        return self.model.columns["track_start_nodes"][self.row]
+
+    @property
+    def end_node(self) -> str:
+        return self.model.columns["track_end_nodes"][self.row]
+
+    @property
+    def endpoints(self) -> Tuple[str, str, str]:
+        """Track name and end nodes, see road_graph.get_track_endpoints()."""
+        return self.name, self.start_node, self.end_node
+
+    @property
+    def portions(self) -> List["Portion"]:
+        offsets = self.model.columns["portion_offsets"]
+        return [Portion(self.model, row) for row in range(offsets[self.row], offsets[self.row + 1])]
+
+class Portion:
+    """View of a portion of a TerrainModel."""
+
+    __slots__ = ('model', 'row')
+
+    def __init__(self, model: "TerrainModel", row: int):
+        self.model = model
+        self.row = row
+
+    def __repr__(self) -> str:
+        return f"Portion({self.track.name!r}, {self.index})"
+
+    @property
+    def track(self) -> Track:
+        return Track(self.model, self.model.portion_track(self.row))
+
+    @property
+    def index(self) -> int:
+        """Position of the portion in its track."""
+        return self.row - self.model.columns["portion_offsets"][self.model.portion_track(self.row)]
+
+    @property
+    def name(self) -> str:
+        return self.model.columns["portion_names"][self.row]
+
+    @property
+    def end_distance(self) -> float:
+        return self.model.columns["portion_end_distance"][self.row]
+
+    @property
+    def start_distance(self) -> float:
+        """End distance of the previous portion of the track, 0 for the first one."""
+        if self.index == 0:
+            return 0.0
+        return self.model.columns["portion_end_distance"][self.row - 1]
+
+    @property
+    def lane_borders(self) -> List[float]:
+        """LaneBorder distances of the portion profile."""
+        offsets = self.model.columns["border_offsets"]
+        return self.model.columns["border_distance"][offsets[self.row]:offsets[self.row + 1]].tolist()
+
+    @property
+    def lanes(self) -> List["Lane"]:
+        offsets = self.model.columns["lane_offsets"]
+        return [Lane(self.model, row) for row in range(offsets[self.row], offsets[self.row + 1])]
+
+class Lane:
+    """View of a lane of a TerrainModel."""
+
+    __slots__ = ('model', 'row')
+
+    def __init__(self, model: "TerrainModel", row: int):
+        self.model = model
+        self.row = row
+
+    def __repr__(self) -> str:
+        portion = self.portion
+        return f"Lane({portion.track.name!r}, {portion.index}, {self.index})"
+
+    @property
+    def portion(self) -> Portion:
+        return Portion(self.model, self.model.lane_portion(self.row))
+
+    @property
+    def index(self) -> int:
+        """Position of the lane in its portion profile."""
+        return self.row - self.model.columns["lane_offsets"][self.model.lane_portion(self.row)]
+
+    @property
+    def name(self) -> str:
+        c = self.model.columns
+        return c["lane_names"][c["lane_name"][self.row]]
+
+    @property
+    def type(self) -> str:
+        c = self.model.columns
+        return c["lane_type_names"][c["lane_type"][self.row]]
+
+    @property
+    def circulation_way(self) -> str:
+        c = self.model.columns
+        return c["circulation_way_names"][c["lane_circulation_way"][self.row]]
+
+    @property
+    def speed_limit(self) -> float:
+        """Lane speedLimit, NaN if the lane has none."""
+        return self.model.columns["lane_speed_limit"][self.row]
+
+    @property
+    def vehicle_types(self) -> List[str]:
+        """Vehicle categories of the lane, split from the VehicleType categories attribute."""
+        c = self.model.columns
+        return c["vehicle_categories_names"][c["lane_vehicle_categories"][self.row]].split(",")
+
+    @property
+    def borders(self) -> Tuple[float, float]:
+        """
+        Distances of the lane borders on both sides of the lane.
+
+        Raises:
+            IndexError: If the profile has no lane border on either side
+        """
+        c = self.model.columns
+        portion = self.model.lane_portion(self.row)
+        border = c["border_offsets"][portion] + self.index
+        if border + 1 >= c["border_offsets"][portion + 1]:
+            raise IndexError(f"Lane {self.index} of portion row {portion} has no lane borders")
+        return c["border_distance"][border], c["border_distance"][border + 1]
+
+class Intersection:
+    """View of an intersection of a TerrainModel."""
+
+    __slots__ = ('model', 'row')
+
+    def __init__(self, model: "TerrainModel", row: int):
+        self.model = model
+        self.row = row
+
+    def __repr__(self) -> str:
+        return f"Intersection({self.name!r})"
+
+    @property
+    def name(self) -> str:
+        return self.model.columns["intersection_names"][self.row]
+
+    @property
+    def banned_links(self) -> List[Tuple[str, str]]:
+        """(a, b) attributes of the LanePair elements of the intersection."""
+        c = self.model.columns
+        offsets = c["banned_link_offsets"]
+        start, end = offsets[self.row], offsets[self.row + 1]
+        return list(zip(c["banned_link_a"][start:end], c["banned_link_b"][start:end]))
+
+class TerrainModel:
+    """
+    Road network of a Terrain file, stored column-wise.
+
+    Tracks, portions, lanes and intersections are rows of flat columns in
+    document order, see build_terrain_model() for the layout. Track, Portion,
+    Lane and Intersection objects are slotted views of a row, created on
+    access, so the model costs a few arrays instead of an object per element
+    and pickles to a compact snapshot.
+    """
+
+    def __init__(self, columns: Dict[str, Any]):
+        self.columns = columns
+        self.track_ids: Dict[str, int] = {track_name: track_id for track_id, track_name in enumerate(columns["track_names"])}
+        self.intersection_ids: Dict[str, int] = {name: row for row, name in enumerate(columns["intersection_names"])}
+        # Owning rows, built on first use of a portion or lane view
+        self._portion_tracks: Optional[array] = None
+        self._lane_portions: Optional[array] = None
+
+    def __len__(self) -> int:
+        return len(self.columns["track_names"])
+
+    def __iter__(self) -> Iterator[Track]:
+        return (Track(self, row) for row in range(len(self)))
+
+    def __contains__(self, track_name: str) -> bool:
+        return track_name in self.track_ids
+
+    def track(self, track_name: str) -> Track:
+        """
+        Get a track by name.
+
+        Raises:
+            KeyError: If there is no such track
+        """
+        return Track(self, self.track_ids[track_name])
+
+    def intersections(self) -> Iterator[Intersection]:
+        return (Intersection(self, row) for row in range(len(self.columns["intersection_names"])))
+
+    def intersection(self, name: str) -> Intersection:
+        """
+        Get an intersection by name.
+
+        Raises:
+            KeyError: If there is no such intersection
+        """
+        return Intersection(self, self.intersection_ids[name])
+
+    def track_endpoints(self) -> List[Tuple[str, str, str]]:
+        """(track name, start node, end node) of every track in document order, e.g. for RoadGraph.from_endpoints()."""
+        c = self.columns
+        return list(zip(c["track_names"], c["track_start_nodes"], c["track_end_nodes"]))
+
+    def portion_track(self, portion: int) -> int:
+        """Track row of a portion row."""
+        if self._portion_tracks is None:
+            self._portion_tracks = _owners(self.columns["portion_offsets"])
+        return self._portion_tracks[portion]
+
+    def lane_portion(self, lane: int) -> int:
+        """Portion row of a lane row."""
+        if self._lane_portions is None:
+            self._lane_portions = _owners(self.columns["lane_offsets"])
+        return self._lane_portions[lane]
+
+def _owners(offsets: array) -> array:
+    """Map every child row to its parent row given the parents' child offsets."""
+    owners = array('q')
+    for parent in range(len(offsets) - 1):
+        owners.extend([parent] * (offsets[parent + 1] - offsets[parent]))
+    return owners
+
+def _code(codes: Dict[str, int], names: List[str], value: str) -> int:
+    """Code of value in a name table, appended on first use."""
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(names)
+        names.append(value)
+    return code
+
+def build_terrain_model(source) -> TerrainModel:
+    """
+    Build the road network model of a terrain in one streaming pass.
+
+    Columns (rows in document order):
+
+    - track_names, track_start_nodes, track_end_nodes: Track attributes
+    - portion_offsets: Portions of track t are rows portion_offsets[t]:portion_offsets[t + 1]
+    - portion_names, portion_end_distance: Portion attributes
+    - border_offsets, border_distance: LaneBorder distances of the profile of
+      portion p are border_distance[border_offsets[p]:border_offsets[p + 1]]
+    - lane_offsets: Lanes of portion p are rows lane_offsets[p]:lane_offsets[p + 1]
+    - lane_name, lane_type, lane_circulation_way, lane_vehicle_categories: Codes
+      into the lane_names, lane_type_names, circulation_way_names and
+      vehicle_categories_names tables (the latter holds VehicleType categories
+      attributes as written)
+    - lane_speed_limit: Lane speedLimit, NaN if missing
+    - intersection_names, banned_link_offsets, banned_link_a, banned_link_b:
+      LanePair attributes of intersection i are rows
+      banned_link_offsets[i]:banned_link_offsets[i + 1]
+
+    Args:
+        source: File path, bytes, binary file object or parsed tree
+
+    Returns:
+        TerrainModel instance
+    """
+    track_names, track_start_nodes, track_end_nodes = [], [], []
+    portion_offsets = array('q', [0])
+    portion_names, portion_end_distance = [], array('d')
+    border_offsets, border_distance = array('q', [0]), array('d')
+    lane_offsets = array('q', [0])
+    lane_name, lane_type, lane_circulation_way, lane_vehicle_categories = array('i'), array('i'), array('i'), array('i')
+    lane_speed_limit = array('d')
+    intersection_names, banned_link_offsets, banned_link_a, banned_link_b = [], array('q', [0]), [], []
+
+    tables: Dict[str, Tuple[Dict[str, int], List[str]]] = {
+        name: ({}, []) for name in ("lane_names", "lane_type_names", "circulation_way_names", "vehicle_categories_names")
+    }
+    lane_names, lane_type_names, circulation_way_names, vehicle_categories_names = tables.values()
+
+    with phase("model"):
+        for element in iter_elements(source, [TRACK_PATH, INTERSECTION_PATH]):
+            attrib = element.attrib
+
+            if element.tag == 'Intersection':
+                intersection_names.append(attrib.get('name', ''))
+                for lane_pair in element.iterfind('BannedLinks/LanePair'):
+                    banned_link_a.append(lane_pair.get('a', ''))
+                    banned_link_b.append(lane_pair.get('b', ''))
+                banned_link_offsets.append(len(banned_link_a))
+                continue
+
+            track_names.append(attrib['name'])
+            track_start_nodes.append(attrib['startNode'])
+            track_end_nodes.append(attrib['endNode'])
+
+            for portion in element.iterfind('Portions/Portion'):
+                portion_names.append(portion.get('name', ''))
+                portion_end_distance.append(float(portion.attrib['endDistance']))
+
+                profile = portion.find('Profile')
+                if profile is not None:
+                    border_distance.extend(float(border.attrib['distance']) for border in profile.iterfind('LaneBorder'))
+
+                    for lane in profile.iterfind('Lane'):
+                        lane_attrib = lane.attrib
+                        vehicle_type = lane.find('VehicleType')
+                        lane_name.append(_code(*lane_names, lane_attrib.get('name', '')))
+                        lane_type.append(_code(*lane_type_names, lane_attrib.get('type', '')))
+                        lane_circulation_way.append(_code(*circulation_way_names, lane_attrib.get('circulationWay', '')))
+                        lane_vehicle_categories.append(_code(*vehicle_categories_names, vehicle_type.get('categories', '') if vehicle_type is not None else ''))
+                        lane_speed_limit.append(float(lane_attrib.get('speedLimit', 'nan')))
+
+                border_offsets.append(len(border_distance))
+                lane_offsets.append(len(lane_speed_limit))
+
+            portion_offsets.append(len(portion_end_distance))
+
+    count("tracks modelled", len(track_names))
+    count("lanes modelled", len(lane_speed_limit))
+
+    columns = {
+        "track_names": track_names,
+        "track_start_nodes": track_start_nodes,
+        "track_end_nodes": track_end_nodes,
+        "portion_offsets": portion_offsets,
+        "portion_names": portion_names,
+        "portion_end_distance": portion_end_distance,
+        "border_offsets": border_offsets,
+        "border_distance": border_distance,
+        "lane_offsets": lane_offsets,
+        "lane_name": lane_name,
+        "lane_type": lane_type,
+        "lane_circulation_way": lane_circulation_way,
+        "lane_vehicle_categories": lane_vehicle_categories,
+        "lane_speed_limit": lane_speed_limit,
+        "intersection_names": intersection_names,
+        "banned_link_offsets": banned_link_offsets,
+        "banned_link_a": banned_link_a,
+        "banned_link_b": banned_link_b,
+    }
+    columns.update((name, names) for name, (_, names) in tables.items())
+    return TerrainModel(columns)
+
+def _file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_snapshot(cache_file: Path, stamp: Dict[str, Any], columns: Dict[str, Any]) -> None:
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_file, "wb") as f:
+        pickle.dump(stamp, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(columns, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, cache_file)
+
+def load_terrain_model(rnd_file: str, cache_dir: Optional[str] = DEFAULT_MODEL_CACHE_DIR) -> TerrainModel:
+    """
+    Get the road network model of a Terrain file, building it only on a cache miss.
+
+    Snapshots are pickle files named after the SHA-256 of the absolute file
+    path. A snapshot stamped with the current size and modification time of
+    the file is loaded without reading the file. Otherwise the file content
+    is hashed: a snapshot of the same content is loaded and stamped again
+    (e.g. after a copy or touch), anything else is rebuilt.
+
+    Args:
+        rnd_file: Path to Terrain (.rnd) file
+        cache_dir: Snapshot cache directory, None disables the cache
+
+    Returns:
+        TerrainModel instance
+
+    Raises:
+        FileNotFoundError: If the terrain file doesn't exist
+    """
+    path = Path(rnd_file)
+
+    if not path.exists():
+        raise FileNotFoundError(f"Terrain file not found: {rnd_file}")
+
+    if not cache_dir:
+        return build_terrain_model(str(path))
+
+    stat = path.stat()
+    cache_file = Path(cache_dir) / f"{hashlib.sha256(str(path.resolve()).encode()).hexdigest()}.pickle"
+    stamp = {"version": MODEL_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    columns = None
+
+    with phase("model cache"):
+        try:
+            with open(cache_file, "rb") as f:
+                cached_stamp = pickle.load(f)
+                if cached_stamp["version"] == MODEL_VERSION:
+                    if (cached_stamp["size"], cached_stamp["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                        columns = pickle.load(f)
+                        count("models loaded")
+                        return TerrainModel(columns)
+
+                    stamp["sha256"] = _file_digest(str(path))
+                    if cached_stamp["sha256"] == stamp["sha256"]:
+                        columns = pickle.load(f)
+                        count("models loaded")
+        except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+            columns = None
+
+    if columns is None:
+        model = build_terrain_model(str(path))
+        columns = model.columns
+    else:
+        model = TerrainModel(columns)
+
+    stamp.setdefault("sha256", _file_digest(str(path)))
+    try:
+        _write_snapshot(cache_file, stamp, columns)
+    except OSError as e:
+        print(f"Warning: Failed to cache terrain model in {cache_dir}: {e}")
+
+    return model
@@ -1,9 +1,29 @@
 """Utility functions for XML processing and manipulation."""
 
 from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+from xml.sax.saxutils import escape
 from lxml import etree
+import mmap
+import os
 import re
 
+from instrumentation import count, phase
+
+# Scenario root start tag as lxml writes it, SCANeR puts the version first,
+# the same rewrite as in format_xml_output()
+_ROOT_START_TAG = re.compile(rb'<sce\s+xmlns:xsi="([^"]+)"\s+version="([^"]+)">')
+
+# Encoding of an XML declaration, and the encodings that byte offsets can be patched in
+_DECLARED_ENCODING = re.compile(rb'<\?xml[^>]*?encoding=["\']([^"\']+)["\']')
+_PATCHABLE_ENCODINGS = (b'utf-8', b'utf8', b'us-ascii', b'ascii')
+
+# Markup skipped while scanning for start tags, as it can hold text looking like tags
+_SKIPPED_MARKUP = rb'<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<!DOCTYPE[^\[>]*(?:\[.*?\])?\s*>'
+
+# Rest of a start tag, '>' may appear in quoted attribute values
+_START_TAG_END = re.compile(rb'(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
 def load_xml_tree(file_path: str) -> tuple[etree._ElementTree, etree._Element]:
     """
     Load and parse an XML file.
@@ -24,12 +44,47 @@ def load_xml_tree(file_path: str) -> tuple[etree._ElementTree, etree._Element]:
         raise FileNotFoundError(f"XML file not found: {file_path}")
     
     try:
-        tree = etree.parse(str(path))
+        with phase("parse"):
+            tree = etree.parse(str(path))
         root = tree.getroot()
         return tree, root
     except etree.XMLSyntaxError as e:
         raise etree.XMLSyntaxError(f"Invalid XML in {file_path}: {e}")
 
+def parse_xml_source(source) -> tuple[etree._ElementTree, etree._Element]:
+    """
+    Get the tree and root of XML given as a file path, bytes, file object or parsed tree.
+
+    Parsed trees and elements are returned as they are, not copied.
+
+    Args:
+        source: XML file path, bytes, binary file object, parsed tree or root element
+
+    Returns:
+        Tuple of (tree, root) elements
+
+    Raises:
+        FileNotFoundError: If file doesn't exist
+        etree.XMLSyntaxError: If XML is malformed
+    """
+    if isinstance(source, etree._ElementTree):
+        return source, source.getroot()
+    if isinstance(source, etree._Element):
+        return source.getroottree(), source
+    if isinstance(source, (bytes, bytearray)):
+        with phase("parse"):
+            root = etree.fromstring(bytes(source))
+        return root.getroottree(), root
+    if hasattr(source, 'read'):
+        with phase("parse"):
+            tree = etree.parse(source)
+        return tree, tree.getroot()
+    return load_xml_tree(source)
+
+def _exceptions_pattern(self_closing_exceptions: list) -> str:
+    """Regex alternation of the tags that stay self-closing."""
+    return '|'.join(re.escape(tag) for tag in self_closing_exceptions)
+
 def format_xml_output(xml_text: str, self_closing_exceptions: list) -> str:
     """
     Format XML output with custom rules.
@@ -50,9 +105,8 @@ def format_xml_output(xml_text: str, self_closing_exceptions: list) -> str:
     )
     
     # Convert self-closing tags to full tags (except for exceptions)
-    exceptions_pattern = '|'.join(re.escape(tag) for tag in self_closing_exceptions)
     xml_text = re.sub(
-        rf"<(?!{exceptions_pattern}\b)([A-Za-z_][\w:.-]*)(\s[^<>]*?)?\/>",
+        rf"<(?!{_exceptions_pattern(self_closing_exceptions)}\b)([A-Za-z_][\w:.-]*)(\s[^<>]*?)?\/>",
         lambda m: f"<{m.group(1)}{m.group(2) or ''}></{m.group(1)}>",
         xml_text
     )
@@ -83,3 +137,353 @@ def save_xml(content: str, file_path: str, declaration: str, encoding: str = 'UT
         print(f"Saved to: {file_path}")
     except IOError as e:
         raise IOError(f"Failed to write output file {file_path}: {e}")
+
+
+class _ScenarioStream:
+    """
+    Binary file wrapper that lays out lxml's serializer output in SCANeR format.
+
+    Moves the version of the sce root ahead of its xmlns:xsi declaration, and drops
+    the top-level comments/PIs around the root element that a whole-document
+    write includes.
+    """
+
+    def __init__(self, file, skip_head: int, skip_tail: int):
+        self.file = file
+        self.skip_head = skip_head
+        self.skip_tail = skip_tail
+        self.head = b''
+        self.tail = b''
+
+    def write(self, data: bytes) -> None:
+        if self.head is not None:
+            self.head += data
+            start_tag_end = self.head.find(b'>', self.skip_head)
+            if start_tag_end < 0:
+                return
+            start_tag = self.head[self.skip_head:start_tag_end + 1]
+            data = _ROOT_START_TAG.sub(rb'<sce version="\2" xmlns:xsi="\1">', start_tag, count=1) + self.head[start_tag_end + 1:]
+            self.head = None
+
+        # Hold back what could still be the trailing siblings of the root
+        data = self.tail + data
+        keep = min(self.skip_tail, len(data))
+        self.file.write(data[:len(data) - keep])
+        self.tail = data[len(data) - keep:]
+
+def _explicit_empty_elements(root: etree._Element, axis: str, self_closing_exceptions: list) -> List[etree._Element]:
+    """Empty elements on an XPath axis of root that get an explicit close tag."""
+    # Same exception matching as format_xml_output(), exact names are filtered out by XPath already
+    closes_explicitly = re.compile(rf"(?!{_exceptions_pattern(self_closing_exceptions)}\b)").match
+    exact_exceptions = ' or '.join(f"self::{tag}" for tag in self_closing_exceptions) or 'false()'
+    return [
+        empty for empty in root.xpath(f"{axis}::*[not(node())][not({exact_exceptions})]")
+        if closes_explicitly(empty.prefix + ':' + etree.QName(empty).localname if empty.prefix else empty.tag)
+    ]
+
+def write_xml(
+    root: etree._Element,
+    file_path: Union[str, BinaryIO],
+    declaration: str,
+    self_closing_exceptions: list,
+    encoding: str = 'UTF-8'
+) -> None:
+    """
+    Serialize an element tree straight to file in SCANeR's scenario format.
+
+    Produces the same output as pretty-printing with lxml, passing the result
+    through format_xml_output() and saving it with save_xml(), without building
+    the document string or running regexes over it: the version of the sce root
+    is written ahead of its xmlns:xsi declaration and empty elements get
+    explicit close tags, except for self_closing_exceptions. lxml's serializer writes to the file in
+    chunks.
+    
+    Args:
+        root: Root element to serialize
+        file_path: Output file path or binary file object
+        declaration: XML declaration string
+        self_closing_exceptions: List of tags that should remain self-closing
+        encoding: File encoding
+        
+    Raises:
+        IOError: If file cannot be written
+    """
+    explicit_empty = _explicit_empty_elements(root, "descendant-or-self", self_closing_exceptions)
+
+    # Top-level siblings of the root are written by lxml, one per line
+    skip_head = sum(len(etree.tostring(sibling, encoding=encoding)) + 1 for sibling in root.itersiblings(preceding=True))
+    skip_tail = sum(len(etree.tostring(sibling, encoding=encoding)) + 1 for sibling in root.itersiblings())
+
+    def write_document(f: BinaryIO) -> None:
+        f.write(declaration.encode(encoding))
+        stream = _ScenarioStream(f, skip_head, skip_tail)
+        with phase("serialize"):
+            etree.ElementTree(root).write(stream, encoding=encoding, xml_declaration=False, pretty_print=True)
+
+    try:
+        # An empty text node makes lxml write an explicit close tag
+        for empty in explicit_empty:
+            empty.text = ''
+
+        if hasattr(file_path, 'write'):
+            write_document(file_path)
+            return
+
+        output_path = Path(file_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(output_path, 'wb') as f:
+            write_document(f)
+            
+        print(f"Saved to: {file_path}")
+    except IOError as e:
+        raise IOError(f"Failed to write output file {file_path}: {e}")
+    finally:
+        for empty in explicit_empty:
+            empty.text = None
+
+
+def serialize_children(
+    parent: etree._Element,
+    self_closing_exceptions: list,
+    encoding: str = 'UTF-8'
+) -> Optional[bytes]:
+    """
+    Serialize the content of an element the way write_xml() writes it within a whole document.
+
+    lxml indents the children of an element without text nodes according to
+    their depth in the document, and writes those of an element with text
+    nodes (such as the whitespace of an indented file) as they are. Only the
+    latter does not depend on the rest of the document.
+
+    Args:
+        parent: Element whose text, children and their tails are serialized
+        self_closing_exceptions: List of tags that should remain self-closing
+        encoding: Output encoding
+
+    Returns:
+        Serialized content, None if parent has no text nodes
+    """
+    if parent.text is None and all(child.tail is None for child in parent):
+        return None
+
+    explicit_empty = _explicit_empty_elements(parent, "descendant", self_closing_exceptions)
+    try:
+        for empty in explicit_empty:
+            empty.text = ''
+        serialized = etree.tostring(parent, encoding=encoding, pretty_print=True, with_tail=False)
+    finally:
+        for empty in explicit_empty:
+            empty.text = None
+
+    # Strip the parent's own start and end tags
+    start_tag_end = _START_TAG_END.match(serialized, 1).end()
+    return serialized[start_tag_end:serialized.rindex(b'</')]
+
+def scan_child_elements(data: bytes, parent_tag: str, tags: Sequence[str]) -> Optional[Tuple[Tuple[int, int], Tuple[int, int], List[Tuple[int, int]]]]:
+    """
+    Find the byte ranges of the children with the given tags of a child of the root, without parsing.
+
+    Only the root, parent and child tags are looked at, skipping comments,
+    CDATA sections, processing instructions and the DOCTYPE, so the scan runs
+    at regex speed. Elements with those tags nested in other elements are
+    taken as nested in the parent, callers have to check the result.
+
+    Args:
+        data: XML document
+        parent_tag: Tag of the root's child that holds the elements, e.g. 'Scenario'
+        tags: Tags of the elements to find
+
+    Returns:
+        Tuple of ((start, end) of the root start tag, (start, end) of the parent
+        start tag, (start, end) of every element found in document order), None
+        if the document has no such parent, more than one, or unbalanced tags
+    """
+    root_match = re.compile(_SKIPPED_MARKUP + rb'|<([^\s/>!?]+)', re.DOTALL)
+    root_tag = None
+    for match in root_match.finditer(data):
+        if match.group(1) is not None:
+            root_tag = match.group(1)
+            break
+    if root_tag is None:
+        return None
+
+    names = [root_tag] + [tag.encode('utf-8') for tag in (parent_tag, *tags)]
+    tag_pattern = re.compile(
+        _SKIPPED_MARKUP + rb'|<(/?)(' + b'|'.join(re.escape(name) for name in dict.fromkeys(names)) + rb')(?=[\s/>])',
+        re.DOTALL
+    )
+    parent_name, child_names = names[1], set(names[2:])
+
+    root_span = parent_span = None
+    elements = []
+    stack = []
+    element_start = None
+
+    for match in tag_pattern.finditer(data, match.start()):
+        tag = match.group(2)
+        if tag is None:
+            continue
+
+        if match.group(1):
+            end = data.find(b'>', match.end()) + 1
+            if not end or not stack or stack[-1] != tag:
+                return None
+            stack.pop()
+            if len(stack) == 2 and tag in child_names and element_start is not None:
+                elements.append((element_start, end))
+                element_start = None
+            continue
+
+        tag_end = _START_TAG_END.match(data, match.end())
+        if tag_end is None:
+            return None
+        end = tag_end.end()
+        self_closing = data[end - 2:end - 1] == b'/'
+
+        if not stack:
+            if root_span is not None:
+                return None
+            root_span = (match.start(), end)
+        elif len(stack) == 1 and tag == parent_name:
+            if parent_span is not None:
+                return None
+            parent_span = (match.start(), end)
+        elif len(stack) == 2 and stack[1] == parent_name and tag in child_names:
+            if self_closing:
+                elements.append((match.start(), end))
+            else:
+                element_start = match.start()
+
+        if not self_closing:
+            stack.append(tag)
+
+    if stack or parent_span is None:
+        return None
+    return root_span, parent_span, elements
+
+def _matches_source_text(raw_text: bytes, text: Optional[str]) -> bool:
+    """Check that raw text between tags parses to the given element text."""
+    if not raw_text:
+        return not text
+    try:
+        return etree.fromstring(b'<text>' + raw_text + b'</text>').text == text
+    except etree.XMLSyntaxError:
+        return False
+
+def patch_xml_text(
+    source_file: str,
+    file_path: str,
+    changes: List[Tuple[etree._Element, Optional[str]]]
+) -> bool:
+    """
+    Save a copy of a parsed XML file with the changed element texts spliced in.
+
+    Only the changed texts are written anew, every other byte is copied from
+    the memory-mapped source, so the document is not serialized again and its
+    formatting is kept as it is. The source is scanned once for the start tags
+    of the changed elements' tags, skipping comments, CDATA sections and
+    processing instructions, and the nth start tag of a tag is taken to be the
+    nth element with that tag. The source text after it has to match the text
+    the element was parsed with.
+
+    Args:
+        source_file: XML file the elements were parsed from
+        file_path: Output file path, can be the source file
+        changes: (element, previous text) list of the text changes, oldest first,
+            see scenario_generator.apply_patch_plan()
+
+    Returns:
+        False if the source is not UTF-8 or a change cannot be located, nothing
+        is written then and the tree has to be serialized instead
+
+    Raises:
+        IOError: If file cannot be written
+    """
+    # The oldest previous text of an element is its source text
+    source_texts: Dict[etree._Element, Optional[str]] = dict()
+    for element, text in changes:
+        source_texts.setdefault(element, text)
+    edits = [(element, text) for element, text in source_texts.items() if element.text != text]
+
+    if any(not isinstance(element.tag, str) or element.tag.startswith('{') for element, _ in edits):
+        return False
+
+    with open(source_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with buffer, phase("patch"):
+        declaration = _DECLARED_ENCODING.match(buffer[:256].lstrip(b'\xef\xbb\xbf'))
+        if declaration and declaration.group(1).lower() not in _PATCHABLE_ENCODINGS:
+            return False
+
+        # Start tags of the edited tags in document order, the nth one of a tag
+        # belongs to the nth element with that tag in the tree
+        tags = sorted({element.tag for element, _ in edits})
+        start_tags: Dict[str, List[Tuple[int, int]]] = {tag: [] for tag in tags}
+        if tags:
+            start_tag_pattern = re.compile(
+                _SKIPPED_MARKUP + rb'|<(' + b'|'.join(re.escape(tag.encode('utf-8')) for tag in tags) + rb')(?=[\s/>])[^<>]*>',
+                re.DOTALL
+            )
+            for match in start_tag_pattern.finditer(buffer):
+                if match.group(1) is not None:
+                    start_tags[match.group(1).decode('utf-8')].append(match.span())
+
+        edited = set(source_texts)
+        element_numbers: Dict[etree._Element, int] = dict()
+        for tag in tags:
+            number = -1
+            for number, element in enumerate(edits[0][0].getroottree().iter(tag)):
+                if element in edited:
+                    element_numbers[element] = number
+            if number + 1 != len(start_tags[tag]):
+                return False
+
+        splices = []
+        for element, source_text in edits:
+            tag_start, tag_end = start_tags[element.tag][element_numbers[element]]
+            text = escape(element.text or '').replace('\r', '&#13;').encode('utf-8')
+
+            if buffer[tag_end - 2:tag_end] == b'/>':
+                # Self-closing element, the explicit close tag is added
+                if source_text:
+                    return False
+                splices.append((tag_end - 2, tag_end, b'>' + text + b'</' + element.tag.encode('utf-8') + b'>'))
+                continue
+
+            text_end = buffer.find(b'<', tag_end)
+            if text_end < 0 or not _matches_source_text(buffer[tag_end:text_end], source_text):
+                return False
+            splices.append((tag_end, text_end, text))
+
+        splices.sort()
+        if any(start < previous_end for (_, previous_end, _), (start, _, _) in zip(splices, splices[1:])):
+            return False
+
+        output_path = Path(file_path)
+        temp_file = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+        try:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Written aside and moved over the output, which may be the mapped source
+            with open(temp_file, 'wb') as f, memoryview(buffer) as source:
+                position = 0
+                for start, end, text in splices:
+                    f.write(source[position:start])
+                    f.write(text)
+                    position = end
+                f.write(source[position:])
+            if output_path.exists():
+                os.chmod(temp_file, output_path.stat().st_mode & 0o7777)
+            os.replace(temp_file, output_path)
+        except IOError as e:
+            if temp_file.exists():
+                temp_file.unlink()
+            raise IOError(f"Failed to write output file {file_path}: {e}")
+
+    count("texts patched", len(splices))
+    print(f"Saved to: {file_path}")
+    return True
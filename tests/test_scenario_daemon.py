@@ -0,0 +1,76 @@
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from scenario_daemon import DocumentCache, ScenarioTools, create_server
+
+
+class ScenarioDaemonRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = create_server(ScenarioTools(DocumentCache(1024 * 1024)), "127.0.0.1", 0)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.directory.cleanup()
+
+    def post(self, path, body, headers):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        try:
+            connection.request("POST", path, body=json.dumps(body), headers=headers)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def merge_request(self):
+        return {
+            "config": os.path.join(self.directory.name, "configuration.xml"),
+            "input": os.path.join(self.directory.name, "scenario.sce"),
+            "output": os.path.join(self.directory.name, "output.sce"),
+        }
+
+    def test_text_plain_post_is_refused(self):
+        request = self.merge_request()
+        status, body = self.post("/merge", request, {"Content-Type": "text/plain"})
+
+        self.assertEqual(status, 415)
+        self.assertIn("application/json", body["error"])
+        self.assertFalse(os.path.exists(request["output"]))
+
+    def test_text_plain_clear_is_refused(self):
+        status, _ = self.post("/clear", {}, {"Content-Type": "text/plain"})
+        self.assertEqual(status, 415)
+
+    def test_cross_origin_post_is_refused(self):
+        request = self.merge_request()
+        status, _ = self.post("/merge", request, {"Content-Type": "application/json", "Origin": "https://example.com"})
+
+        self.assertEqual(status, 403)
+        self.assertFalse(os.path.exists(request["output"]))
+
+    def test_non_loopback_host_is_refused(self):
+        status, _ = self.post("/clear", {}, {"Content-Type": "application/json", "Host": "attacker.example:8765"})
+        self.assertEqual(status, 403)
+
+    def test_json_post_is_served(self):
+        status, body = self.post("/clear", {}, {"Content-Type": "application/json; charset=utf-8"})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()